@@ -1,31 +1,42 @@
+import time
+_import_started = time.perf_counter()
 
 import numpy as np
-import pandas as pd
-from sklearn.preprocessing import StandardScaler, LabelEncoder, RobustScaler
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, r2_score, mean_squared_error
-from sklearn.ensemble import RandomForestRegressor
-import tensorflow as tf
-from tensorflow.keras.models import Sequential, Model, load_model
-from tensorflow.keras.layers import LSTM, Dense, Dropout, BatchNormalization, Input, Concatenate
-from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCheckpoint
-from tensorflow.keras.optimizers import AdamW
-from tensorflow.keras.regularizers import l1_l2
 import pickle
-import joblib
 from datetime import datetime, timedelta
 import warnings
 import logging
 import os
-from flask import Flask, request, jsonify
+import io
+import json
+import random
+import threading
+import itertools
+from collections import namedtuple
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import sqlite3
+
+from company_aggregates import DEFAULT_COMPANY_FEATURES
+from feature_cache import FeatureVectorCache
+from feature_spec import (compile_features, request_columns, company_history, company_history_columns,
+                          COMPANY_HISTORY_VALUES, FEATURE_DTYPE, REQUEST_FIELDS)
+from risk_index import RiskIndex, RiskEntry, RISK_LEVELS, TRENDS, risk_assessment
+from history_store import create_history_store
+from history_ingest import detect_format, ingest_history
+from numpy_inference import NumpyPaymentModel, export_numpy_weights, DEFAULT_SAMPLE_BATCH_SIZE
+from micro_batching import MicroBatcher
+from model_registry import ModelRegistry
+from metrics import LATENCY_BUCKETS_S, MetricsRegistry, StageTimer
+from training_jobs import TrainingJobManager, STAGED_MODEL, STAGED_ARTIFACTS, STAGED_NPZ
+
+# TensorFlow, pandas and sklearn's training modules are imported lazily by
+# load_inference_model (Keras engine) and train_model, so a serving worker
+# only pays for what it uses.
 
 warnings.filterwarnings('ignore')
 
-# Set random seeds for reproducibility
-np.random.seed(42)
-tf.random.set_seed(42)
+# Startup cost breakdown, in seconds
+startup_report = {'import': time.perf_counter() - _import_started}
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -41,701 +52,744 @@ sequence_scaler = None
 static_scaler = None
 model_artifacts = None
 
-# Model file paths
-MODEL_H5_PATH = 'payment_prediction_model.h5'
-MODEL_PKL_PATH = 'payment_prediction_model.pkl'
+# A loaded model version with its scalers and artifacts; numpy_model is its
+# NumpyPaymentModel, which draws Monte-Carlo dropout samples and scores
+# scenario sweeps for either engine
+ServingModel = namedtuple('ServingModel', ['model', 'sequence_scaler', 'static_scaler', 'artifacts', 'version',
+                                           'numpy_model'])
 
-# Simple in-memory database for company payment history (for demo purposes)
-company_history_db = {}
+# The ServingModel predictions use, swapped as one reference so a prediction
+# never mixes a new model with old scalers; requests take it once and finish
+# on it even if another version is activated meanwhile
+active_model = None
 
-def load_existing_model():
-    """Load existing model artifacts if available"""
-    global ml_model, sequence_scaler, static_scaler, model_artifacts
-    
-    try:
-        if os.path.exists(MODEL_H5_PATH) and os.path.exists(MODEL_PKL_PATH):
-            logger.info("Loading existing model artifacts...")
-            
-            # Load the TensorFlow model
-            ml_model = load_model(MODEL_H5_PATH)
-            
-            # Load the artifacts
-            with open(MODEL_PKL_PATH, 'rb') as f:
-                model_artifacts = pickle.load(f)
-            
-            sequence_scaler = model_artifacts['sequence_scaler']
-            static_scaler = model_artifacts['static_scaler']
-            
-            logger.info("✅ Model loaded successfully from existing files!")
-            return True
-    except Exception as e:
-        logger.error(f"Error loading existing model: {str(e)}")
-    
-    return False
+# Versioned model store with the current-version pointer (see model_registry.py)
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'model_registry')
+model_registry = ModelRegistry(MODEL_REGISTRY_DIR)
 
-def get_company_payment_history(company_name):
-    """Get company payment history from in-memory database"""
-    return company_history_db.get(company_name, [])
+# Fixed model file paths used before the registry; files found here are
+# imported as the registry's first version
+MODEL_H5_PATH = 'payment_prediction_model.h5'
+MODEL_PKL_PATH = 'payment_prediction_model.pkl'
+MODEL_NPZ_PATH = 'payment_prediction_model.npz'
 
-def add_company_payment_record(company_name, record):
-    """Add a payment record to company history"""
-    if company_name not in company_history_db:
-        company_history_db[company_name] = []
-    company_history_db[company_name].append(record)
+# Serving engine: 'keras' (TensorFlow) or 'numpy' (NumpyPaymentModel over MODEL_NPZ_PATH)
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'keras')
 
-def calculate_company_behavioral_features(company_name):
-    """Calculate advanced company behavioral features from actual history"""
-    history = get_company_payment_history(company_name)
-    
-    if not history:
-        # Default values for new companies
-        return {
-            'efficiency_3': 0.7,
-            'efficiency_7': 0.7, 
-            'efficiency_all': 0.7,
-            'velocity_avg': 1.0,
-            'consistency': 0.5,
-            'trend': 0.0,
-            'frequency': 0.1,
-            'days_since_last': 30
-        }
-    
-    # Sort by date
-    history = sorted(history, key=lambda x: x.get('date', datetime.now()))
-    
-    # Recent 3 records efficiency
-    recent_3 = history[-3:] if len(history) >= 3 else history
-    efficiency_3 = np.mean([r.get('payment_efficiency', 0.7) for r in recent_3])
-    
-    # Recent 7 records efficiency  
-    recent_7 = history[-7:] if len(history) >= 7 else history
-    efficiency_7 = np.mean([r.get('payment_efficiency', 0.7) for r in recent_7])
-    
-    # All time efficiency
-    efficiency_all = np.mean([r.get('payment_efficiency', 0.7) for r in history])
-    
-    # Payment velocity (days to payment / log(amount))
-    velocities = []
-    for r in history:
-        amount = r.get('amount', 50000)
-        days = r.get('days_to_payment', 30)
-        velocity = days / (np.log(amount) + 1)
-        velocities.append(velocity)
-    velocity_avg = np.mean(velocities) if velocities else 1.0
-    
-    # Consistency (inverse of standard deviation)
-    efficiencies = [r.get('payment_efficiency', 0.7) for r in history]
-    consistency = 1 / (1 + np.std(efficiencies)) if len(efficiencies) > 1 else 0.5
-    
-    # Trend calculation (slope of recent efficiency)
-    if len(recent_7) >= 3:
-        x = np.arange(len(recent_7))
-        y = [r.get('payment_efficiency', 0.7) for r in recent_7]
-        trend = np.polyfit(x, y, 1)[0] if len(y) > 1 else 0.0
-    else:
-        trend = 0.0
-    
-    # Payment frequency (records per month)
-    if len(history) > 1:
-        first_date = history[0].get('date', datetime.now())
-        last_date = history[-1].get('date', datetime.now())
-        days_span = (last_date - first_date).days + 1
-        frequency = len(history) / max(days_span / 30, 1)
-    else:
-        frequency = 0.1
-    
-    # Days since last payment
-    if history:
-        last_date = history[-1].get('date', datetime.now())
-        days_since_last = min(365, (datetime.now() - last_date).days)
-    else:
-        days_since_last = 30
-    
-    return {
-        'efficiency_3': efficiency_3,
-        'efficiency_7': efficiency_7,
-        'efficiency_all': efficiency_all,
-        'velocity_avg': velocity_avg,
-        'consistency': consistency,
-        'trend': trend,
-        'frequency': frequency,
-        'days_since_last': days_since_last
-    }
+# Company payment history backend: 'memory' (demo dict) or 'sqlite' (persistent)
+HISTORY_BACKEND = os.environ.get('HISTORY_BACKEND', 'memory')
+HISTORY_DB_PATH = os.environ.get('HISTORY_DB_PATH', 'payment_history.db')
+history_store = create_history_store(HISTORY_BACKEND, HISTORY_DB_PATH)
 
-def generate_improved_synthetic_data():
-    """Generate synthetic invoice data with stronger continuous patterns"""
+# Per-company feature vectors cached on (company, history version)
+FEATURE_CACHE_SIZE = int(os.environ.get('FEATURE_CACHE_SIZE', 10000))
+feature_cache = FeatureVectorCache(FEATURE_CACHE_SIZE)
 
-    num_customers = 200
-    num_invoices = 80000
+# Risk scores of every company with history, ordered for top-k queries
+risk_index = RiskIndex(history_store)
 
-    industries = ['IT', 'Finance', 'Healthcare', 'Retail', 'Manufacturing']
-    locations = ['Mumbai', 'Delhi', 'Bangalore', 'Chennai', 'Hyderabad']
+# Fraction of requests whose per-request log line is written
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 0.01))
 
-    def assign_segment(score):
-        if score > 720:
-            return 'Reliable'
-        elif score < 650:
-            return 'At-risk'
-        else:
-            return 'Average'
-
-    # Create customers with more realistic distributions
-    customers = pd.DataFrame({
-        'CustomerID': range(1, num_customers + 1),
-        'Company': [f'Company_{i + 1}' for i in range(num_customers)],
-        'Industry': np.random.choice(industries, num_customers),
-        'CustomerCreditScore': np.random.normal(700, 50, num_customers).astype(int),
-        'Location': np.random.choice(locations, num_customers)
-    })
-    customers['Segment'] = customers['CustomerCreditScore'].apply(assign_segment)
-
-    # More dynamic market conditions
-    market_conditions = {}
-    payment_urgency = {}
-    for month in range(1, 13):
-        market_conditions[month] = 1 + 0.2 * np.sin(2 * np.pi * month / 12) + np.random.normal(0, 0.05)
-        payment_urgency[month] = np.random.beta(2, 5)
-
-    payment_methods = ['Bank Transfer', 'Credit Card', 'Cheque', 'UPI']
-    invoices = []
-    company_payment_history = {f'Company_{i + 1}': [] for i in range(num_customers)}
-
-    for i in range(num_invoices):
-        cust = customers.sample(1).iloc[0]
-        month = np.random.randint(1, 13)
-        day = np.random.randint(1, 28)
-        company = cust['Company']
-        history = company_payment_history[company]
-
-        # Invoice details
-        invoice_id = 10001 + i
-        invoice_date = pd.Timestamp(year=2024, month=month, day=day)
-
-        payment_due_days = np.random.choice([15, 30, 45, 60, 90], p=[0.1, 0.4, 0.3, 0.15, 0.05])
-        payment_due_date = invoice_date + pd.Timedelta(days=payment_due_days)
-
-        base_amount = np.random.lognormal(9.5, 1.2)
-        seasonal_multiplier = 1 + 0.3 * np.sin(2 * np.pi * month / 12)
-        invoice_amount = round(base_amount * seasonal_multiplier * market_conditions[month], 2)
-
-        payment_method = np.random.choice(payment_methods)
-
-        # Payment prediction logic
-        credit_factor = (cust['CustomerCreditScore'] - 600) / 200
-        base_payment_tendency = payment_due_days * (1.2 - credit_factor)
-
-        industry_adjustments = {
-            'IT': lambda m: 2 * np.sin(2 * np.pi * m / 12),
-            'Finance': lambda m: -3 + 5 * payment_urgency[m],
-            'Healthcare': lambda m: 1 + 2 * np.cos(2 * np.pi * m / 6),
-            'Retail': lambda m: -5 if m in [11, 12] else 3,
-            'Manufacturing': lambda m: 4 * np.sin(2 * np.pi * (m - 3) / 12)
-        }
+# Staging area for background training jobs
+TRAINING_JOBS_DIR = os.environ.get('TRAINING_JOBS_DIR', 'training_runs')
 
-        industry_adj = industry_adjustments[cust['Industry']](month)
-        amount_factor = np.log(invoice_amount / 50000) * 2
+# Seconds between checks for a current version activated by another worker process
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 5))
 
-        method_effects = {
-            'Bank Transfer': np.random.normal(-2, 1),
-            'Credit Card': np.random.normal(-1, 1.5),
-            'Cheque': np.random.normal(3, 2),
-            'UPI': np.random.normal(-0.5, 1)
-        }
-        method_adj = method_effects[payment_method]
-
-        location_factors = {
-            'Mumbai': np.random.normal(-1, 2),
-            'Delhi': np.random.normal(0, 2),
-            'Bangalore': np.random.normal(-0.5, 1.5),
-            'Chennai': np.random.normal(1, 2),
-            'Hyderabad': np.random.normal(0.5, 1.5)
-        }
-        location_adj = location_factors[cust['Location']]
+next_model_check = 0.0
+# Held while a version is loaded in the background, so only one load runs at a time
+model_reload_lock = threading.Lock()
 
-        if len(history) > 0:
-            recent_performance = np.mean([h['payment_efficiency'] for h in history[-10:]])
-            consistency_factor = 1 - np.std([h['payment_efficiency'] for h in history[-5:]]) / 10
-            historical_adj = recent_performance * consistency_factor * 5
-        else:
-            historical_adj = np.random.normal(0, 3)
-
-        market_stress = (1 - market_conditions[month]) * 10
-        day_effect = 2 * np.sin(2 * np.pi * day / 30)
-
-        total_adjustment = (industry_adj + amount_factor + method_adj +
-                            location_adj + historical_adj + market_stress + day_effect)
+# Set once the server starts shutting down; /ready then reports 503 so
+# load balancers stop routing here while in-flight requests finish
+draining = False
 
-        days_to_payment = base_payment_tendency + total_adjustment + np.random.normal(0, 3)
-        days_to_payment = max(1, min(120, days_to_payment))
-        days_to_payment = round(days_to_payment, 1)
-
-        if np.random.rand() < 0.01:
-            days_to_payment += np.random.exponential(30)
+def load_existing_model():
+    """Load and activate the registry's current model version if there is one"""
+    try:
+        import_legacy_model()
+        version = model_registry.current()
+        if version is None:
+            return False
+        logger.info(f"Loading model version {version}...")
+        load_started = time.perf_counter()
+        serving_model = load_model_version(version, warm_up=False)
+        startup_report['artifact_load'] = time.perf_counter() - load_started
+
+        startup_report['first_inference_warmup'] = warmup_model(serving_model)
+        activate_model(serving_model)
+        logger.info("✅ Model loaded successfully from existing files!")
+        return True
+    except Exception as e:
+        logger.error(f"Error loading existing model: {str(e)}")
 
-        payment_delay = days_to_payment - payment_due_days
-        payment_efficiency = max(0, 1 - payment_delay / payment_due_days)
+    return False
 
-        if payment_delay > 7:
-            payment_status = 'Late'
-        elif payment_delay < -2:
-            payment_status = 'Early'
-        else:
-            payment_status = 'On Time'
-
-        payment_date = invoice_date + pd.Timedelta(days=days_to_payment)
-        has_early_discount = (payment_delay < -5 and np.random.rand() < 0.2)
-
-        invoice_data = {
-            "InvoiceID": invoice_id,
-            "Company": company,
-            "Industry": cust['Industry'],
-            "Segment": cust['Segment'],
-            "InvoiceDate": invoice_date.strftime('%Y-%m-%d'),
-            "PaymentDueDays": payment_due_days,
-            "PaymentDueDate": payment_due_date.strftime('%Y-%m-%d'),
-            "InvoiceAmount": invoice_amount,
-            "CustomerCreditScore": cust['CustomerCreditScore'],
-            "Location": cust['Location'],
-            "PaymentMethod": payment_method,
-            "InvoiceCurrency": 'INR',
-            "HasEarlyDiscount": has_early_discount,
-            "MarketCondition": market_conditions[month],
-            "PaymentUrgency": payment_urgency[month],
-            "DayOfMonth": day,
-            "ActualPaymentDate": payment_date.strftime('%Y-%m-%d'),
-            "PaymentDelay": round(payment_delay, 1),
-            "DaysToPayment": round(days_to_payment, 1),
-            "PaymentStatus": payment_status,
-            "PaymentEfficiency": payment_efficiency
-        }
+def import_legacy_model():
+    """Register model files at the fixed pre-registry paths as the first version"""
+    if model_registry.current() is not None or not (os.path.exists(MODEL_H5_PATH) and os.path.exists(MODEL_PKL_PATH)):
+        return None
+    if not os.path.exists(MODEL_NPZ_PATH) or os.path.getmtime(MODEL_NPZ_PATH) < os.path.getmtime(MODEL_H5_PATH):
+        export_numpy_weights(MODEL_H5_PATH, MODEL_NPZ_PATH)
+    with open(MODEL_PKL_PATH, 'rb') as f:
+        artifacts = pickle.load(f)
+    version = model_registry.register(MODEL_H5_PATH, MODEL_PKL_PATH, MODEL_NPZ_PATH,
+                                      version_metadata(artifacts, source='import'))
+    model_registry.set_current(version)
+    logger.info(f"Imported {MODEL_H5_PATH} into the model registry as version {version}")
+    return version
+
+def version_metadata(artifacts, **extra):
+    """Registry metadata summarising a model's artifacts"""
+    return dict(extra, trainedAt=artifacts.get('timestamp'), metrics=artifacts.get('metrics', {}),
+                sequenceFeatures=artifacts.get('sequence_features'),
+                staticFeatures=artifacts.get('static_features'))
+
+def load_model_version(version, warm_up=True):
+    """Load a registry version into a ServingModel, warmed up unless warm_up is False"""
+    h5_path, pkl_path, npz_path = model_registry.paths(version)
+    model = load_inference_model(h5_path, npz_path)
+    # Keras would need training mode for dropout, which also switches BatchNorm to batch statistics
+    numpy_model = model if isinstance(model, NumpyPaymentModel) else NumpyPaymentModel.load(npz_path)
+    with open(pkl_path, 'rb') as f:
+        artifacts = pickle.load(f)
+    serving_model = ServingModel(model, artifacts['sequence_scaler'], artifacts['static_scaler'], artifacts, version,
+                                 numpy_model)
+    if warm_up:
+        # Warmed before it takes traffic; the active model keeps serving meanwhile
+        warmup_model(serving_model)
+    return serving_model
+
+def activate_model(serving_model):
+    """Make a loaded model version the one used for new predictions"""
+    global ml_model, sequence_scaler, static_scaler, model_artifacts, active_model
+
+    # One reference assignment: requests already running keep the ServingModel they took.
+    # The feature cache needs no flush: scaled company rows remember the sequence_scaler
+    # that scaled them and are rescaled by the new one on first use.
+    active_model = serving_model
+    ml_model, sequence_scaler, static_scaler, model_artifacts = serving_model[:4]
+
+def current_model_files():
+    """(model, artifacts, npz) paths of the current version, or None"""
+    import_legacy_model()
+    version = model_registry.current()
+    return model_registry.paths(version) if version else None
+
+def load_inference_model(h5_path=MODEL_H5_PATH, npz_path=MODEL_NPZ_PATH):
+    """Load the saved model with the configured inference engine"""
+    if INFERENCE_ENGINE == 'numpy':
+        if not os.path.exists(npz_path) or os.path.getmtime(npz_path) < os.path.getmtime(h5_path):
+            export_numpy_weights(h5_path, npz_path)
+        return NumpyPaymentModel.load(npz_path)
+    from tensorflow.keras.models import load_model
+
+    # Serving never needs the custom training loss, so the model is not compiled
+    return load_model(h5_path, compile=False)
+
+def warmup_model(serving_model=None):
+    """Run one throwaway prediction so the first request skips lazy model initialisation"""
+    warmup_started = time.perf_counter()
+    sequence_scaled, static_matrix = engineer_features_for_batch([{}], serving_model)
+    predict_days_batch(sequence_scaled, static_matrix, serving_model)
+
+    # One full Monte-Carlo pass, which also measures its cost for the uncertainty latency budget
+    rows = max(1, DEFAULT_SAMPLE_BATCH_SIZE // UNCERTAINTY_SAMPLES)
+    predict_days_intervals(np.repeat(sequence_scaled, rows, axis=0), np.repeat(static_matrix, rows, axis=0),
+                           serving_model, UNCERTAINTY_SAMPLES, budget_ms=float('inf'))
+    return time.perf_counter() - warmup_started
 
-        invoices.append(invoice_data)
+def get_company_payment_history(company_name):
+    """Get company payment history from the history store"""
+    return history_store.get_history(company_name)
 
-        company_payment_history[company].append({
-            'payment_delay': payment_delay,
-            'days_to_payment': days_to_payment,
-            'amount': invoice_amount,
-            'payment_efficiency': payment_efficiency
-        })
+def get_company_history_count(company_name):
+    """Number of payment records held for a company"""
+    return history_store.count(company_name)
 
-    return pd.DataFrame(invoices)
-
-def engineer_continuous_features(df):
-    """Advanced feature engineering focusing on continuous behavioral patterns"""
-
-    df = df.copy()
-    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
-    df = df.sort_values(['Company', 'InvoiceDate']).reset_index(drop=True)
-
-    # Time-based continuous features
-    df['Month'] = df['InvoiceDate'].dt.month
-    df['Quarter'] = df['InvoiceDate'].dt.quarter
-    df['DayOfWeek'] = df['InvoiceDate'].dt.dayofweek
-    df['WeekOfYear'] = df['InvoiceDate'].dt.isocalendar().week
-
-    # Continuous seasonal features
-    df['MonthSin'] = np.sin(2 * np.pi * df['Month'] / 12)
-    df['MonthCos'] = np.cos(2 * np.pi * df['Month'] / 12)
-    df['QuarterSin'] = np.sin(2 * np.pi * df['Quarter'] / 4)
-    df['QuarterCos'] = np.cos(2 * np.pi * df['Quarter'] / 4)
-    df['DayOfWeekSin'] = np.sin(2 * np.pi * df['DayOfWeek'] / 7)
-    df['DayOfWeekCos'] = np.cos(2 * np.pi * df['DayOfWeek'] / 7)
-    df['DayOfMonthSin'] = np.sin(2 * np.pi * df['DayOfMonth'] / 30)
-    df['DayOfMonthCos'] = np.cos(2 * np.pi * df['DayOfMonth'] / 30)
-
-    # Amount features
-    df['LogInvoiceAmount'] = np.log1p(df['InvoiceAmount'])
-    df['AmountSquareRoot'] = np.sqrt(df['InvoiceAmount'])
-    df['AmountPerDueDay'] = df['InvoiceAmount'] / df['PaymentDueDays']
-    df['LogAmountPerDueDay'] = np.log1p(df['AmountPerDueDay'])
-
-    # Credit score features
-    df['CreditScoreNorm'] = (df['CustomerCreditScore'] - 650) / 100
-    df['CreditScoreSquared'] = df['CreditScoreNorm'] ** 2
-    df['CreditScoreCubed'] = df['CreditScoreNorm'] ** 3
-
-    # Company behavioral features
-    df['CompanyEfficiency_3'] = df.groupby('Company')['PaymentEfficiency'].transform(
-        lambda x: x.shift(1).rolling(3, min_periods=1).mean()
-    )
-    df['CompanyEfficiency_7'] = df.groupby('Company')['PaymentEfficiency'].transform(
-        lambda x: x.shift(1).rolling(7, min_periods=1).mean()
-    )
-    df['CompanyEfficiency_All'] = df.groupby('Company')['PaymentEfficiency'].transform(
-        lambda x: x.shift(1).expanding().mean()
-    )
-
-    df['PaymentVelocity'] = df['DaysToPayment'] / (df['LogInvoiceAmount'] + 1)
-    df['CompanyVelocity_Avg'] = df.groupby('Company')['PaymentVelocity'].transform(
-        lambda x: x.shift(1).expanding().mean()
-    )
-
-    df['CompanyConsistency'] = df.groupby('Company')['PaymentEfficiency'].transform(
-        lambda x: 1 / (1 + x.shift(1).rolling(5, min_periods=2).std().fillna(0.5))
-    )
-
-    def calculate_trend(series):
-        if len(series) < 3:
-            return 0
-        x = np.arange(len(series))
-        y = series.values
-        return np.polyfit(x, y, 1)[0]
-
-    df['CompanyTrend'] = df.groupby('Company')['PaymentEfficiency'].transform(
-        lambda x: x.shift(1).rolling(7, min_periods=3).apply(calculate_trend)
-    )
-
-    # Market features
-    df['MarketTrend'] = df.groupby('Month')['MarketCondition'].transform('mean')
-    df['MarketVolatility'] = df.groupby('Month')['MarketCondition'].transform('std')
-
-    # Industry features
-    industry_payment_avg = df.groupby(['Industry', 'Month'])['PaymentEfficiency'].transform('mean')
-    df['IndustrySeasonalEffect'] = df['PaymentEfficiency'] - industry_payment_avg
-
-    # Location features
-    location_economic_index = df.groupby(['Location', 'Quarter'])['MarketCondition'].transform('mean')
-    df['LocationEconomicIndex'] = location_economic_index
-
-    # Interaction features
-    df['CreditScore_Amount'] = df['CreditScoreNorm'] * df['LogInvoiceAmount']
-    df['CreditScore_Market'] = df['CreditScoreNorm'] * df['MarketCondition']
-    df['Amount_Market'] = df['LogInvoiceAmount'] * df['MarketCondition']
-    df['Efficiency_Consistency'] = df['CompanyEfficiency_All'] * df['CompanyConsistency']
-
-    # Payment frequency
-    df['DaysSinceLastInvoice'] = df.groupby('Company')['InvoiceDate'].diff().dt.days
-    df['DaysSinceLastInvoice'].fillna(30, inplace=True)
-    df['PaymentFrequency'] = 1 / (df['DaysSinceLastInvoice'] + 1)
-
-    # Target encoding
-    categorical_cols = ['Industry', 'Location', 'PaymentMethod', 'Segment']
-
-    for col in categorical_cols:
-        target_mean = df.groupby(col)['PaymentEfficiency'].transform('mean')
-        global_mean = df['PaymentEfficiency'].mean()
-        counts = df.groupby(col)['PaymentEfficiency'].transform('count')
-        smoothing = 10
-        smoothed_target = (target_mean * counts + global_mean * smoothing) / (counts + smoothing)
-        df[f'{col}_TargetEncoded'] = smoothed_target
-
-    # Fill missing values
-    continuous_cols = [col for col in df.columns if df[col].dtype in ['float64', 'int64']]
-    for col in continuous_cols:
-        if df[col].isnull().any():
-            if 'Efficiency' in col:
-                df[col].fillna(0.7, inplace=True)
-            elif 'Trend' in col:
-                df[col].fillna(0, inplace=True)
-            elif 'Consistency' in col:
-                df[col].fillna(0.5, inplace=True)
+def add_company_payment_record(company_name, record):
+    """Add a payment record to company history"""
+    history_store.add_record(company_name, record)
+
+def add_company_payment_records(company_name, records):
+    """Add a batch of payment records to company history"""
+    history_store.add_records(company_name, records)
+
+def clear_company_history(company_name):
+    """Drop all payment records held for a company"""
+    history_store.clear(company_name)
+
+class CompanyFeatureVector:
+    """Behavioral features of one company as a dict, its feature_spec company history and
+    (sequence_scaler, row) of its company history sequence columns scaled by that scaler"""
+
+    __slots__ = ('features', 'history', 'scaled')
+
+    def __init__(self, features, history):
+        self.features = features
+        self.history = history
+        self.scaled = None
+
+def company_feature_vectors(company_names):
+    """Feature vectors for each distinct company, from the feature cache where possible"""
+    now = datetime.now()
+    vectors = {}
+    for name in set(company_names):
+        key = (name, history_store.version(name))
+        vector = feature_cache.get(key, now)
+        if vector is None:
+            aggregate = history_store.get_aggregate(name)
+            expires_at = None
+            if aggregate is None:
+                # Default values for new companies
+                vector = CompanyFeatureVector(dict(DEFAULT_COMPANY_FEATURES), company_history(None))
             else:
-                df[col].fillna(df[col].median(), inplace=True)
+                vector = CompanyFeatureVector(aggregate.features(now), company_history(aggregate))
+                days_since_last = vector.features['days_since_last']
+                if aggregate.count and days_since_last < 365:
+                    # days_since_last ticks over a day after the last payment's time of day
+                    expires_at = aggregate.last_date + timedelta(days=days_since_last + 1)
+            feature_cache.put(key, vector, expires_at)
+        vectors[name] = vector
+    return vectors
 
-    return df
-
-def create_continuous_prediction_model(sequence_features, static_features):
-    """Create a hybrid LSTM + feedforward model designed for continuous predictions"""
+def calculate_company_behavioral_features(company_name):
+    """Calculate advanced company behavioral features from actual history"""
+    return dict(company_feature_vectors([company_name])[company_name].features)
+
+def install_trained_model(job):
+    """Register, load, warm up and activate the model a finished training job staged"""
+    staged = [os.path.join(job.job_dir, name) for name in (STAGED_MODEL, STAGED_ARTIFACTS, STAGED_NPZ)]
+    with open(staged[1], 'rb') as f:
+        artifacts = pickle.load(f)
+    version = model_registry.register(*staged, version_metadata(
+        artifacts, source=job.params.get('mode', 'full'), jobId=job.job_id, params=job.params), move=True)
+
+    activate_version(version)
+    logger.info(f"🎉 Model version {version} from training job {job.job_id} is now serving")
+
+def activate_version(version):
+    """Load and warm up a version, make it current for every worker and serve it here"""
+    serving_model = load_model_version(version)
+    model_registry.set_current(version)
+    activate_model(serving_model)
+    return serving_model
+
+training_jobs = TrainingJobManager(TRAINING_JOBS_DIR, install_trained_model)
+
+def reload_model_if_replaced():
+    """Start loading the current version in the background if another worker activated a new one
+
+    Checked at most every MODEL_RELOAD_INTERVAL seconds. Requests keep being
+    served by the active model until the new one is loaded and warmed up.
+    """
+    global next_model_check
+
+    now = time.monotonic()
+    if now < next_model_check or model_reload_lock.locked():
+        return
+    next_model_check = now + MODEL_RELOAD_INTERVAL
+    version = model_registry.current()
+    if version is None or (active_model is not None and version == active_model.version):
+        return
+    if model_reload_lock.acquire(blocking=False):
+        threading.Thread(target=_reload_current_version, args=(version,), name='model-reload', daemon=True).start()
+
+def _reload_current_version(version):
+    try:
+        logger.info(f"Model version {version} was activated by another worker; loading it")
+        serving_model = load_model_version(version)
+        # Another activation may have happened while loading; only swap if this is still current
+        if model_registry.current() == version:
+            activate_model(serving_model)
+            logger.info(f"Model version {version} is now serving")
+    except Exception as e:
+        logger.error(f"Error loading model version {version}: {str(e)}")
+    finally:
+        model_reload_lock.release()
 
-    # Sequence input for LSTM processing
-    sequence_input = Input(shape=(sequence_features,), name='sequence_input')
-    sequence_reshaped = tf.keras.layers.Reshape((sequence_features, 1))(sequence_input)
+def readiness_checks():
+    """Named checks that must all pass before this worker takes traffic"""
+    try:
+        history_store.count('')
+        history_ok = True
+    except Exception:
+        history_ok = False
+    return {
+        'model_loaded': active_model is not None,
+        'history_store': history_ok,
+        'accepting_requests': not draining
+    }
 
-    # LSTM layers for sequence processing
-    lstm1 = LSTM(64, return_sequences=True, dropout=0.4, recurrent_dropout=0.4,
-                 kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(sequence_reshaped)
-    lstm1_bn = BatchNormalization()(lstm1)
+def begin_shutdown():
+    """Stop reporting ready and cancel this worker's training job ahead of exit"""
+    global draining
+    draining = True
+    training_jobs.shutdown()
 
-    lstm2 = LSTM(32, return_sequences=False, dropout=0.4, recurrent_dropout=0.4,
-                 kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(lstm1_bn)
-    lstm2_bn = BatchNormalization()(lstm2)
+# Request fields a what-if sweep can vary (see feature_spec.REQUEST_FIELDS)
+SCENARIO_PARAMETERS = ['marketCondition', 'paymentUrgency', 'paymentDueDays', 'paymentMethod']
 
-    # Static input for dense processing
-    static_input = Input(shape=(static_features,), name='static_input')
+# Most grid points per sweep, and rows (invoices x grid points) built and scored per chunk
+MAX_SCENARIOS = int(os.environ.get('MAX_SCENARIOS', 1000))
+SCENARIO_CHUNK_ROWS = int(os.environ.get('SCENARIO_CHUNK_ROWS', 50000))
 
-    # Dense layers for static features
-    dense1 = Dense(64, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(static_input)
-    dense1_dropout = Dropout(0.3)(dense1)
-    dense1_bn = BatchNormalization()(dense1_dropout)
+# Rows per model call when scoring a batch of invoices
+PREDICT_BATCH_SIZE = 1024
 
-    dense2 = Dense(32, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(dense1_bn)
-    dense2_dropout = Dropout(0.3)(dense2)
+# Invoices scored per model call by the streaming /forecast/stream endpoint
+FORECAST_STREAM_CHUNK_SIZE = int(os.environ.get('FORECAST_STREAM_CHUNK_SIZE', 2000))
 
-    # Combine LSTM and dense outputs
-    combined = Concatenate()([lstm2_bn, dense2_dropout])
+# Monte-Carlo dropout prediction intervals, requested with "uncertainty" on /predict and /forecast:
+# forward passes per invoice, the fewest the latency budget may cut a request down to, and the
+# default budget in milliseconds for drawing them
+UNCERTAINTY_SAMPLES = int(os.environ.get('UNCERTAINTY_SAMPLES', 30))
+UNCERTAINTY_MIN_SAMPLES = int(os.environ.get('UNCERTAINTY_MIN_SAMPLES', 10))
+UNCERTAINTY_BUDGET_MS = float(os.environ.get('UNCERTAINTY_BUDGET_MS', 2000))
 
-    # Final prediction layers
-    final_dense1 = Dense(32, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(combined)
-    final_dropout1 = Dropout(0.4)(final_dense1)
+# Dropout masks are seeded per request, so identical requests get identical intervals
+UNCERTAINTY_SEED = 0
 
-    final_dense2 = Dense(16, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(final_dropout1)
-    final_dropout2 = Dropout(0.3)(final_dense2)
+# Cash-flow forecasts: bucket sizes, breakdowns (request name -> invoice field) and the
+# default horizon in days past which expected payments are only totalled
+CASHFLOW_BUCKETS = ('day', 'week', 'month')
+CASHFLOW_GROUPS = {'customer': 'customerName', 'segment': 'customerSegment', 'riskLevel': None}
+CASHFLOW_HORIZON_DAYS = int(os.environ.get('CASHFLOW_HORIZON_DAYS', 365))
 
-    # Output layer
-    output = Dense(1, activation='linear', name='days_prediction')(final_dropout2)
+# Most groups a cash-flow breakdown returns; smaller ones are summed into one 'other' group
+CASHFLOW_MAX_GROUPS = int(os.environ.get('CASHFLOW_MAX_GROUPS', 100))
 
-    # Create model
-    model = Model(inputs=[sequence_input, static_input], outputs=output)
+# Coalescing of concurrent /predict requests into batched model calls
+MICRO_BATCHING = os.environ.get('MICRO_BATCHING', 'true').lower() == 'true'
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 64))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', 5))
 
-    # Custom loss function for continuous predictions
-    def continuous_loss(y_true, y_pred):
-        mse = tf.reduce_mean(tf.square(y_true - y_pred))
-        # Add clustering penalty to encourage predictions near common payment terms
-        common_terms = tf.constant([15.0, 30.0, 45.0, 60.0, 90.0])
-        distances = tf.abs(tf.expand_dims(y_pred, -1) - tf.expand_dims(common_terms, 0))
-        min_distances = tf.reduce_min(distances, axis=-1)
-        clustering_penalty = tf.reduce_mean(tf.exp(-min_distances))
-        return mse + 0.1 * clustering_penalty
+def engineer_features_for_prediction(invoice_data, timer=None, serving_model=None):
+    """Enhanced feature engineering for API predictions using real company history"""
+    sequence_scaled, static_matrix = engineer_features_for_batch([invoice_data], serving_model, timer)
+    return sequence_scaled[0], static_matrix[0]
 
-    # Compile model
-    model.compile(
-        optimizer='adam',
-        loss=continuous_loss,
-        metrics=['mae', 'mse']
-    )
+def engineer_features_for_batch(invoices, serving_model=None, timer=None):
+    """Build the scaled sequence matrix and the static feature matrix for a batch of invoices"""
+    try:
+        serving_model = serving_model or active_model
+        columns, company_scaled = invoice_columns(invoices, serving_model)
+        if timer is not None:
+            timer.mark('history_lookup')
 
-    return model
+        sequence_scaled, static_matrix = model_input_matrices(columns, company_scaled, serving_model)
+        if timer is not None:
+            timer.mark('feature_engineering')
+        return sequence_scaled, static_matrix
 
-def prepare_continuous_data(df):
-    """Prepare data for continuous prediction model"""
+    except Exception as e:
+        logger.error(f"Error in feature engineering: {str(e)}")
+        raise e
 
-    sequence_features = [
-        'CompanyEfficiency_3', 'CompanyEfficiency_7', 'CompanyEfficiency_All',
-        'CompanyVelocity_Avg', 'CompanyConsistency', 'CompanyTrend',
-        'PaymentFrequency', 'DaysSinceLastInvoice'
-    ]
+def invoice_columns(invoices, serving_model=None):
+    """feature_spec source columns of a batch of invoices: the request fields and each customer's history
+
+    With serving_model, returns (columns, company_scaled) instead, company_scaled
+    holding each invoice's company history sequence columns already scaled by
+    the model's sequence_scaler (see scaled_company_rows).
+    """
+    columns = request_columns(invoices)
+    customer_names = [inv.get('customerName', 'Company_1') for inv in invoices]
+    company_vectors = company_feature_vectors(customer_names)
+
+    # One history per distinct customer, indexed by each invoice's position in that list
+    positions = {}
+    codes = np.array([positions.setdefault(name, len(positions)) for name in customer_names], dtype=np.intp)
+    distinct_vectors = [company_vectors[name] for name in positions]
+    columns.update(company_history_columns([vector.history for vector in distinct_vectors], codes,
+                                           columns['InvoiceDate']))
+    if serving_model is None:
+        return columns
+    return columns, scaled_company_rows(distinct_vectors, serving_model)[codes]
+
+def company_sequence_columns(sequence_features):
+    """(positions in the sequence input, positions in COMPANY_HISTORY_VALUES) of the sequence
+    features that are company history values, the same for every invoice of a company"""
+    pairs = [(i, COMPANY_HISTORY_VALUES.index(name)) for i, name in enumerate(sequence_features)
+             if name in COMPANY_HISTORY_VALUES]
+    return [i for i, _ in pairs], [j for _, j in pairs]
+
+def scale_columns(matrix, scaler, positions):
+    """matrix scaled as a fitted RobustScaler scales the given columns of its full input"""
+    scaled = (matrix - scaler.center_[positions]).astype(matrix.dtype)
+    scaled /= scaler.scale_[positions]
+    return scaled
+
+def scaled_company_rows(vectors, serving_model):
+    """Company history sequence columns of each vector scaled by the model's sequence_scaler
+
+    Scaled rows are kept on the (feature-cached) vectors, so a company is only
+    scaled again once its history changes or another model version serves.
+    """
+    scaler = serving_model.sequence_scaler
+    sequence_positions, history_positions = company_sequence_columns(serving_model.artifacts['sequence_features'])
+    rows = [vector.scaled[1] if vector.scaled is not None and vector.scaled[0] is scaler else None
+            for vector in vectors]
+    unscaled = [i for i, row in enumerate(rows) if row is None]
+    if unscaled:
+        raw = np.array([vectors[i].history[0] for i in unscaled], dtype=FEATURE_DTYPE).reshape(
+            len(unscaled), len(COMPANY_HISTORY_VALUES))[:, history_positions]
+        for i, row in zip(unscaled, scale_columns(np.nan_to_num(raw), scaler, sequence_positions)):
+            # One assignment, so concurrent requests never see a row paired with the wrong scaler
+            vectors[i].scaled = (scaler, row)
+            rows[i] = row
+    return np.array(rows, dtype=FEATURE_DTYPE).reshape(len(vectors), len(sequence_positions))
+
+def scaled_sequence_matrix(columns, company_scaled, serving_model):
+    """Scaled sequence matrix: the cached company columns, and the invoice-dated rest computed and scaled"""
+    artifacts = serving_model.artifacts
+    features = artifacts['sequence_features']
+    sequence_positions, _ = company_sequence_columns(features)
+    matrix = np.empty((len(company_scaled), len(features)), dtype=FEATURE_DTYPE)
+    matrix[:, sequence_positions] = company_scaled
+    rest = [i for i in range(len(features)) if i not in sequence_positions]
+    if rest:
+        raw = compile_features([features[i] for i in rest]).matrix(columns, artifacts.get('portfolio_statistics'))
+        matrix[:, rest] = scale_columns(raw, serving_model.sequence_scaler, rest)
+    return matrix
+
+def model_input_matrices(columns, company_scaled, serving_model):
+    """Scaled sequence matrix and unscaled static matrix of a model's features over source columns"""
+    artifacts = serving_model.artifacts
+    static_matrix = compile_features(artifacts['static_features']).matrix(columns,
+                                                                         artifacts.get('portfolio_statistics'))
+    return scaled_sequence_matrix(columns, company_scaled, serving_model), static_matrix
+
+def predict_days_batch(sequence_scaled, static_matrix, serving_model=None, timer=None):
+    """Scale the static matrix once and score the batch with one model call"""
+    serving_model = serving_model or active_model
+    static_scaled = serving_model.static_scaler.transform(static_matrix)
+    if timer is not None:
+        timer.mark('scaler_transform')
+    predictions = serving_model.model.predict([sequence_scaled, static_scaled],
+                                batch_size=PREDICT_BATCH_SIZE, verbose=0)
+    if timer is not None:
+        timer.mark('model_predict')
+    return np.asarray(predictions, dtype=float).reshape(-1)
+
+predict_batcher = MicroBatcher(predict_days_batch, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS)
+
+def predict_days_single(sequence_features, static_features, timer=None, serving_model=None):
+    """Predict one invoice, coalesced with concurrent requests when micro-batching is on"""
+    if MICRO_BATCHING:
+        predicted_days = float(predict_batcher.submit(sequence_features, static_features, serving_model))
+        if timer is not None:
+            # Queue wait, scaling and the batched model call are one stage here
+            timer.mark('model_predict')
+        return predicted_days
+    return float(predict_days_batch(sequence_features[None, :], static_features[None, :], serving_model, timer)[0])
+
+def uncertainty_options(data):
+    """(samples, budget ms) asked for by a request's "uncertainty" field (true or an object), or None"""
+    option = data.get('uncertainty')
+    if not option:
+        return None
+    option = option if isinstance(option, dict) else {}
+    samples = float(option.get('samples', UNCERTAINTY_SAMPLES))
+    budget_ms = float(option.get('budgetMs', UNCERTAINTY_BUDGET_MS))
+    if not samples.is_integer() or samples < 2:
+        raise ValueError('samples must be an integer of at least 2')
+    if not np.isfinite(budget_ms) or budget_ms <= 0:
+        raise ValueError('budgetMs must be a finite positive number')
+    return int(samples), budget_ms
+
+def uncertainty_sample_count(numpy_model, rows, samples, budget_ms):
+    """Samples per row: as requested, cut to fit the latency budget but not below UNCERTAINTY_MIN_SAMPLES
+
+    An infinite budget_ms never cuts the samples.
+    """
+    cost = numpy_model.seconds_per_sampled_row
+    if cost is None or not rows or np.isinf(budget_ms):
+        return samples
+    affordable = int(budget_ms / 1000 / (rows * cost))
+    return max(min(samples, affordable), min(samples, UNCERTAINTY_MIN_SAMPLES))
+
+def predict_days_samples(sequence_scaled, static_matrix, serving_model=None, samples=UNCERTAINTY_SAMPLES,
+                         budget_ms=UNCERTAINTY_BUDGET_MS, timer=None):
+    """Monte-Carlo dropout draws of the predicted days, one row of samples per invoice"""
+    serving_model = serving_model or active_model
+    static_scaled = serving_model.static_scaler.transform(static_matrix)
+    samples = uncertainty_sample_count(serving_model.numpy_model, len(static_scaled), samples, budget_ms)
+    draws = serving_model.numpy_model.predict_samples([sequence_scaled, static_scaled], samples,
+                                                  np.random.default_rng(UNCERTAINTY_SEED)).astype(float)
+    if timer is not None:
+        timer.mark('uncertainty_sampling')
+    return draws
+
+def predict_days_intervals(sequence_scaled, static_matrix, serving_model=None, samples=UNCERTAINTY_SAMPLES,
+                           budget_ms=UNCERTAINTY_BUDGET_MS, timer=None):
+    """Monte-Carlo dropout mean, standard deviation and P10 / P50 / P90 days per row, and the samples drawn"""
+    draws = predict_days_samples(sequence_scaled, static_matrix, serving_model, samples, budget_ms, timer)
+    samples = draws.shape[1]
+    p10, p50, p90 = np.percentile(draws, [10, 50, 90], axis=1)
+    return {'mean': draws.mean(axis=1), 'std': draws.std(axis=1), 'p10': p10, 'p50': p50, 'p90': p90,
+            'samples': samples}
+
+def interval_fields(intervals, i):
+    """Response fields of row i of predict_days_intervals"""
+    return {
+        'meanDays': round(float(intervals['mean'][i]), 1),
+        'stdDays': round(float(intervals['std'][i]), 1),
+        'p10Days': round(float(intervals['p10'][i]), 1),
+        'p50Days': round(float(intervals['p50'][i]), 1),
+        'p90Days': round(float(intervals['p90'][i]), 1),
+        'samples': intervals['samples']
+    }
 
-    static_features = [
-        'LogInvoiceAmount', 'AmountSquareRoot', 'LogAmountPerDueDay',
-        'CreditScoreNorm', 'CreditScoreSquared', 'CreditScoreCubed',
-        'MonthSin', 'MonthCos', 'QuarterSin', 'QuarterCos',
-        'DayOfWeekSin', 'DayOfWeekCos', 'DayOfMonthSin', 'DayOfMonthCos',
-        'MarketCondition', 'PaymentUrgency', 'MarketTrend', 'MarketVolatility',
-        'IndustrySeasonalEffect', 'LocationEconomicIndex',
-        'CreditScore_Amount', 'CreditScore_Market', 'Amount_Market',
-        'Efficiency_Consistency',
-        'Industry_TargetEncoded', 'Location_TargetEncoded',
-        'PaymentMethod_TargetEncoded', 'Segment_TargetEncoded'
+def scenario_grid(grid):
+    """Cross product of a {parameter: [values]} grid: scenario parameter dicts and feature_spec source columns"""
+    unknown = sorted(set(grid) - set(SCENARIO_PARAMETERS))
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters: {', '.join(unknown)} "
+                         f"(supported: {', '.join(SCENARIO_PARAMETERS)})")
+    for name, values in grid.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"{name} needs a non-empty list of values")
+    count = int(np.prod([len(values) for values in grid.values()]))
+    if count > MAX_SCENARIOS:
+        raise ValueError(f"The grid has {count} scenarios; at most {MAX_SCENARIOS} are allowed")
+
+    scenarios = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    columns = {}
+    for name in grid:
+        column, _, convert = REQUEST_FIELDS[name]
+        columns[column] = np.array([convert(scenario[name]) for scenario in scenarios],
+                                   dtype=object if convert is str else None)
+    if 'PaymentDueDays' in columns and (columns['PaymentDueDays'] <= 0).any():
+        raise ValueError('paymentDueDays must be positive')
+    return scenarios, columns
+
+def sweep_scenarios(invoices, scenario_columns, serving_model=None, timer=None):
+    """Predicted days of every invoice under every scenario, as an (invoices, scenarios) matrix
+
+    Company features are looked up once per customer and the LSTM branch runs
+    once per invoice (NumPy engine, whichever engine serves /predict); only
+    the static branch and the head see the invoice x scenario cross product,
+    which is built and scored SCENARIO_CHUNK_ROWS rows at a time.
+    """
+    serving_model = serving_model or active_model
+    artifacts = serving_model.artifacts
+    statistics = artifacts.get('portfolio_statistics')
+    columns, company_scaled = invoice_columns(invoices, serving_model)
+    if timer is not None:
+        timer.mark('history_lookup')
+
+    sequence_scaled = scaled_sequence_matrix(columns, company_scaled, serving_model)
+    # Static features the scenario parameters do not change are computed once per invoice
+    static_transform = compile_features(artifacts['static_features'])
+    varying = static_transform.dependents(scenario_columns) | set(scenario_columns)
+    invoice_level = {name: values for name, values in
+                     dict(columns, **static_transform.columns(columns, statistics)).items() if name not in varying}
+
+    num_scenarios = len(next(iter(scenario_columns.values())))
+    predicted_days = np.empty((len(invoices), num_scenarios))
+    invoices_per_chunk = max(1, SCENARIO_CHUNK_ROWS // num_scenarios)
+    for start in range(0, len(invoices), invoices_per_chunk):
+        end = min(start + invoices_per_chunk, len(invoices))
+        # Invoice columns repeat once per scenario; scenario columns tile once per invoice
+        chunk = {name: np.repeat(values[start:end], num_scenarios) for name, values in invoice_level.items()}
+        for name, values in scenario_columns.items():
+            chunk[name] = np.tile(values, end - start)
+        static_scaled = serving_model.static_scaler.transform(static_transform.matrix(chunk, statistics))
+        if timer is not None:
+            timer.mark('feature_engineering')
+        predicted_days[start:end] = serving_model.numpy_model.predict_repeated_sequences(
+            sequence_scaled[start:end], static_scaled, num_scenarios).reshape(end - start, num_scenarios)
+        if timer is not None:
+            timer.mark('model_predict')
+
+    due_days = scenario_columns.get('PaymentDueDays')
+    due_days = np.broadcast_to(due_days[None, :] if due_days is not None else columns['PaymentDueDays'][:, None],
+                               predicted_days.shape)
+    return columns['InvoiceAmount'], due_days, predicted_days
+
+def summarize_scenarios(grid, scenarios, amounts, due_days, predicted_days):
+    """Per-scenario portfolio statistics and, per parameter, the average over the rest of the grid"""
+    total_amount = amounts.sum()
+    average_days = predicted_days.mean(axis=0)
+    weighted_days = amounts @ predicted_days / total_amount if total_amount else average_days
+    p10, p50, p90 = np.percentile(predicted_days, [10, 50, 90], axis=0)
+    risk_levels = classify_risk_levels(predicted_days, due_days)
+    risk_counts = {level: np.count_nonzero(risk_levels == level, axis=0) for level in ('low', 'medium', 'high')}
+
+    results = [
+        {
+            'parameters': scenario,
+            'averagePredictedDays': round(float(average_days[i]), 1),
+            'amountWeightedDays': round(float(weighted_days[i]), 1),
+            'p10Days': round(float(p10[i]), 1),
+            'p50Days': round(float(p50[i]), 1),
+            'p90Days': round(float(p90[i]), 1),
+            'riskDistribution': {level: int(counts[i]) for level, counts in risk_counts.items()}
+        }
+        for i, scenario in enumerate(scenarios)
     ]
 
-    available_sequence = [f for f in sequence_features if f in df.columns]
-    available_static = [f for f in static_features if f in df.columns]
-
-    print(f"Using {len(available_sequence)} sequence features and {len(available_static)} static features")
-
-    X_sequence = df[available_sequence].fillna(0).values
-    X_static = df[available_static].fillna(0).values
-    y = df['DaysToPayment'].values
-
-    sequence_scaler = RobustScaler()
-    static_scaler = RobustScaler()
-
-    X_sequence_scaled = sequence_scaler.fit_transform(X_sequence)
-    X_static_scaled = static_scaler.fit_transform(X_static)
-
-    return X_sequence_scaled, X_static_scaled, y, sequence_scaler, static_scaler, available_sequence, available_static
-
-def train_model():
-    """Train the ML model with full LSTM + feedforward architecture"""
-    global ml_model, sequence_scaler, static_scaler, model_artifacts
-
-    print("=" * 50)
-    print("🚀 TRAINING PAYMENT PREDICTION MODEL")
-    print("=" * 50)
-
-    # Generate data
-    print("📊 Generating synthetic data...")
-    synthetic_df = generate_improved_synthetic_data()
-    print(f"✅ Generated {len(synthetic_df)} invoice records")
-
-    # Engineer features
-    print("🔧 Engineering features...")
-    df_continuous = engineer_continuous_features(synthetic_df)
-    print("✅ Feature engineering completed")
-
-    # Prepare data
-    print("🎯 Preparing data for modeling...")
-    X_seq, X_static, y, seq_scaler, static_scaler, seq_features, static_features = prepare_continuous_data(
-        df_continuous)
-    print(f"✅ Data prepared: {X_seq.shape[0]} samples")
-
-    # Split data
-    X_seq_temp, X_seq_test, X_static_temp, X_static_test, y_temp, y_test = train_test_split(
-        X_seq, X_static, y, test_size=0.15, random_state=42, shuffle=True
-    )
-    X_seq_train, X_seq_val, X_static_train, X_static_val, y_train, y_val = train_test_split(
-        X_seq_temp, X_static_temp, y_temp, test_size=0.18, random_state=42, shuffle=True
-    )
-
-    print(f"📈 Training samples: {X_seq_train.shape[0]}")
-    print(f"📊 Validation samples: {X_seq_val.shape[0]}")
-    print(f"🧪 Test samples: {X_seq_test.shape[0]}")
-
-    # Create and train model
-    print("🏗️ Building hybrid LSTM + feedforward model...")
-    model = create_continuous_prediction_model(len(seq_features), len(static_features))
-
-    # Training callbacks
-    callbacks = [
-        EarlyStopping(monitor='val_loss', patience=15, restore_best_weights=True, verbose=1),
-        ReduceLROnPlateau(monitor='val_loss', factor=0.7, patience=8, min_lr=1e-6, verbose=1),
-        ModelCheckpoint('best_model_temp.h5', monitor='val_loss', save_best_only=True, verbose=0)
+    curves = {}
+    for name, values in grid.items():
+        curve = []
+        for value in values:
+            selected = [i for i, scenario in enumerate(scenarios) if scenario[name] == value]
+            curve.append({
+                'value': value,
+                'averagePredictedDays': round(float(average_days[selected].mean()), 1),
+                'amountWeightedDays': round(float(weighted_days[selected].mean()), 1)
+            })
+        curves[name] = curve
+    return results, curves
+
+def classify_risk_levels(predicted_days, due_days):
+    """Vectorized risk level from the predicted-to-due days ratio"""
+    delay_ratio = predicted_days / due_days
+    return np.where(delay_ratio <= 3, 'low', np.where(delay_ratio <= 6, 'medium', 'high'))
+
+def bucket_starts(dates, bucket):
+    """First day of the day, week (from Monday) or month bucket of each datetime64[D] date"""
+    if bucket == 'day':
+        return dates
+    if bucket == 'week':
+        # 1970-01-01 was a Thursday
+        return dates - (dates.astype(np.int64) + 3) % 7
+    return dates.astype('datetime64[M]').astype('datetime64[D]')
+
+def cashflow_histogram(amounts, predicted_days, bucket, horizon_days, now=None, group_codes=None, num_groups=1):
+    """Expected collections per bucket and group, from today to the horizon, and the amount expected beyond it
+
+    predicted_days holds one prediction per invoice, or one row of Monte-Carlo
+    draws per invoice, each carrying an equal share of the invoice's amount.
+    Payments predicted before now are expected today. Returns the bucket start
+    dates and (groups x buckets, groups) amount arrays.
+    """
+    now = np.datetime64(now or datetime.now(), 'us')
+    today = now.astype('datetime64[D]')
+    predicted_days = np.asarray(predicted_days, dtype=float).reshape(len(amounts), -1)
+    samples = predicted_days.shape[1]
+    weights = np.repeat(np.asarray(amounts, dtype=float) / samples, samples)
+    groups = np.zeros(weights.size, dtype=np.intp) if group_codes is None else np.repeat(group_codes, samples)
+
+    # Whole days from today to each payment date, and the bucket of each day up to the horizon
+    day_fraction = (now - today) / np.timedelta64(1, 'D')
+    payment_days = np.floor(np.maximum(predicted_days.reshape(-1), 0) + day_fraction).astype(np.intp)
+    starts, day_buckets = np.unique(bucket_starts(today + np.arange(horizon_days), bucket), return_inverse=True)
+
+    within = payment_days < horizon_days
+    positions = groups[within] * len(starts) + day_buckets[payment_days[within]]
+    amounts_by_bucket = np.bincount(positions, weights[within], minlength=num_groups * len(starts))
+    beyond = np.bincount(groups[~within], weights[~within], minlength=num_groups)
+    return starts, amounts_by_bucket.reshape(num_groups, len(starts)), beyond
+
+def cashflow_groups(invoices, group_by, risk_levels):
+    """(group names, each invoice's index into them) of a cash-flow breakdown"""
+    if group_by == 'riskLevel':
+        return list(RISK_LEVELS), np.argmax(risk_levels[:, None] == np.array(RISK_LEVELS), axis=1)
+    field = CASHFLOW_GROUPS[group_by]
+    default = REQUEST_FIELDS[field][1] if field in REQUEST_FIELDS else ''
+    positions = {}
+    codes = np.array([positions.setdefault(str(invoice.get(field, default)), len(positions)) for invoice in invoices],
+                     dtype=np.intp)
+    return list(positions), codes
+
+def largest_groups(names, bucket_amounts, beyond, limit):
+    """The limit groups expecting the most, largest first, with the rest summed into an 'other' group"""
+    order = np.argsort(-(bucket_amounts.sum(axis=1) + beyond), kind='stable')
+    kept, rest = order[:limit], order[limit:]
+    names = [names[i] for i in kept] + ['other']
+    bucket_amounts = np.vstack([bucket_amounts[kept], bucket_amounts[rest].sum(axis=0)])
+    beyond = np.append(beyond[kept], beyond[rest].sum())
+    return names, bucket_amounts, beyond
+
+def forecast_invoices(invoices, serving_model=None, timer=None, uncertainty=None):
+    """Score a batch of invoices; returns amounts, predicted days, risk levels and per-invoice forecasts
+
+    With uncertainty (samples, budget ms), every forecast also carries its Monte-Carlo dropout interval.
+    """
+    sequence_scaled, static_matrix = engineer_features_for_batch(invoices, serving_model, timer)
+    predicted_days = predict_days_batch(sequence_scaled, static_matrix, serving_model, timer)
+    intervals = None
+    if uncertainty is not None:
+        intervals = predict_days_intervals(sequence_scaled, static_matrix, serving_model, *uncertainty, timer=timer)
+
+    amounts = np.array([float(invoice.get('amount', 0)) for invoice in invoices])
+    due_days = np.array([int(invoice.get('paymentDueDays', 30)) for invoice in invoices])
+    risk_levels = classify_risk_levels(predicted_days, due_days)
+
+    now = datetime.now()
+    forecasts = [
+        {
+            'invoiceId': invoice.get('invoiceId', ''),
+            'customerName': invoice.get('customerName', ''),
+            'amount': float(amount),
+            'predictedDays': round(float(days), 1),
+            'riskLevel': str(risk_level),
+            'expectedPaymentDate': (now + timedelta(days=float(days))).isoformat()
+        }
+        for invoice, amount, days, risk_level in zip(invoices, amounts, predicted_days, risk_levels)
     ]
+    if intervals is not None:
+        for i, forecast in enumerate(forecasts):
+            forecast['uncertainty'] = interval_fields(intervals, i)
+    if timer is not None:
+        timer.mark('forecast_rows')
+    return amounts, predicted_days, risk_levels, forecasts
+
+class ForecastSummary:
+    """Running portfolio totals, so a streamed forecast never holds all of its rows"""
+
+    def __init__(self):
+        self.total_invoices = 0
+        self.total_amount = 0.0
+        self.predicted_days_sum = 0.0
+        self.risk_distribution = {'low': 0, 'medium': 0, 'high': 0}
+
+    def add(self, amounts, predicted_days, risk_levels):
+        self.total_invoices += len(amounts)
+        self.total_amount += float(amounts.sum())
+        self.predicted_days_sum += float(predicted_days.sum())
+        for level in self.risk_distribution:
+            self.risk_distribution[level] += int(np.count_nonzero(risk_levels == level))
+
+    def to_dict(self):
+        average = self.predicted_days_sum / self.total_invoices if self.total_invoices else 0.0
+        return {
+            'totalAmount': self.total_amount,
+            'totalInvoices': self.total_invoices,
+            'averagePredictedDays': round(average, 1),
+            'riskDistribution': self.risk_distribution,
+            'generatedAt': datetime.now().isoformat()
+        }
 
-    print("🎓 Training model with epochs...")
-    history = model.fit(
-        [X_seq_train, X_static_train], y_train,
-        validation_data=([X_seq_val, X_static_val], y_val),
-        epochs=100,
-        batch_size=64,
-        callbacks=callbacks,
-        verbose=1
-    )
-
-    # Evaluation
-    print("📋 Evaluating model...")
-    y_pred = model.predict([X_seq_test, X_static_test], verbose=0).flatten()
-    mae = mean_absolute_error(y_test, y_pred)
-    r2 = r2_score(y_test, y_pred)
-
-    print(f"✅ Model Performance:")
-    print(f"   📉 MAE: {mae:.2f} days")
-    print(f"   📈 R²: {r2:.3f}")
-
-    # Save model artifacts
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    model_filename = MODEL_H5_PATH
-    pickle_filename = MODEL_PKL_PATH
-
-    model.save(model_filename)
-
-    model_artifacts = {
-        'model_path': model_filename,
-        'sequence_scaler': seq_scaler,
-        'static_scaler': static_scaler,
-        'sequence_features': seq_features,
-        'static_features': static_features,
-        'timestamp': timestamp,
-        'model_version': '1.0',
-        'industries': ['IT', 'Finance', 'Healthcare', 'Retail', 'Manufacturing'],
-        'locations': ['Mumbai', 'Delhi', 'Bangalore', 'Chennai', 'Hyderabad'],
-        'payment_methods': ['Bank Transfer', 'Credit Card', 'Cheque', 'UPI'],
-        'segments': ['Reliable', 'Average', 'At-risk']
-    }
-
-    with open(pickle_filename, 'wb') as f:
-        pickle.dump(model_artifacts, f)
-
-    # Load into global variables
-    ml_model = model
-    sequence_scaler = seq_scaler
-    static_scaler = static_scaler
-
-    print(f"✅ Model saved: {model_filename}")
-    print(f"✅ Artifacts saved: {pickle_filename}")
-    print("🎉 Model training completed and loaded for API!")
-
-    return True
-
-def engineer_features_for_prediction(invoice_data):
-    """Enhanced feature engineering for API predictions using real company history"""
-    try:
-        amount = float(invoice_data.get('amount', 50000))
-        due_days = int(invoice_data.get('paymentDueDays', 30))
-        credit_score = int(invoice_data.get('customerCreditScore', 700))
-        customer_name = invoice_data.get('customerName', 'Company_1')
-
-        # Get real company behavioral features
-        company_features = calculate_company_behavioral_features(customer_name)
-        
-        logger.info(f"Company {customer_name} behavioral features: {company_features}")
-
-        # Feature engineering
-        log_amount = np.log1p(amount)
-        amount_sqrt = np.sqrt(amount)
-        log_amount_per_due_day = np.log1p(amount / due_days)
-
-        # Credit score features
-        credit_score_norm = credit_score / 850.0
-        credit_score_squared = credit_score_norm ** 2
-        credit_score_cubed = credit_score_norm ** 3
-
-        # Date features
-        invoice_date = datetime.now()
-        month = invoice_date.month
-        quarter = (month - 1) // 3 + 1
-        day_of_week = invoice_date.weekday()
-        day_of_month = invoice_date.day
-
-        # Cyclical encoding
-        month_sin = np.sin(2 * np.pi * month / 12)
-        month_cos = np.cos(2 * np.pi * month / 12)
-        quarter_sin = np.sin(2 * np.pi * quarter / 4)
-        quarter_cos = np.cos(2 * np.pi * quarter / 4)
-        day_of_week_sin = np.sin(2 * np.pi * day_of_week / 7)
-        day_of_week_cos = np.cos(2 * np.pi * day_of_week / 7)
-        day_of_month_sin = np.sin(2 * np.pi * day_of_month / 31)
-        day_of_month_cos = np.cos(2 * np.pi * day_of_month / 31)
-
-        # Market features
-        market_condition = float(invoice_data.get('marketCondition', 1.0))
-        payment_urgency = float(invoice_data.get('paymentUrgency', 0.5))
-        market_trend = 0.0
-        market_volatility = 0.1
-        industry_seasonal_effect = 0.0
-        location_economic_index = 1.0
-
-        # Interaction features
-        credit_score_amount = credit_score_norm * log_amount
-        credit_score_market = credit_score_norm * market_condition
-        amount_market = log_amount * market_condition
-        efficiency_consistency = company_features['efficiency_all'] * company_features['consistency']
-
-        # Target encoding
-        segment_mapping = {'Reliable': 0.9, 'Average': 0.5, 'At-risk': 0.1}
-        industry_mapping = {'IT': 0.8, 'Finance': 0.7, 'Healthcare': 0.75, 'Retail': 0.6, 'Manufacturing': 0.65}
-        location_mapping = {'Mumbai': 0.8, 'Delhi': 0.75, 'Bangalore': 0.85, 'Chennai': 0.7, 'Hyderabad': 0.72}
-        payment_method_mapping = {'Bank Transfer': 0.7, 'Credit Card': 0.8, 'Cheque': 0.5, 'UPI': 0.9}
-
-        segment = invoice_data.get('customerSegment', 'Average')
-        industry = invoice_data.get('customerIndustry', 'IT')
-        location = invoice_data.get('customerLocation', 'Mumbai')
-        payment_method = invoice_data.get('paymentMethod', 'Bank Transfer')
-
-        industry_target_encoded = industry_mapping.get(industry, 0.7)
-        location_target_encoded = location_mapping.get(location, 0.75)
-        payment_method_target_encoded = payment_method_mapping.get(payment_method, 0.7)
-        segment_target_encoded = segment_mapping.get(segment, 0.5)
-
-        # Build feature arrays using real company behavioral features
-        sequence_features = np.array([
-            company_features['efficiency_3'], 
-            company_features['efficiency_7'], 
-            company_features['efficiency_all'],
-            company_features['velocity_avg'], 
-            company_features['consistency'], 
-            company_features['trend'],
-            company_features['frequency'], 
-            company_features['days_since_last']
-        ])
-
-        static_features = np.array([
-            log_amount, amount_sqrt, log_amount_per_due_day,
-            credit_score_norm, credit_score_squared, credit_score_cubed,
-            month_sin, month_cos, quarter_sin, quarter_cos,
-            day_of_week_sin, day_of_week_cos, day_of_month_sin, day_of_month_cos,
-            market_condition, payment_urgency, market_trend, market_volatility,
-            industry_seasonal_effect, location_economic_index,
-            credit_score_amount, credit_score_market, amount_market,
-            efficiency_consistency, industry_target_encoded, location_target_encoded,
-            payment_method_target_encoded, segment_target_encoded
-        ])
-
-        return sequence_features, static_features
-
-    except Exception as e:
-        logger.error(f"Error in feature engineering: {str(e)}")
-        raise e
+def read_ndjson_lines(stream, block_size=1 << 16):
+    """Yield the lines of a byte stream, reading it in blocks rather than byte by byte"""
+    pending = b''
+    for block in iter(lambda: stream.read(block_size), b''):
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+def read_ndjson_chunks(stream, chunk_size):
+    """Yield lists of at most chunk_size objects parsed from an NDJSON byte stream"""
+    chunk = []
+    for line_number, line in enumerate(read_ndjson_lines(stream), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            chunk.append(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f'Invalid JSON on line {line_number}: {e}')
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 # Company_34 Demonstration Utilities
 def setup_company_34_demo():
@@ -744,20 +798,21 @@ def setup_company_34_demo():
     logger.info(f"Setting up demo for {company_name}")
     
     # Clear existing history
-    company_history_db[company_name] = []
+    clear_company_history(company_name)
     
     # Add poor payment history (delayed payments)
     base_date = datetime.now() - timedelta(days=180)
+    records = []
     for i in range(8):
-        record = {
+        records.append({
             'date': base_date + timedelta(days=i*20),
             'amount': np.random.uniform(45000, 85000),
             'days_to_payment': np.random.uniform(35, 55),  # Delayed payments
             'payment_efficiency': np.random.uniform(0.3, 0.6)  # Poor efficiency
-        }
-        add_company_payment_record(company_name, record)
+        })
+    add_company_payment_records(company_name, records)
     
-    logger.info(f"Added {len(company_history_db[company_name])} poor payment records for {company_name}")
+    logger.info(f"Added {get_company_history_count(company_name)} poor payment records for {company_name}")
 
 def improve_company_34_history():
     """Improve Company_34's payment history to show model learning"""
@@ -766,16 +821,56 @@ def improve_company_34_history():
     
     # Add recent good payment history (early/on-time payments)
     base_date = datetime.now() - timedelta(days=60)
+    records = []
     for i in range(6):
-        record = {
+        records.append({
             'date': base_date + timedelta(days=i*10),
             'amount': np.random.uniform(50000, 90000),
             'days_to_payment': np.random.uniform(18, 28),  # Early/on-time payments
             'payment_efficiency': np.random.uniform(0.8, 0.95)  # High efficiency
-        }
-        add_company_payment_record(company_name, record)
+        })
+    add_company_payment_records(company_name, records)
     
-    logger.info(f"Added {len(company_history_db[company_name][-6:])} improved payment records for {company_name}")
+    logger.info(f"Added {len(records)} improved payment records for {company_name}")
+
+def log_sampled():
+    """True for the REQUEST_LOG_SAMPLE_RATE fraction of requests whose details are logged"""
+    return REQUEST_LOG_SAMPLE_RATE >= 1 or random.random() < REQUEST_LOG_SAMPLE_RATE
+
+# Request metrics, exposed in Prometheus text format on /metrics
+metrics = MetricsRegistry()
+metrics.histogram('request_duration_seconds', 'Request latency by endpoint', LATENCY_BUCKETS_S)
+metrics.histogram('request_stage_seconds', 'Time spent in each stage of a request', LATENCY_BUCKETS_S)
+metrics.counter('requests_total', 'Requests by endpoint and HTTP status')
+metrics.counter('predictions_total', 'Invoices scored by endpoint')
+metrics.gauge('model_info', 'Serving model; the value is 1 while a model is loaded', lambda: [
+    ({'engine': INFERENCE_ENGINE, 'version': active_model.version,
+      'trained_at': active_model.artifacts.get('timestamp', '')}, 1)
+] if active_model else [])
+metrics.gauge('history_companies', 'Companies in the payment-history store',
+              lambda: len(history_store.companies()))
+metrics.gauge('history_records', 'Payment records in the history store', lambda: history_store.total_records())
+metrics.gauge('feature_cache_entries', 'Company feature vectors in the feature cache',
+              lambda: feature_cache.stats()['entries'])
+for counter_name in ('hits', 'misses', 'evictions'):
+    metrics.gauge(f'feature_cache_{counter_name}_total', f'Feature cache {counter_name}',
+                  lambda counter_name=counter_name: feature_cache.stats()[counter_name], kind='counter')
+metrics.external_histogram('predict_micro_batch_size', 'Rows per micro-batched /predict model call',
+                           predict_batcher.batch_size_histogram)
+metrics.external_histogram('predict_micro_batch_queue_wait_ms', 'Milliseconds a /predict row waited for its batch',
+                           predict_batcher.queue_wait_histogram)
+
+@app.before_request
+def start_request_timer():
+    g.timer = StageTimer(metrics, request.endpoint or 'unmatched')
+    reload_model_if_replaced()
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.get('timer')
+    if timer is not None:
+        timer.finish(response.status_code)
+    return response
 
 # Flask API Endpoints
 @app.route('/health', methods=['GET'])
@@ -784,31 +879,187 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'model_loaded': ml_model is not None,
+        'model_version': active_model.version if active_model else None,
+        'ready': all(readiness_checks().values()),
+        'inference_engine': INFERENCE_ENGINE,
+        'history_backend': history_store.backend,
+        'pid': os.getpid(),
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 until the model is loaded, or once the worker is shutting down"""
+    checks = readiness_checks()
+    ready = all(checks.values())
+    return jsonify({
+        'ready': ready,
+        'checks': checks,
+        'pid': os.getpid(),
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
+@app.route('/startup-report', methods=['GET'])
+def startup_report_endpoint():
+    """Startup time spent on imports, artifact loading and first-inference warmup"""
+    return jsonify({
+        'success': True,
+        'inferenceEngine': INFERENCE_ENGINE,
+        'seconds': {stage: round(seconds, 4) for stage, seconds in startup_report.items()}
+    })
+
 @app.route('/train', methods=['POST'])
 def train_model_endpoint():
-    """Train the ML model"""
+    """Start training the ML model in a background job"""
     try:
-        success = train_model()
-        if success:
-            return jsonify({
-                'success': True,
-                'message': 'Model trained and loaded successfully',
-                'timestamp': datetime.now().isoformat()
-            })
+        data = request.get_json(silent=True) or {}
+        if data.get('mode', 'full') == 'incremental':
+            new_invoices_path = data.get('newInvoicesPath')
+            if not new_invoices_path or not os.path.exists(new_invoices_path):
+                return jsonify({
+                    'success': False,
+                    'message': 'Incremental training needs newInvoicesPath, an invoice file on the server'
+                }), 400
+            model_files = current_model_files()
+            if model_files is None:
+                return jsonify({
+                    'success': False,
+                    'message': 'No current model to fine-tune; run a full training first'
+                }), 400
+            params = {
+                'mode': 'incremental',
+                'new_invoices_path': new_invoices_path,
+                'base_model_path': model_files[0],
+                'base_artifacts_path': model_files[1],
+                'since': data.get('since'),
+                'epochs': int(data.get('epochs', 5)),
+                'replay_ratio': float(data.get('replayRatio', 1.0)),
+                'max_mae_regression': float(data.get('maxMaeRegression', 0.0))
+            }
         else:
+            params = {
+                'num_customers': int(data.get('numCustomers', 200)),
+                'num_invoices': int(data.get('numInvoices', 80000)),
+                'seed': int(data.get('seed', 42)),
+                'epochs': int(data.get('epochs', 100))
+            }
+        try:
+            job = training_jobs.start(params)
+        except RuntimeError as e:
             return jsonify({
                 'success': False,
-                'message': 'Failed to train model'
-            }), 500
+                'message': str(e)
+            }), 409
+        return jsonify({
+            'success': True,
+            'message': 'Training started; the new model is activated when the job completes',
+            'jobId': job.job_id,
+            'job': job.to_dict()
+        }), 202
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'Error training model: {str(e)}'
         }), 500
 
+@app.route('/train/jobs', methods=['GET'])
+def list_training_jobs():
+    """All training jobs, including those started by other worker processes"""
+    return jsonify({
+        'success': True,
+        'jobs': training_jobs.list_jobs()
+    })
+
+@app.route('/train/jobs/<job_id>', methods=['GET'])
+def get_training_job(job_id):
+    """Status, phase, epoch and metrics of one training job"""
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': f'Training job {job_id} not found'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+@app.route('/train/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_training_job(job_id):
+    """Stop a running training job; the serving model is left untouched"""
+    if training_jobs.get(job_id) is None:
+        return jsonify({
+            'success': False,
+            'message': f'Training job {job_id} not found'
+        }), 404
+    if not training_jobs.cancel(job_id):
+        return jsonify({
+            'success': False,
+            'message': f'Training job {job_id} is not running'
+        }), 409
+    return jsonify({
+        'success': True,
+        'job': training_jobs.get(job_id)
+    })
+
+@app.route('/models', methods=['GET'])
+def list_model_versions():
+    """Registered model versions, the current one and the one this worker serves"""
+    return jsonify({
+        'success': True,
+        'current': model_registry.current(),
+        'serving': active_model.version if active_model else None,
+        'versions': model_registry.versions()
+    })
+
+@app.route('/models/<version>/activate', methods=['POST'])
+def activate_model_version(version):
+    """Load, warm up and activate a registered version; in-flight requests finish on the old one"""
+    if model_registry.metadata(version) is None:
+        return jsonify({
+            'success': False,
+            'message': f'Model version {version} not found'
+        }), 404
+    try:
+        activate_version(version)
+        logger.info(f"Model version {version} activated")
+        return jsonify({
+            'success': True,
+            'current': version
+        })
+    except Exception as e:
+        logger.error(f"Error activating model version {version}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error activating model version {version}: {str(e)}'
+        }), 500
+
+@app.route('/models/rollback', methods=['POST'])
+def rollback_model_version():
+    """Activate the version that was current before the current one"""
+    try:
+        version = model_registry.previous()
+        if version is None:
+            return jsonify({
+                'success': False,
+                'message': 'No earlier model version to roll back to'
+            }), 409
+        # Loaded and warmed before the pointer moves, like an activation
+        serving_model = load_model_version(version)
+        model_registry.rollback()
+        activate_model(serving_model)
+        logger.info(f"Rolled back to model version {version}")
+        return jsonify({
+            'success': True,
+            'current': version
+        })
+    except Exception as e:
+        logger.error(f"Error rolling back model: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error rolling back model: {str(e)}'
+        }), 500
+
 @app.route('/predict', methods=['POST'])
 def predict_payment():
     """Make payment prediction with enhanced company learning"""
@@ -829,24 +1080,30 @@ def predict_payment():
                     'success': False,
                     'message': f'Missing required field: {field}'
                 }), 400
+        try:
+            uncertainty = uncertainty_options(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid uncertainty options: {str(e)}'
+            }), 400
+        timer = g.timer
+        timer.mark('parse')
+        serving_model = active_model
 
-        # Engineer features with real company behavioral data
-        sequence_features, static_features = engineer_features_for_prediction(data)
-
-        # Scale features
-        sequence_scaled = sequence_scaler.transform([sequence_features])
-        static_scaled = static_scaler.transform([static_features])
+        # Counted from here so an open micro-batch waits for this request's row rather than flushing
+        with predict_batcher.in_flight():
+            # Engineer features with real company behavioral data
+            sequence_features, static_features = engineer_features_for_prediction(data, timer, serving_model)
 
-        # Make prediction
-        prediction = ml_model.predict([sequence_scaled, static_scaled])
-        predicted_days = float(prediction[0][0])
+            # Scale features and make prediction
+            predicted_days = predict_days_single(sequence_features, static_features, timer, serving_model)
 
         # Calculate confidence based on company history quality
-        company_features = calculate_company_behavioral_features(data.get('customerName', 'Company_1'))
-        history_quality = len(get_company_payment_history(data.get('customerName', 'Company_1')))
-        base_confidence = 0.6 + (min(history_quality, 20) / 20) * 0.3  # 0.6 to 0.9 based on history
-        confidence_score = min(0.95, max(0.6, base_confidence + np.random.normal(0, 0.05)))
-        
+        history_quality = get_company_history_count(data.get('customerName', 'Company_1'))
+        timer.mark('history_count')
+        confidence_score = 0.6 + (min(history_quality, 20) / 20) * 0.3  # 0.6 to 0.9 based on history
+
         due_days = int(data['paymentDueDays'])
         delay_ratio = predicted_days / due_days
 
@@ -857,18 +1114,29 @@ def predict_payment():
         else:
             risk_level = 'high'
 
-        logger.info(f"Prediction for {data.get('customerName')}: {predicted_days:.1f} days (confidence: {confidence_score:.2f})")
+        if log_sampled():
+            logger.info(f"Prediction for {data.get('customerName')}: {predicted_days:.1f} days (confidence: {confidence_score:.2f})")
 
-        return jsonify({
+        prediction = {
+            'predictedDaysToPayment': round(predicted_days, 1),
+            'confidenceScore': round(confidence_score, 2),
+            'riskLevel': risk_level,
+            'delayRatio': round(delay_ratio, 2),
+            'companyHistoryRecords': history_quality,
+            'modelVersion': serving_model.version
+        }
+        if uncertainty is not None:
+            intervals = predict_days_intervals(sequence_features[None, :], static_features[None, :],
+                                               serving_model, *uncertainty, timer=timer)
+            prediction['uncertainty'] = interval_fields(intervals, 0)
+
+        response = jsonify({
             'success': True,
-            'prediction': {
-                'predictedDaysToPayment': round(predicted_days, 1),
-                'confidenceScore': round(confidence_score, 2),
-                'riskLevel': risk_level,
-                'delayRatio': round(delay_ratio, 2),
-                'companyHistoryRecords': len(get_company_payment_history(data.get('customerName', 'Company_1')))
-            }
+            'prediction': prediction
         })
+        timer.mark('serialize')
+        metrics.inc('predictions_total', endpoint='predict_payment')
+        return response
 
     except Exception as e:
         logger.error(f"Error in prediction: {str(e)}")
@@ -877,45 +1145,164 @@ def predict_payment():
             'message': f'Prediction error: {str(e)}'
         }), 500
 
-@app.route('/customer-risk/<customer_name>', methods=['GET'])
-def get_customer_risk(customer_name):
-    """Get customer risk assessment using real company behavioral data"""
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Latency histograms, counters, model, history store and cache statistics for Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/predict/batching', methods=['GET'])
+def predict_batching_stats():
+    """Micro-batching configuration, queue depth and batch-size / queue-wait histograms"""
+    return jsonify({
+        'success': True,
+        'enabled': MICRO_BATCHING,
+        'batching': predict_batcher.stats()
+    })
+
+@app.route('/feature-cache', methods=['GET'])
+def feature_cache_stats():
+    """Size and hit / miss / eviction counters of the company feature-vector cache"""
+    return jsonify({
+        'success': True,
+        'cache': feature_cache.stats()
+    })
+
+def risk_query_options(params, default_limit=None):
+    """(limit, RiskIndex.top filters) of a risk query's query args or JSON body
+
+    Raises ValueError with the message to return when a value is malformed.
+    """
+    level = params.get('level')
+    trend = params.get('trend')
+    if level is not None and level not in RISK_LEVELS:
+        raise ValueError(f"level must be one of {', '.join(RISK_LEVELS)}")
+    if trend is not None and trend not in TRENDS:
+        raise ValueError(f"trend must be one of {', '.join(TRENDS)}")
     try:
-        company_features = calculate_company_behavioral_features(customer_name)
-        history_records = len(get_company_payment_history(customer_name))
-        
-        # Calculate risk based on actual company efficiency
-        avg_efficiency = company_features['efficiency_all']
-        consistency = company_features['consistency']
-        
-        # Risk calculation based on efficiency and consistency
-        risk_score = (1 - avg_efficiency) * 70 + (1 - consistency) * 30
-        
-        if risk_score <= 25:
-            risk_level = 'low'
-        elif risk_score <= 50:
-            risk_level = 'medium'
-        else:
-            risk_level = 'high'
+        limit = params.get('limit', default_limit)
+        limit = None if limit is None else int(limit)
+        min_history = int(params.get('minHistory', 0))
+        min_score, max_score = (None if params.get(name) is None else float(params[name])
+                                for name in ('minScore', 'maxScore'))
+    except (TypeError, ValueError):
+        raise ValueError('limit and minHistory must be integers, minScore and maxScore numbers')
+    if (limit is not None and limit < 0) or min_history < 0:
+        raise ValueError('limit and minHistory must not be negative')
+    if any(score is not None and not np.isfinite(score) for score in (min_score, max_score)):
+        raise ValueError('minScore and maxScore must be finite')
+    return limit, {'level': level, 'trend': trend, 'min_history': min_history,
+                   'min_score': min_score, 'max_score': max_score}
+
+@app.route('/customer-risk', methods=['GET'])
+def get_portfolio_risk():
+    """Riskiest companies across the portfolio, optionally filtered by level, trend, history and score"""
+    try:
+        timer = g.timer
+        try:
+            limit, filters = risk_query_options(request.args, default_limit=100)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        timer.mark('parse')
 
-        # Calculate average delay from efficiency
-        avg_delay_days = (1 - avg_efficiency) * 20  # Convert efficiency to delay days
-        payment_reliability = avg_efficiency * 100
+        risk_index.refresh()
+        timer.mark('index_refresh')
+        entries = risk_index.top(limit, **filters)
+        timer.mark('risk_query')
 
+        response = jsonify({
+            'success': True,
+            'customers': [entry.to_dict() for entry in entries],
+            'indexedCompanies': len(risk_index)
+        })
+        timer.mark('serialize')
+        return response
+
+    except Exception as e:
         return jsonify({
+            'success': False,
+            'message': f'Error querying portfolio risk: {str(e)}'
+        }), 500
+
+@app.route('/customer-risk/batch', methods=['POST'])
+def get_customer_risk_batch():
+    """Risk assessments of a list of customers, e.g. a segment, with a summary
+
+    Takes the GET /customer-risk filters and limit, applied in request order.
+    """
+    try:
+        data = request.get_json()
+        customer_names = data.get('customers', [])
+
+        if not customer_names:
+            return jsonify({
+                'success': False,
+                'message': 'No customers provided'
+            }), 400
+        try:
+            limit, filters = risk_query_options(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+
+        timer = g.timer
+        timer.mark('parse')
+        risk_index.refresh()
+        timer.mark('index_refresh')
+
+        customers = []
+        distribution = dict.fromkeys(RISK_LEVELS, 0)
+        for name in customer_names:
+            if limit is not None and len(customers) >= limit:
+                break
+            entry = risk_index.get(name)
+            if entry is None:
+                # Default values for companies without history
+                entry = RiskEntry(name, DEFAULT_COMPANY_FEATURES, 0)
+            if entry.matches(**filters):
+                assessment = entry.to_dict()
+                distribution[assessment['riskLevel']] += 1
+                customers.append(assessment)
+        timer.mark('risk_scoring')
+
+        average_score = sum(c['riskScore'] for c in customers) / len(customers) if customers else 0.0
+        response = jsonify({
             'success': True,
-            'customerName': customer_name,
-            'riskLevel': risk_level,
-            'riskScore': round(risk_score, 1),
-            'averageDelayDays': round(avg_delay_days, 1),
-            'paymentReliability': round(payment_reliability, 1),
-            'historyRecords': history_records,
-            'companyFeatures': {
-                'efficiency': round(avg_efficiency, 3),
-                'consistency': round(consistency, 3),
-                'trend': round(company_features['trend'], 3)
+            'customers': customers,
+            'summary': {
+                'customers': len(customers),
+                'averageRiskScore': round(average_score, 1),
+                'riskDistribution': distribution
             }
         })
+        timer.mark('serialize')
+        return response
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error calculating customer risk: {str(e)}'
+        }), 500
+
+@app.route('/customer-risk/<customer_name>', methods=['GET'])
+def get_customer_risk(customer_name):
+    """Get customer risk assessment using real company behavioral data"""
+    try:
+        timer = g.timer
+        company_features = calculate_company_behavioral_features(customer_name)
+        history_records = get_company_history_count(customer_name)
+        timer.mark('history_lookup')
+
+        assessment = risk_assessment(company_features, history_records)
+        timer.mark('risk_scoring')
+
+        response = jsonify(dict({'success': True, 'customerName': customer_name}, **assessment))
+        timer.mark('serialize')
+        return response
 
     except Exception as e:
         return jsonify({
@@ -941,63 +1328,258 @@ def generate_forecast():
                 'success': False,
                 'message': 'No invoices provided'
             }), 400
+        try:
+            uncertainty = uncertainty_options(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid uncertainty options: {str(e)}'
+            }), 400
 
-        forecasts = []
-        total_amount = 0
-        total_predicted_days = 0
-        risk_distribution = {'low': 0, 'medium': 0, 'high': 0}
+        timer = g.timer
+        timer.mark('parse')
 
-        for invoice in invoices:
-            sequence_features, static_features = engineer_features_for_prediction(invoice)
+        # Score the whole portfolio in one pass, with one model version
+        serving_model = active_model
+        amounts, predicted_days, risk_levels, forecasts = forecast_invoices(invoices, serving_model, timer,
+                                                                            uncertainty)
+        summary = ForecastSummary()
+        summary.add(amounts, predicted_days, risk_levels)
+        timer.mark('summary')
 
-            sequence_scaled = sequence_scaler.transform([sequence_features])
-            static_scaled = static_scaler.transform([static_features])
-            prediction = ml_model.predict([sequence_scaled, static_scaled])
+        response = jsonify({
+            'success': True,
+            'forecast': dict(summary.to_dict(), individualForecasts=forecasts),
+            'modelVersion': serving_model.version
+        })
+        timer.mark('serialize')
+        metrics.inc('predictions_total', len(invoices), endpoint='generate_forecast')
+        return response
 
-            predicted_days = float(prediction[0][0])
-            amount = float(invoice.get('amount', 0))
-            due_days = int(invoice.get('paymentDueDays', 30))
+    except Exception as e:
+        logger.error(f"Error generating forecast: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Forecast error: {str(e)}'
+        }), 500
 
-            delay_ratio = predicted_days / due_days
-            if delay_ratio <= 3:
-                risk_level = 'low'
-            elif delay_ratio <= 6:
-                risk_level = 'medium'
-            else:
-                risk_level = 'high'
-
-            risk_distribution[risk_level] += 1
-            total_amount += amount
-            total_predicted_days += predicted_days
-
-            forecasts.append({
-                'invoiceId': invoice.get('invoiceId', ''),
-                'customerName': invoice.get('customerName', ''),
-                'amount': amount,
-                'predictedDays': round(predicted_days, 1),
-                'riskLevel': risk_level,
-                'expectedPaymentDate': (datetime.now() + timedelta(days=predicted_days)).isoformat()
-            })
+@app.route('/forecast/stream', methods=['POST'])
+def generate_forecast_stream():
+    """Stream forecasts for an NDJSON portfolio: one result line per invoice, then a summary line"""
+    if ml_model is None:
+        return jsonify({
+            'success': False,
+            'message': 'Model not loaded. Please train the model first.'
+        }), 400
+
+    # One model serves the whole stream, even if a new one is activated meanwhile
+    serving_model = active_model
+
+    def generate():
+        summary = ForecastSummary()
+        try:
+            for invoices in read_ndjson_chunks(request.stream, FORECAST_STREAM_CHUNK_SIZE):
+                amounts, predicted_days, risk_levels, forecasts = forecast_invoices(invoices, serving_model)
+                summary.add(amounts, predicted_days, risk_levels)
+                metrics.inc('predictions_total', len(invoices), endpoint='generate_forecast_stream')
+                yield ''.join(json.dumps(forecast) + '\n' for forecast in forecasts)
+        except Exception as e:
+            # Headers are already sent, so errors are reported in-band and end the stream
+            logger.error(f"Error streaming forecast: {str(e)}")
+            yield json.dumps({'success': False, 'message': f'Forecast error: {str(e)}'}) + '\n'
+            return
+        yield json.dumps({'success': True, 'summary': summary.to_dict(), 'modelVersion': serving_model.version}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/forecast/scenarios', methods=['POST'])
+def generate_scenario_forecast():
+    """What-if sweep: score a set of invoices under every point of a parameter grid"""
+    try:
+        if ml_model is None:
+            return jsonify({
+                'success': False,
+                'message': 'Model not loaded. Please train the model first.'
+            }), 400
 
-        avg_predicted_days = total_predicted_days / len(invoices) if invoices else 0
+        data = request.get_json()
+        invoices = data.get('invoices', [])
+        grid = data.get('grid', {})
 
-        return jsonify({
+        if not invoices:
+            return jsonify({
+                'success': False,
+                'message': 'No invoices provided'
+            }), 400
+        if not grid or not isinstance(grid, dict):
+            return jsonify({
+                'success': False,
+                'message': f"No grid provided; give lists of values for any of {', '.join(SCENARIO_PARAMETERS)}"
+            }), 400
+        try:
+            scenarios, scenario_columns = scenario_grid(grid)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid grid: {str(e)}'
+            }), 400
+
+        timer = g.timer
+        timer.mark('parse')
+
+        serving_model = active_model
+        amounts, due_days, predicted_days = sweep_scenarios(invoices, scenario_columns, serving_model, timer)
+        results, curves = summarize_scenarios(grid, scenarios, amounts, due_days, predicted_days)
+        timer.mark('summary')
+
+        response = jsonify({
             'success': True,
-            'forecast': {
-                'totalAmount': total_amount,
-                'totalInvoices': len(invoices),
-                'averagePredictedDays': round(avg_predicted_days, 1),
-                'riskDistribution': risk_distribution,
-                'individualForecasts': forecasts,
-                'generatedAt': datetime.now().isoformat()
+            'totalInvoices': len(invoices),
+            'totalAmount': float(amounts.sum()),
+            'scenarioCount': len(scenarios),
+            'scenarios': results,
+            'curves': curves,
+            'modelVersion': serving_model.version
+        })
+        timer.mark('serialize')
+        metrics.inc('predictions_total', predicted_days.size, endpoint='generate_scenario_forecast')
+        return response
+
+    except Exception as e:
+        logger.error(f"Error generating scenario forecast: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Scenario forecast error: {str(e)}'
+        }), 500
+
+@app.route('/forecast/cashflow', methods=['POST'])
+def generate_cashflow_forecast():
+    """Expected collections of a set of invoices per day, week or month, optionally broken down"""
+    try:
+        if ml_model is None:
+            return jsonify({
+                'success': False,
+                'message': 'Model not loaded. Please train the model first.'
+            }), 400
+
+        data = request.get_json()
+        invoices = data.get('invoices', [])
+        bucket = data.get('bucket', 'week')
+        group_by = data.get('groupBy')
+
+        if not invoices:
+            return jsonify({
+                'success': False,
+                'message': 'No invoices provided'
+            }), 400
+        if bucket not in CASHFLOW_BUCKETS or (group_by is not None and group_by not in CASHFLOW_GROUPS):
+            return jsonify({
+                'success': False,
+                'message': f"bucket must be one of {', '.join(CASHFLOW_BUCKETS)} and groupBy one of "
+                           f"{', '.join(CASHFLOW_GROUPS)}"
+            }), 400
+        try:
+            horizon_days = int(data.get('horizonDays', CASHFLOW_HORIZON_DAYS))
+            max_groups = int(data.get('maxGroups', CASHFLOW_MAX_GROUPS))
+            if horizon_days <= 0 or max_groups <= 0:
+                raise ValueError('horizonDays and maxGroups must be positive')
+            uncertainty = uncertainty_options(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid cash-flow options: {str(e)}'
+            }), 400
+
+        timer = g.timer
+        timer.mark('parse')
+
+        # Point predictions, and with "uncertainty" the draws each invoice's amount is spread over
+        serving_model = active_model
+        sequence_scaled, static_matrix = engineer_features_for_batch(invoices, serving_model, timer)
+        predicted_days = predict_days_batch(sequence_scaled, static_matrix, serving_model, timer)
+        payment_days = predicted_days
+        if uncertainty is not None:
+            payment_days = predict_days_samples(sequence_scaled, static_matrix, serving_model, *uncertainty,
+                                                timer=timer)
+
+        amounts = np.array([float(invoice.get('amount', 0)) for invoice in invoices])
+        group_names, group_codes = [None], None
+        if group_by is not None:
+            due_days = np.array([int(invoice.get('paymentDueDays', 30)) for invoice in invoices])
+            group_names, group_codes = cashflow_groups(invoices, group_by,
+                                                       classify_risk_levels(predicted_days, due_days))
+        starts, bucket_amounts, beyond = cashflow_histogram(amounts, payment_days, bucket, horizon_days,
+                                                            group_codes=group_codes, num_groups=len(group_names))
+        timer.mark('cashflow_buckets')
+
+        cashflow = {
+            'bucket': bucket,
+            'horizonDays': horizon_days,
+            'bucketStarts': np.datetime_as_string(starts).tolist(),
+            'amounts': np.round(bucket_amounts.sum(axis=0), 2).tolist(),
+            'beyondHorizon': round(float(beyond.sum()), 2),
+            'totalAmount': float(amounts.sum()),
+            'totalInvoices': len(invoices),
+            'averagePredictedDays': round(float(predicted_days.mean()), 1)
+        }
+        if uncertainty is not None:
+            cashflow['samples'] = payment_days.shape[1]
+        if group_by is not None:
+            if len(group_names) > max_groups:
+                group_names, bucket_amounts, beyond = largest_groups(group_names, bucket_amounts, beyond, max_groups)
+            cashflow['groupBy'] = group_by
+            cashflow['groups'] = {
+                'names': group_names,
+                'amounts': np.round(bucket_amounts, 2).tolist(),
+                'beyondHorizon': np.round(beyond, 2).tolist()
             }
+
+        response = jsonify({
+            'success': True,
+            'cashflow': cashflow,
+            'modelVersion': serving_model.version
         })
+        timer.mark('serialize')
+        metrics.inc('predictions_total', len(invoices), endpoint='generate_cashflow_forecast')
+        return response
 
     except Exception as e:
-        logger.error(f"Error generating forecast: {str(e)}")
+        logger.error(f"Error generating cash-flow forecast: {str(e)}")
         return jsonify({
             'success': False,
-            'message': f'Forecast error: {str(e)}'
+            'message': f'Cash-flow forecast error: {str(e)}'
+        }), 500
+
+@app.route('/history/ingest', methods=['POST'])
+def ingest_history_endpoint():
+    """Bulk-load payment history from a CSV, Parquet or Arrow IPC file"""
+    try:
+        # Either a multipart upload named 'file' or the raw file as the request body
+        upload = request.files.get('file')
+        if upload is not None:
+            source, filename = upload.stream, upload.filename
+        else:
+            source, filename = io.BytesIO(request.get_data()), None
+        fmt = request.args.get('format') or detect_format(filename)
+
+        stats = ingest_history(history_store, source, fmt)
+        logger.info(f"Ingested {stats['rows']} payment records for {stats['companies']} companies "
+                    f"({stats['rowsPerSecond']} rows/s)")
+        return jsonify({
+            'success': True,
+            'ingest': stats
+        })
+
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error ingesting history: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Ingest error: {str(e)}'
         }), 500
 
 # Company_34 Demo Endpoints
@@ -1009,7 +1591,7 @@ def setup_company_34_demo_endpoint():
         return jsonify({
             'success': True,
             'message': 'Company_34 demo setup completed with poor payment history',
-            'historyRecords': len(company_history_db.get('Company_34', []))
+            'historyRecords': get_company_history_count('Company_34')
         })
     except Exception as e:
         return jsonify({
@@ -1025,7 +1607,7 @@ def improve_company_34_demo_endpoint():
         return jsonify({
             'success': True,
             'message': 'Company_34 payment history improved',
-            'historyRecords': len(company_history_db.get('Company_34', []))
+            'historyRecords': get_company_history_count('Company_34')
         })
     except Exception as e:
         return jsonify({
@@ -1038,11 +1620,21 @@ if __name__ == '__main__':
     print("🚀 ENHANCED PAYMENT PREDICTION ML + FLASK API SERVER")
     print("=" * 60)
     print("📋 Available endpoints:")
-    print("   POST /train - Train the ML model")
+    print("   POST /train - Start a background training job")
+    print("   GET  /train/jobs/<id> - Training job progress")
+    print("   GET  /models - Model versions; POST /models/<version>/activate, /models/rollback")
     print("   GET  /health - Health check")
+    print("   GET  /ready - Readiness check")
+    print("   GET  /metrics - Prometheus metrics")
     print("   POST /predict - Single prediction (enhanced with company learning)")
     print("   GET  /customer-risk/<name> - Customer risk assessment (enhanced)")
+    print("   GET  /customer-risk - Riskiest customers across the portfolio")
+    print("   POST /customer-risk/batch - Risk assessments of a list of customers")
     print("   POST /forecast - Bulk predictions")
+    print("   POST /forecast/stream - Streaming NDJSON bulk predictions")
+    print("   POST /forecast/scenarios - What-if sweep over a parameter grid")
+    print("   POST /forecast/cashflow - Expected collections per day, week or month")
+    print("   POST /history/ingest - Bulk payment-history ingest (CSV / Parquet / Arrow)")
     print("   POST /demo/company-34/setup - Setup Company_34 demo")
     print("   POST /demo/company-34/improve - Improve Company_34 history")
     print("=" * 60)
@@ -1051,6 +1643,7 @@ if __name__ == '__main__':
     print("🔍 Checking for existing model files...")
     if load_existing_model():
         print("✅ Existing model loaded successfully!")
+        print("⏱️  Startup: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in startup_report.items()))
     else:
         print("ℹ️  No existing model found. Call POST /train to train a new model.")
     
@@ -1058,4 +1651,5 @@ if __name__ == '__main__':
     print("💡 Enhanced with real-time company learning!")
     print("🎯 Company_34 demo ready for department presentation!")
     print("=" * 60)
+    # Development server; run `gunicorn -c gunicorn.conf.py app:app` in production
     app.run(debug=True, host='0.0.0.0', port=5173)
@@ -0,0 +1,698 @@
+"""Benchmarks for the payment prediction backend.
+
+Usage:
+    python benchmarks.py rolling-features --rows 80000 5000000
+    python benchmarks.py inference-parity
+    python benchmarks.py inference-latency --batch-sizes 1 10 100 1000 10000
+    python benchmarks.py uncertainty --rows 1 1000 10000 [--samples 30] [--check]
+    python benchmarks.py training-memory --rows 80000 1000000
+    python benchmarks.py partitioned-features --rows 2000000 --shards 16 [--workers 4] [--check]
+    python benchmarks.py feature-skew [--rows 20000] [--sample 500] [--incremental]
+    python benchmarks.py micro-batching [--clients 1 16] [--requests 300]
+    python benchmarks.py suite [--quick] [--output results.json] [--save-baseline] [--threshold 0.2]
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import app
+from history_store import InMemoryHistoryStore
+from feature_engineering import (generate_improved_synthetic_data, add_company_behavioral_features,
+                                 engineer_continuous_features, prepare_continuous_data, GlobalAggregates,
+                                 SEQUENCE_FEATURES, STATIC_FEATURES)
+from feature_spec import compile_features, TARGET_DEPENDENT_FEATURES
+from training import training_split_order
+from partitioned_features import engineer_partitioned_features, read_invoice_chunks, read_partitioned_features
+from numpy_inference import NumpyPaymentModel, export_numpy_weights
+
+# Stored suite results that later runs are compared against
+BENCHMARK_BASELINE_PATH = 'benchmark_baseline.json'
+
+COMPANY_FEATURE_COLUMNS = [
+    'CompanyEfficiency_3', 'CompanyEfficiency_7', 'CompanyEfficiency_All',
+    'CompanyVelocity_Avg', 'CompanyConsistency', 'CompanyTrend'
+]
+
+def reference_company_behavioral_features(df):
+    """Original groupby/lambda + rolling polyfit implementation, kept for parity checks"""
+    df['CompanyEfficiency_3'] = df.groupby('Company')['PaymentEfficiency'].transform(
+        lambda x: x.shift(1).rolling(3, min_periods=1).mean()
+    )
+    df['CompanyEfficiency_7'] = df.groupby('Company')['PaymentEfficiency'].transform(
+        lambda x: x.shift(1).rolling(7, min_periods=1).mean()
+    )
+    df['CompanyEfficiency_All'] = df.groupby('Company')['PaymentEfficiency'].transform(
+        lambda x: x.shift(1).expanding().mean()
+    )
+
+    df['PaymentVelocity'] = df['DaysToPayment'] / (df['LogInvoiceAmount'] + 1)
+    df['CompanyVelocity_Avg'] = df.groupby('Company')['PaymentVelocity'].transform(
+        lambda x: x.shift(1).expanding().mean()
+    )
+
+    df['CompanyConsistency'] = df.groupby('Company')['PaymentEfficiency'].transform(
+        lambda x: 1 / (1 + x.shift(1).rolling(5, min_periods=2).std().fillna(0.5))
+    )
+
+    def calculate_trend(series):
+        if len(series) < 3:
+            return 0
+        x = np.arange(len(series))
+        y = series.values
+        return np.polyfit(x, y, 1)[0]
+
+    df['CompanyTrend'] = df.groupby('Company')['PaymentEfficiency'].transform(
+        lambda x: x.shift(1).rolling(7, min_periods=3).apply(calculate_trend)
+    )
+    return df
+
+def prepare_company_frame(num_invoices):
+    """Synthetic invoices sorted the way engineer_continuous_features sorts them"""
+    num_customers = max(200, num_invoices // 400)
+    df = generate_improved_synthetic_data(num_customers, num_invoices)
+    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
+    df = df.sort_values(['Company', 'InvoiceDate']).reset_index(drop=True)
+    df['LogInvoiceAmount'] = np.log1p(df['InvoiceAmount'])
+    return df
+
+def benchmark_rolling_features(rows, run_reference=True, atol=1e-6):
+    """Time the closed-form company features against the reference implementation
+
+    The features are stored as float32 (FEATURE_DTYPE), so they match the
+    float64 reference to float32 precision.
+    """
+    for num_invoices in rows:
+        df = prepare_company_frame(num_invoices)
+
+        start = time.perf_counter()
+        fast = add_company_behavioral_features(df.copy())
+        fast_seconds = time.perf_counter() - start
+        print(f"{num_invoices:>10} rows  closed-form: {fast_seconds:8.3f}s")
+
+        if not run_reference:
+            continue
+
+        start = time.perf_counter()
+        reference = reference_company_behavioral_features(df.copy())
+        reference_seconds = time.perf_counter() - start
+        print(f"{num_invoices:>10} rows  reference:   {reference_seconds:8.3f}s  "
+              f"speedup: {reference_seconds / fast_seconds:.1f}x")
+
+        for col in COMPANY_FEATURE_COLUMNS:
+            expected = reference[col].to_numpy(dtype=float)
+            actual = fast[col].to_numpy(dtype=float)
+            if not np.allclose(actual, expected, atol=atol, rtol=0, equal_nan=True):
+                max_diff = np.nanmax(np.abs(actual - expected))
+                raise AssertionError(f"{col} differs from reference (max abs diff {max_diff:.3g})")
+        print(f"{num_invoices:>10} rows  parity: all company features match within {atol:g}")
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def _measure_training_pipeline(num_invoices, results):
+    """Run generate -> engineer -> prepare -> split in this (fresh) process and report its peak memory"""
+    start_rss = peak_rss_mb()
+    start = time.perf_counter()
+    synthetic = generate_improved_synthetic_data(max(200, num_invoices // 400), num_invoices, 42)
+    engineered = engineer_continuous_features(synthetic)
+    del synthetic
+    frame_mb = engineered.memory_usage(deep=True).sum() / 2 ** 20
+    X_seq, X_static, y = prepare_continuous_data(engineered)[:3]
+    del engineered
+    order, _, _ = training_split_order(len(y))
+    X_seq, X_static, y = X_seq[order], X_static[order], y[order]
+    results.put({
+        'rows': num_invoices,
+        'seconds': time.perf_counter() - start,
+        'peak_rss_mb': peak_rss_mb() - start_rss,
+        'frame_mb': frame_mb,
+        'matrix_mb': (X_seq.nbytes + X_static.nbytes + y.nbytes) / 2 ** 20
+    })
+
+def benchmark_training_memory(rows):
+    """Peak memory of the training data pipeline, each size in a fresh process"""
+    context = multiprocessing.get_context('spawn')
+    for num_invoices in rows:
+        results = context.Queue()
+        process = context.Process(target=_measure_training_pipeline, args=(num_invoices, results))
+        process.start()
+        result = results.get()
+        process.join()
+        print(f"{result['rows']:>10} rows  peak RSS +{result['peak_rss_mb']:8.0f} MB  "
+              f"engineered frame {result['frame_mb']:7.0f} MB  matrices {result['matrix_mb']:7.0f} MB  "
+              f"{result['seconds']:7.2f}s")
+
+def write_synthetic_invoices(path, num_invoices, chunk_rows=500000):
+    """Write synthetic invoices to a Parquet file (CSV without pyarrow) chunk by chunk"""
+    if not path.endswith('.csv'):
+        import pyarrow
+        import pyarrow.parquet
+
+    num_customers = max(200, num_invoices // 400)
+    writer = None
+    for i, start in enumerate(range(0, num_invoices, chunk_rows)):
+        chunk = generate_improved_synthetic_data(num_customers, min(chunk_rows, num_invoices - start), 42 + i)
+        chunk['InvoiceID'] = np.arange(start, start + len(chunk))
+        chunk = chunk.astype({col: str for col in chunk.columns if isinstance(chunk[col].dtype, pd.CategoricalDtype)})
+        if path.endswith('.csv'):
+            chunk.to_csv(path, mode='a', header=i == 0, index=False)
+            continue
+        table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+        writer = writer or pyarrow.parquet.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+    if writer:
+        writer.close()
+
+def benchmark_partitioned_features(rows, shards, workers, check=False, atol=1e-5):
+    """Time company-partitioned feature engineering, optionally checking it against the in-memory path"""
+    extension = '.parquet' if importlib.util.find_spec('pyarrow') else '.csv'
+
+    work_dir = tempfile.mkdtemp(prefix='partitioned-features-')
+    try:
+        for num_invoices in rows:
+            source = os.path.join(work_dir, f'invoices-{num_invoices}{extension}')
+            output_dir = os.path.join(work_dir, f'features-{num_invoices}')
+            write_synthetic_invoices(source, num_invoices)
+
+            stats = engineer_partitioned_features(source, output_dir, num_shards=shards, workers=workers)
+            print(f"{num_invoices:>10} rows  {stats['shards']} shards, {stats['workers']} workers: "
+                  f"{stats['seconds']:7.2f}s (partition {stats['partitionSeconds']:.2f}s, "
+                  f"engineer {stats['engineerSeconds']:.2f}s, fill {stats['fillSeconds']:.2f}s)  "
+                  f"parent peak RSS {peak_rss_mb():.0f} MB")
+
+            if check:
+                # Needs the whole file in memory: only for sizes the in-memory path can handle
+                raw = pd.concat(read_invoice_chunks(source, extension[1:]), ignore_index=True)
+                expected = engineer_continuous_features(raw).sort_values('InvoiceID', ignore_index=True)
+                del raw
+                actual = read_partitioned_features(output_dir).sort_values('InvoiceID', ignore_index=True)
+                for col in expected.select_dtypes('number').columns:
+                    expected_values = expected[col].to_numpy(dtype=float)
+                    actual_values = actual[col].to_numpy(dtype=float)
+                    if not np.allclose(actual_values, expected_values, atol=atol, rtol=0, equal_nan=True):
+                        max_diff = np.nanmax(np.abs(actual_values - expected_values))
+                        raise AssertionError(f"{col} differs from in-memory engineering (max abs diff {max_diff:.3g})")
+                print(f"{num_invoices:>10} rows  parity: all {expected.shape[1]} columns match in-memory "
+                      f"engineering within {atol:g}")
+            shutil.rmtree(output_dir)
+            os.remove(source)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def skew_request(row):
+    """The /predict request of one engineered invoice row"""
+    return {
+        'customerName': row.Company,
+        'amount': float(row.InvoiceAmount),
+        'paymentDueDays': int(row.PaymentDueDays),
+        'customerCreditScore': int(row.CustomerCreditScore),
+        'marketCondition': float(row.MarketCondition),
+        'paymentUrgency': float(row.PaymentUrgency),
+        'customerIndustry': row.Industry,
+        'customerLocation': row.Location,
+        'paymentMethod': row.PaymentMethod,
+        'customerSegment': row.Segment,
+        'invoiceDate': row.InvoiceDate.isoformat()
+    }
+
+def benchmark_feature_skew(num_invoices=20000, sample=500, seed=0, rtol=1e-5, atol=1e-5, incremental=False):
+    """Check that serving builds the same model inputs as training for the same invoices
+
+    Synthetic invoices are engineered the way training does. A sample of them
+    is then rebuilt the way /predict does, from request dicts, a history store
+    holding every earlier invoice of their companies and the training data's
+    PortfolioStatistics. Every feature must agree except the target-dependent
+    ones, which serving cannot know.
+
+    With incremental, the invoices are engineered the way incremental_retrain
+    builds its fine-tuning rows instead: with the fixed statistics of a base
+    model trained on other (larger) data, which serving keeps using.
+    """
+    num_companies = max(50, num_invoices // 400)
+    invoices = generate_improved_synthetic_data(num_companies, num_invoices, seed)
+    if incremental:
+        base_aggregates = GlobalAggregates()
+        engineer_continuous_features(generate_improved_synthetic_data(num_companies, num_invoices * 2, seed + 1),
+                                     base_aggregates)
+        statistics = base_aggregates.portfolio_statistics()
+        # A small new file: the latest tenth of the invoices, covering only some groups of the base data
+        dates = pd.to_datetime(invoices['InvoiceDate'].astype(str))
+        engineered = engineer_continuous_features(invoices[dates >= dates.quantile(0.9)], statistics=statistics)
+    else:
+        aggregates = GlobalAggregates()
+        engineered = engineer_continuous_features(invoices, aggregates)
+        statistics = aggregates.portfolio_statistics()
+    features = [name for name in SEQUENCE_FEATURES + STATIC_FEATURES if name not in TARGET_DEPENDENT_FEATURES]
+    transform = compile_features(features)
+    sampled = set(np.random.default_rng(seed).choice(len(engineered), min(sample, len(engineered)),
+                                                     replace=False).tolist())
+
+    # Rows are in company and date order, so walking them builds each company's history
+    # up to every sampled invoice, as the store would hold it when the invoice is scored
+    app.history_store = InMemoryHistoryStore()
+    app.feature_cache.clear()
+    start = time.perf_counter()
+    served_rows, training_rows = [], []
+    for i, row in enumerate(engineered.itertuples(index=False)):
+        if i in sampled:
+            served_rows.append(transform.matrix(app.invoice_columns([skew_request(row)]), statistics)[0])
+            training_rows.append(i)
+        app.add_company_payment_record(row.Company, {
+            'date': row.InvoiceDate.to_pydatetime(),
+            'amount': float(row.InvoiceAmount),
+            'days_to_payment': float(row.DaysToPayment),
+            'payment_efficiency': float(row.PaymentEfficiency)
+        })
+    served = np.array(served_rows)
+    trained = transform.matrix(engineered)[training_rows]
+    print(f"{len(served)} invoices served from {len(engineered)} invoices of history "
+          f"in {time.perf_counter() - start:.2f}s; not compared (target-dependent): "
+          f"{', '.join(TARGET_DEPENDENT_FEATURES)}")
+
+    skewed = []
+    for i, name in enumerate(features):
+        max_diff = float(np.abs(served[:, i] - trained[:, i]).max())
+        matches = np.allclose(served[:, i], trained[:, i], rtol=rtol, atol=atol)
+        print(f"  {'✅' if matches else '❌'} {name:<28} max abs diff {max_diff:.3g}")
+        if not matches:
+            skewed.append(name)
+    if skewed:
+        raise AssertionError(f"Serving features differ from training: {', '.join(skewed)}")
+    print(f"✅ All {len(features)} features match training within rtol {rtol:g}, atol {atol:g}")
+
+def load_inference_models():
+    """Keras model and NumPy engine built from the same saved weights"""
+    from tensorflow.keras.models import load_model
+
+    model_files = app.current_model_files()
+    if model_files is None:
+        raise RuntimeError(f"No model to benchmark; train one or place {app.MODEL_H5_PATH} here")
+    h5_path = model_files[0]
+    # Exported afresh from the .h5, leaving the registry's immutable version untouched
+    export_dir = tempfile.mkdtemp(prefix='inference-benchmark-')
+    try:
+        npz_path = os.path.join(export_dir, 'model.npz')
+        export_numpy_weights(h5_path, npz_path)
+        return load_model(h5_path, compile=False), NumpyPaymentModel.load(npz_path)
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+def random_model_inputs(rows, seed=0):
+    """Scaled-looking sequence and static inputs for the saved model"""
+    rng = np.random.default_rng(seed)
+    return [rng.normal(size=(rows, 8)).astype(np.float32), rng.normal(size=(rows, 28)).astype(np.float32)]
+
+def benchmark_inference_parity(rows=10000, atol=1e-3):
+    """Check the NumPy engine against Keras outputs on the same inputs"""
+    keras_model, numpy_model = load_inference_models()
+    inputs = random_model_inputs(rows)
+    expected = keras_model.predict(inputs, batch_size=1024, verbose=0)
+    actual = numpy_model.predict(inputs)
+    max_diff = float(np.max(np.abs(actual - expected)))
+    print(f"{rows} rows  max abs diff vs Keras: {max_diff:.3g} days")
+    if max_diff > atol:
+        raise AssertionError(f"NumPy engine differs from Keras by {max_diff:.3g} (> {atol:g})")
+
+def benchmark_inference_latency(batch_sizes, repeats=20):
+    """Median predict latency of Keras and the NumPy engine per batch size"""
+    keras_model, numpy_model = load_inference_models()
+    for batch_size in batch_sizes:
+        inputs = random_model_inputs(batch_size)
+        timings = {}
+        for name, model in (('keras', keras_model), ('numpy', numpy_model)):
+            model.predict(inputs, batch_size=1024, verbose=0)
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                model.predict(inputs, batch_size=1024, verbose=0)
+                samples.append(time.perf_counter() - start)
+            timings[name] = np.median(samples) * 1000
+        print(f"batch {batch_size:>6}  keras: {timings['keras']:9.3f}ms  numpy: {timings['numpy']:9.3f}ms  "
+              f"speedup: {timings['keras'] / timings['numpy']:.1f}x")
+
+def benchmark_uncertainty(rows_list, samples, check=False, check_samples=2000, max_z=5.0):
+    """Monte-Carlo dropout latency per row count, and the samples the default latency budget allows
+
+    With check, the sample mean and spread are compared with Keras in training
+    mode with BatchNormalization frozen, which applies dropout alone.
+    """
+    check_uncertainty_options()
+    keras_model, numpy_model = load_inference_models()
+    if check:
+        from tensorflow.keras.layers import BatchNormalization
+        for layer in keras_model.layers:
+            if isinstance(layer, BatchNormalization):
+                layer.trainable = False
+        rows = 4
+        inputs = random_model_inputs(rows)
+        repeated = [np.repeat(x, check_samples, axis=0) for x in inputs]
+        expected = keras_model(repeated, training=True).numpy().reshape(rows, check_samples)
+        actual = numpy_model.predict_samples(inputs, check_samples, np.random.default_rng(0))
+        standard_error = np.sqrt((expected.var(axis=1) + actual.var(axis=1)) / check_samples)
+        z = np.abs(expected.mean(axis=1) - actual.mean(axis=1)) / standard_error
+        print(f"{check_samples} samples  mean diff: {np.abs(expected.mean(axis=1) - actual.mean(axis=1)).max():.3f} days "
+              f"(max z {z.max():.2f})  std keras {np.round(expected.std(axis=1), 2)} numpy {np.round(actual.std(axis=1), 2)}")
+        if z.max() > max_z:
+            raise AssertionError(f"Monte-Carlo dropout mean differs from Keras by {z.max():.1f} standard errors")
+
+    for rows in rows_list:
+        inputs = random_model_inputs(rows)
+        start = time.perf_counter()
+        numpy_model.predict_samples(inputs, samples, np.random.default_rng(0))
+        seconds = time.perf_counter() - start
+        budgeted = app.uncertainty_sample_count(numpy_model, rows, samples, app.UNCERTAINTY_BUDGET_MS)
+        print(f"{rows:>7} rows x {samples} samples: {seconds * 1000:9.1f}ms  "
+              f"({seconds / (rows * samples) * 1e6:.1f}us per sampled row)  "
+              f"samples within {app.UNCERTAINTY_BUDGET_MS:g}ms budget: {budgeted}")
+
+def check_uncertainty_options(client=None):
+    """Malformed uncertainty options are rejected and an infinite latency budget never cuts samples
+
+    With a test client for an app with a model loaded, /predict must answer 400 to them too.
+    """
+    malformed = [{'budgetMs': float('inf')}, {'budgetMs': float('nan')}, {'budgetMs': 0},
+                 {'samples': 2.5}, {'samples': float('inf')}, {'samples': 1}, {'samples': 'many'}]
+    for option in malformed:
+        try:
+            app.uncertainty_options({'uncertainty': option})
+        except (TypeError, ValueError):
+            pass
+        else:
+            raise AssertionError(f"uncertainty option {option} was accepted")
+        if client is not None:
+            # json.dumps writes Infinity / NaN, which the request parser reads back as floats
+            response = client.post('/predict', data=json.dumps(dict(suite_invoice(0, np.random.default_rng(0)),
+                                                                    uncertainty=option)),
+                                   content_type='application/json')
+            if response.status_code != 400:
+                raise AssertionError(f"/predict answered {response.status_code} to uncertainty option {option}")
+    if app.uncertainty_options({'uncertainty': {'samples': 40.0, 'budgetMs': '250'}}) != (40, 250.0):
+        raise AssertionError("integral samples and a numeric budgetMs string should be accepted")
+
+    class MeasuredModel:
+        seconds_per_sampled_row = 1e-3
+    if app.uncertainty_sample_count(MeasuredModel(), 10000, 30, float('inf')) != 30:
+        raise AssertionError("an infinite budget must not cut the samples")
+    if app.uncertainty_sample_count(MeasuredModel(), 10000, 30, 1.0) != app.UNCERTAINTY_MIN_SAMPLES:
+        raise AssertionError("a tight budget should cut the samples to UNCERTAINTY_MIN_SAMPLES")
+    print("✅ Uncertainty options validated")
+
+def timed(fn, repeats):
+    """Median wall time of fn() over repeats runs, in seconds"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+def suite_invoice(i, rng):
+    return {
+        'invoiceId': f'INV-{i}',
+        'customerName': f'Company_{int(rng.integers(0, 200))}',
+        'amount': float(rng.uniform(1000, 100000)),
+        'paymentDueDays': int(rng.choice([15, 30, 45, 60])),
+        'customerCreditScore': int(rng.integers(550, 850)),
+        'customerIndustry': 'IT',
+        'customerLocation': 'Mumbai',
+        'paymentMethod': 'Bank Transfer'
+    }
+
+def seed_suite_history(num_companies=200, records_per_company=20, seed=0):
+    """Fresh in-memory payment history, so the suite never touches a configured database"""
+    app.history_store = InMemoryHistoryStore()
+    app.feature_cache.clear()
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+    for company in range(num_companies):
+        app.add_company_payment_records(f'Company_{company}', [
+            {
+                'date': now - timedelta(days=int(days_ago)),
+                'amount': float(rng.uniform(1000, 100000)),
+                'days_to_payment': float(rng.uniform(10, 60)),
+                'payment_efficiency': float(rng.uniform(0.3, 1.0))
+            }
+            for days_ago in sorted(rng.integers(1, 365, records_per_company), reverse=True)
+        ])
+
+def benchmark_micro_batching(clients_list, requests_per_client=300):
+    """/predict throughput and latency with micro-batching off and on, per number of concurrent clients"""
+    if not app.load_existing_model():
+        raise RuntimeError(f"No model to benchmark; train one or place {app.MODEL_H5_PATH} here")
+    seed_suite_history()
+    print(f"Inference engine: {app.INFERENCE_ENGINE}")
+    for batching in (False, True):
+        app.MICRO_BATCHING = batching
+        for clients in clients_list:
+            latencies = []
+
+            def run_client(seed):
+                client = app.app.test_client()
+                rng = np.random.default_rng(seed)
+                client_latencies = []
+                for i in range(requests_per_client):
+                    invoice = suite_invoice(i, rng)
+                    start = time.perf_counter()
+                    response = client.post('/predict', json=invoice)
+                    client_latencies.append((time.perf_counter() - start) * 1000)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"/predict failed: {response.get_json()}")
+                # The first requests warm caches and lazy initialisation
+                latencies.extend(client_latencies[10:])
+
+            threads = [threading.Thread(target=run_client, args=(seed,)) for seed in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f"  batching {'on ' if batching else 'off'} {clients:>3} clients: "
+                  f"{clients * requests_per_client / seconds:8.0f} req/s  p50 {p50:7.1f}ms  p99 {p99:7.1f}ms")
+
+def run_benchmark_suite(quick=False):
+    """Time the training and serving hot paths; returns {name: {value, unit, higherIsBetter}}"""
+    results = {}
+
+    def record(name, value, unit, higher_is_better=False):
+        results[name] = {'value': value, 'unit': unit, 'higherIsBetter': higher_is_better}
+        print(f"  {name:<48} {value:12.4f} {unit}")
+
+    repeats = 1 if quick else 3
+    num_invoices = 20000 if quick else 80000
+
+    print("🔍 Train/serve feature skew")
+    benchmark_feature_skew(5000 if quick else 20000, 200 if quick else 500)
+    benchmark_feature_skew(5000 if quick else 20000, 200 if quick else 500, incremental=True)
+
+    print(f"📊 Training pipeline ({num_invoices} invoices)")
+    record('generate_synthetic_data_s',
+           timed(lambda: generate_improved_synthetic_data(200, num_invoices, 42), repeats), 's')
+    synthetic = generate_improved_synthetic_data(200, num_invoices, 42)
+    record('engineer_continuous_features_s',
+           timed(lambda: engineer_continuous_features(synthetic.copy()), repeats), 's')
+    engineered = engineer_continuous_features(synthetic.copy())
+    record('prepare_continuous_data_s', timed(lambda: prepare_continuous_data(engineered.copy()), repeats), 's')
+
+    print("📦 Model artifacts")
+    load_seconds = []
+    for _ in range(repeats):
+        if not app.load_existing_model():
+            raise RuntimeError(f"No model artifacts to benchmark; train one or place {app.MODEL_H5_PATH} "
+                               f"and {app.MODEL_PKL_PATH} here")
+        load_seconds.append(app.startup_report['artifact_load'])
+    record('artifact_load_s', float(np.median(load_seconds)), 's')
+
+    seed_suite_history()
+    client = app.app.test_client()
+    rng = np.random.default_rng(0)
+    check_uncertainty_options(client)
+
+    print("⚡ /predict latency")
+    latencies = []
+    for i in range(100 if quick else 500):
+        invoice = suite_invoice(i, rng)
+        start = time.perf_counter()
+        response = client.post('/predict', json=invoice)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict failed: {response.get_json()}")
+    # The first requests warm caches and lazy initialisation
+    latencies = latencies[10:]
+    for percentile in (50, 95, 99):
+        record(f'predict_latency_p{percentile}_ms', float(np.percentile(latencies, percentile)), 'ms')
+
+    print("📈 /forecast throughput")
+    for batch_size in ((10, 100, 1000) if quick else (10, 100, 1000, 10000)):
+        invoices = [suite_invoice(i, rng) for i in range(batch_size)]
+        client.post('/forecast', json={'invoices': invoices})
+        seconds = timed(lambda: client.post('/forecast', json={'invoices': invoices}), repeats)
+        record(f'forecast_throughput_{batch_size}_invoices_per_s', batch_size / seconds, 'invoices/s', True)
+
+    print("🏢 Company behavioral features")
+    now = datetime.now()
+    for history_length in ((10, 1000) if quick else (10, 100, 1000, 10000)):
+        company = f'Benchmark_History_{history_length}'
+        app.add_company_payment_records(company, [
+            {'date': now - timedelta(hours=history_length - i), 'amount': 50000.0,
+             'days_to_payment': 30.0, 'payment_efficiency': 0.8}
+            for i in range(history_length)
+        ])
+
+        def uncached():
+            app.feature_cache.clear()
+            app.calculate_company_behavioral_features(company)
+
+        calls = 200
+        record(f'company_features_{history_length}_records_uncached_us',
+               timed(lambda: [uncached() for _ in range(calls)], repeats) / calls * 1e6, 'us')
+        record(f'company_features_{history_length}_records_cached_us',
+               timed(lambda: [app.calculate_company_behavioral_features(company) for _ in range(calls)],
+                     repeats) / calls * 1e6, 'us')
+    return results
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpuCount': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'inferenceEngine': app.INFERENCE_ENGINE,
+        'microBatching': app.MICRO_BATCHING
+    }
+
+def compare_with_baseline(results, baseline, threshold):
+    """Names of metrics more than threshold (a fraction) worse than the baseline"""
+    regressions = []
+    for name, metric in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['value'], metric['value']
+        change = (after - before) / before if before else 0.0
+        worse = -change if metric['higherIsBetter'] else change
+        marker = '❌' if worse > threshold else '✅'
+        print(f"  {marker} {name:<48} {before:12.4f} -> {after:12.4f} {metric['unit']} ({change:+.1%})")
+        if worse > threshold:
+            regressions.append(name)
+    return regressions
+
+def benchmark_suite(quick, output, baseline_path, save_baseline, threshold):
+    """Run the suite, write JSON results and fail on regressions against the baseline"""
+    report = {
+        'generatedAt': datetime.now().isoformat(),
+        'quick': quick,
+        'machine': machine_info(),
+        'results': run_benchmark_suite(quick)
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {output}")
+
+    if save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Baseline saved to {baseline_path}")
+        return
+
+    if not os.path.exists(baseline_path):
+        print(f"ℹ️  No baseline at {baseline_path}; run with --save-baseline to store one")
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline['machine'] != report['machine']:
+        print("⚠️  Baseline was recorded on a different machine or configuration")
+    print(f"🔍 Comparing with {baseline_path} (threshold {threshold:.0%})")
+    regressions = compare_with_baseline(report['results'], baseline['results'], threshold)
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("✅ No regressions")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    rolling = subparsers.add_parser('rolling-features', help='Company rolling features vs the reference')
+    rolling.add_argument('--rows', type=int, nargs='+', default=[80000, 5000000])
+    rolling.add_argument('--no-reference', action='store_true', help='Skip the slow reference implementation')
+
+    subparsers.add_parser('inference-parity', help='NumPy engine vs Keras outputs')
+
+    latency = subparsers.add_parser('inference-latency', help='NumPy engine vs Keras predict latency')
+    latency.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+
+    uncertainty = subparsers.add_parser('uncertainty', help='Monte-Carlo dropout interval latency')
+    uncertainty.add_argument('--rows', type=int, nargs='+', default=[1, 1000, 10000])
+    uncertainty.add_argument('--samples', type=int, default=app.UNCERTAINTY_SAMPLES)
+    uncertainty.add_argument('--check', action='store_true', help='Compare sample moments with Keras dropout')
+
+    memory = subparsers.add_parser('training-memory', help='Peak RSS of the training data pipeline')
+    memory.add_argument('--rows', type=int, nargs='+', default=[80000, 1000000])
+
+    partitioned = subparsers.add_parser('partitioned-features', help='Out-of-core company-partitioned features')
+    partitioned.add_argument('--rows', type=int, nargs='+', default=[2000000])
+    partitioned.add_argument('--shards', type=int, default=16)
+    partitioned.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    partitioned.add_argument('--check', action='store_true', help='Compare with in-memory engineering')
+
+    skew = subparsers.add_parser('feature-skew', help='Serving features vs the training pipeline')
+    skew.add_argument('--rows', type=int, default=20000)
+    skew.add_argument('--sample', type=int, default=500, help='Invoices rebuilt the serving way')
+    skew.add_argument('--incremental', action='store_true',
+                      help='Rows engineered the way incremental retraining does, with a base model\'s statistics')
+
+    batching = subparsers.add_parser('micro-batching', help='/predict latency with micro-batching off and on')
+    batching.add_argument('--clients', type=int, nargs='+', default=[1, 16])
+    batching.add_argument('--requests', type=int, default=300, help='Requests per client')
+
+    suite = subparsers.add_parser('suite', help='Training and serving hot paths, compared with a baseline')
+    suite.add_argument('--quick', action='store_true', help='Smaller inputs and single repeats')
+    suite.add_argument('--output', help='Write the results JSON here')
+    suite.add_argument('--baseline', default=BENCHMARK_BASELINE_PATH)
+    suite.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline')
+    suite.add_argument('--threshold', type=float, default=0.2,
+                       help='Fail when a metric is this fraction worse than the baseline')
+
+    args = parser.parse_args()
+    if args.benchmark == 'rolling-features':
+        benchmark_rolling_features(args.rows, run_reference=not args.no_reference)
+    elif args.benchmark == 'inference-parity':
+        benchmark_inference_parity()
+    elif args.benchmark == 'inference-latency':
+        benchmark_inference_latency(args.batch_sizes)
+    elif args.benchmark == 'uncertainty':
+        benchmark_uncertainty(args.rows, args.samples, args.check)
+    elif args.benchmark == 'training-memory':
+        benchmark_training_memory(args.rows)
+    elif args.benchmark == 'partitioned-features':
+        benchmark_partitioned_features(args.rows, args.shards, args.workers, args.check)
+    elif args.benchmark == 'feature-skew':
+        benchmark_feature_skew(args.rows, args.sample, incremental=args.incremental)
+    elif args.benchmark == 'micro-batching':
+        benchmark_micro_batching(args.clients, args.requests)
+    elif args.benchmark == 'suite':
+        benchmark_suite(args.quick, args.output, args.baseline, args.save_baseline, args.threshold)
+
+if __name__ == '__main__':
+    main()
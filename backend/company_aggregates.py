@@ -0,0 +1,191 @@
+"""Incremental per-company payment aggregates.
+
+Keeps everything calculate_company_behavioral_features needs as running
+state, so reading a company's features costs the same no matter how much
+payment history it has.
+"""
+
+import bisect
+import math
+from datetime import datetime
+
+# Features served for companies without any payment history
+DEFAULT_COMPANY_FEATURES = {
+    'efficiency_3': 0.7,
+    'efficiency_7': 0.7,
+    'efficiency_all': 0.7,
+    'velocity_avg': 1.0,
+    'consistency': 0.5,
+    'trend': 0.0,
+    'frequency': 0.1,
+    'days_since_last': 30
+}
+
+# Size of the window of most recent records (the last 3 are its tail)
+RECENT_WINDOW = 7
+
+class CompanyAggregate:
+    """Running aggregates over one company's payment records"""
+
+    __slots__ = ('count', 'efficiency_mean', 'efficiency_m2', 'velocity_sum',
+                 'first_date', 'last_date', 'recent_dates', 'recent_efficiencies')
+
+    def __init__(self):
+        self.count = 0
+        # Welford running mean and sum of squared deviations of efficiency
+        self.efficiency_mean = 0.0
+        self.efficiency_m2 = 0.0
+        self.velocity_sum = 0.0
+        self.first_date = None
+        self.last_date = None
+        # Most recent records by date, oldest first, at most RECENT_WINDOW long
+        self.recent_dates = []
+        self.recent_efficiencies = []
+
+    @classmethod
+    def from_records(cls, records):
+        """Build the aggregate for an existing list of records"""
+        aggregate = cls()
+        for record in records:
+            aggregate.add(record)
+        return aggregate
+
+    def add(self, record):
+        """Fold one payment record into the aggregate"""
+        efficiency = record.get('payment_efficiency', 0.7)
+        amount = record.get('amount', 50000)
+        days = record.get('days_to_payment', 30)
+        date = record.get('date', datetime.now())
+
+        self.count += 1
+        delta = efficiency - self.efficiency_mean
+        self.efficiency_mean += delta / self.count
+        self.efficiency_m2 += delta * (efficiency - self.efficiency_mean)
+        self.velocity_sum += days / (math.log1p(amount) + 1)
+
+        if self.first_date is None or date < self.first_date:
+            self.first_date = date
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+
+        # Records can arrive out of date order; the window only changes when
+        # the new record is among the most recent ones. Equal dates keep
+        # insertion order, like the stable sort the history was read with.
+        if len(self.recent_dates) < RECENT_WINDOW or date >= self.recent_dates[0]:
+            position = bisect.bisect_right(self.recent_dates, date)
+            self.recent_dates.insert(position, date)
+            self.recent_efficiencies.insert(position, efficiency)
+            if len(self.recent_dates) > RECENT_WINDOW:
+                del self.recent_dates[0]
+                del self.recent_efficiencies[0]
+
+    @classmethod
+    def from_totals(cls, count, efficiency_mean, efficiency_m2, velocity_sum,
+                    first_date, last_date, recent_dates, recent_efficiencies):
+        """Build the aggregate from totals computed elsewhere, e.g. column-wise by bulk ingest"""
+        aggregate = cls()
+        aggregate.count = count
+        aggregate.efficiency_mean = efficiency_mean
+        aggregate.efficiency_m2 = efficiency_m2
+        aggregate.velocity_sum = velocity_sum
+        aggregate.first_date = first_date
+        aggregate.last_date = last_date
+        aggregate.recent_dates = list(recent_dates[-RECENT_WINDOW:])
+        aggregate.recent_efficiencies = list(recent_efficiencies[-RECENT_WINDOW:])
+        return aggregate
+
+    def copy(self):
+        """An independent copy, to update while readers keep using this aggregate"""
+        return CompanyAggregate.from_totals(self.count, self.efficiency_mean, self.efficiency_m2, self.velocity_sum,
+                                            self.first_date, self.last_date, self.recent_dates,
+                                            self.recent_efficiencies)
+
+    def merge(self, other):
+        """Fold in the aggregate of records added after this aggregate's records"""
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        # Chan et al. pairwise combination of the Welford statistics
+        delta = other.efficiency_mean - self.efficiency_mean
+        self.efficiency_m2 += other.efficiency_m2 + delta * delta * self.count * other.count / count
+        self.efficiency_mean += delta * other.count / count
+        self.count = count
+        self.velocity_sum += other.velocity_sum
+
+        if self.first_date is None or other.first_date < self.first_date:
+            self.first_date = other.first_date
+        if self.last_date is None or other.last_date > self.last_date:
+            self.last_date = other.last_date
+
+        # The most recent records of the union are among the most recent of each
+        # side; the stable sort keeps existing records first among equal dates, as add() does
+        recent = sorted(zip(self.recent_dates + other.recent_dates,
+                            self.recent_efficiencies + other.recent_efficiencies),
+                        key=lambda item: item[0])[-RECENT_WINDOW:]
+        self.recent_dates = [date for date, _ in recent]
+        self.recent_efficiencies = [efficiency for _, efficiency in recent]
+
+    def features(self, now=None):
+        """Company behavioral features in the calculate_company_behavioral_features format"""
+        if self.count == 0:
+            return dict(DEFAULT_COMPANY_FEATURES)
+
+        now = now or datetime.now()
+        recent_7 = self.recent_efficiencies
+        recent_3 = recent_7[-3:]
+
+        consistency = 1 / (1 + math.sqrt(self.efficiency_m2 / self.count)) if self.count > 1 else 0.5
+
+        if self.count > 1:
+            days_span = (self.last_date - self.first_date).days + 1
+            frequency = self.count / max(days_span / 30, 1)
+        else:
+            frequency = 0.1
+
+        return {
+            'efficiency_3': sum(recent_3) / len(recent_3),
+            'efficiency_7': sum(recent_7) / len(recent_7),
+            'efficiency_all': self.efficiency_mean,
+            'velocity_avg': self.velocity_sum / self.count,
+            'consistency': consistency,
+            'trend': least_squares_slope(recent_7) if len(recent_7) >= 3 else 0.0,
+            'frequency': frequency,
+            'days_since_last': min(365, (now - self.last_date).days)
+        }
+
+    def to_state(self):
+        """JSON-friendly snapshot of the aggregate for persistent stores"""
+        return {
+            'count': self.count,
+            'efficiency_mean': self.efficiency_mean,
+            'efficiency_m2': self.efficiency_m2,
+            'velocity_sum': self.velocity_sum,
+            'first_date': self.first_date.isoformat() if self.first_date else None,
+            'last_date': self.last_date.isoformat() if self.last_date else None,
+            'recent_dates': [date.isoformat() for date in self.recent_dates],
+            'recent_efficiencies': list(self.recent_efficiencies)
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild an aggregate from a to_state snapshot"""
+        aggregate = cls()
+        aggregate.count = state['count']
+        aggregate.efficiency_mean = state['efficiency_mean']
+        aggregate.efficiency_m2 = state['efficiency_m2']
+        aggregate.velocity_sum = state['velocity_sum']
+        if state['first_date']:
+            aggregate.first_date = datetime.fromisoformat(state['first_date'])
+            aggregate.last_date = datetime.fromisoformat(state['last_date'])
+        aggregate.recent_dates = [datetime.fromisoformat(date) for date in state['recent_dates']]
+        aggregate.recent_efficiencies = list(state['recent_efficiencies'])
+        return aggregate
+
+def least_squares_slope(values):
+    """Slope of the least-squares line through values at x = 0, 1, 2, ..."""
+    n = len(values)
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    sum_y = sum(values)
+    sum_xy = sum(x * y for x, y in enumerate(values))
+    return (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x ** 2)
@@ -0,0 +1,58 @@
+"""Bounded LRU cache of per-company feature vectors.
+
+Entries are keyed on (company, history version): the history stores bump a
+company's version on every append or clear, so a changed history simply
+stops matching its old entries, which then age out of the LRU. Entries may
+also carry an expiry time for values that drift with the clock.
+"""
+
+import threading
+from collections import OrderedDict
+
+class FeatureVectorCache:
+    """Thread-safe LRU with hit, miss and eviction counters"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        """Cached value for key, or None when it is missing or expired at `now`"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and (item[1] is None or now is None or now < item[1]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, expires_at=None):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'maxEntries': self.max_entries,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': self.hits / lookups if lookups else 0.0
+            }
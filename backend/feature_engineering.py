@@ -0,0 +1,454 @@
+"""Synthetic invoice data and the feature engineering that turns it into model inputs.
+
+Kept free of TensorFlow so data-preparation tooling, including the worker
+processes of partitioned_features.py, stays light; training.py builds on it.
+The feature definitions themselves live in feature_spec.py, which serving
+computes its model inputs with too.
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import RobustScaler
+
+from feature_spec import (
+    compile_features, PortfolioStatistics, FEATURE_DTYPE, GLOBAL_STATISTICS, INVOICE_FEATURES,
+    COMPANY_FEATURES, PORTFOLIO_FEATURES, COMPANY_HISTORY_DEFAULTS, EFFICIENCY_WINDOWS,
+    CONSISTENCY_WINDOW, TREND_WINDOW, NO_HISTORY_STD
+)
+
+# String columns of the synthetic data, held as pandas categoricals
+CATEGORICAL_COLUMNS = ['Company', 'Industry', 'Segment', 'Location', 'PaymentMethod',
+                       'InvoiceCurrency', 'PaymentStatus']
+
+def generate_improved_synthetic_data(num_customers=200, num_invoices=80000, seed=42):
+    """Generate synthetic invoice data with stronger continuous patterns"""
+
+    rng = np.random.default_rng(seed)
+
+    # Category names; the invoice columns are categoricals of codes into these
+    industries = np.array(['IT', 'Finance', 'Healthcare', 'Retail', 'Manufacturing'], dtype=object)
+    locations = np.array(['Mumbai', 'Delhi', 'Bangalore', 'Chennai', 'Hyderabad'], dtype=object)
+    payment_methods = np.array(['Bank Transfer', 'Credit Card', 'Cheque', 'UPI'], dtype=object)
+
+    # Create customers with more realistic distributions
+    customer_industry = rng.integers(0, len(industries), num_customers)
+    customer_location = rng.integers(0, len(locations), num_customers)
+    customer_credit = rng.normal(700, 50, num_customers).astype(int)
+    segments = np.array(['Reliable', 'Average', 'At-risk'], dtype=object)
+    customer_segment = np.select([customer_credit > 720, customer_credit < 650], [0, 2], 1)
+    company_names = np.array([f'Company_{i + 1}' for i in range(num_customers)], dtype=object)
+
+    # More dynamic market conditions, indexed by month (slot 0 unused)
+    months = np.arange(1, 13)
+    market_conditions = np.zeros(13)
+    payment_urgency = np.zeros(13)
+    market_conditions[1:] = 1 + 0.2 * np.sin(2 * np.pi * months / 12) + rng.normal(0, 0.05, 12)
+    payment_urgency[1:] = rng.beta(2, 5, 12)
+
+    # Invoice-level draws
+    cust = rng.integers(0, num_customers, num_invoices)
+    month = rng.integers(1, 13, num_invoices)
+    day = rng.integers(1, 28, num_invoices)
+    payment_due_days = rng.choice([15, 30, 45, 60, 90], size=num_invoices, p=[0.1, 0.4, 0.3, 0.15, 0.05])
+    base_amount = rng.lognormal(9.5, 1.2, num_invoices)
+    method = rng.integers(0, len(payment_methods), num_invoices)
+
+    seasonal_multiplier = 1 + 0.3 * np.sin(2 * np.pi * month / 12)
+    invoice_amount = np.round(base_amount * seasonal_multiplier * market_conditions[month], 2)
+
+    # Payment prediction logic
+    industry = customer_industry[cust]
+    location = customer_location[cust]
+    credit_factor = (customer_credit[cust] - 600) / 200
+    base_payment_tendency = payment_due_days * (1.2 - credit_factor)
+
+    industry_adj = np.select(
+        [industry == 0, industry == 1, industry == 2, industry == 3],
+        [2 * np.sin(2 * np.pi * month / 12),
+         -3 + 5 * payment_urgency[month],
+         1 + 2 * np.cos(2 * np.pi * month / 6),
+         np.where(np.isin(month, [11, 12]), -5, 3)],
+        4 * np.sin(2 * np.pi * (month - 3) / 12)
+    )
+    amount_factor = np.log(invoice_amount / 50000) * 2
+
+    # Bank Transfer, Credit Card, Cheque, UPI
+    method_mu = np.array([-2, -1, 3, -0.5])
+    method_sigma = np.array([1, 1.5, 2, 1])
+    method_adj = rng.normal(method_mu[method], method_sigma[method])
+
+    # Mumbai, Delhi, Bangalore, Chennai, Hyderabad
+    location_mu = np.array([-1, 0, -0.5, 1, 0.5])
+    location_sigma = np.array([2, 2, 1.5, 2, 1.5])
+    location_adj = rng.normal(location_mu[location], location_sigma[location])
+
+    market_stress = (1 - market_conditions[month]) * 10
+    day_effect = 2 * np.sin(2 * np.pi * day / 30)
+
+    # Everything except the company history term is known up front
+    partial_days = (base_payment_tendency + industry_adj + amount_factor + method_adj +
+                    location_adj + market_stress + day_effect + rng.normal(0, 3, num_invoices))
+    # At millions of invoices these per-invoice terms dominate peak memory
+    del (base_amount, seasonal_multiplier, credit_factor, base_payment_tendency, industry_adj,
+         amount_factor, method_adj, location_adj, market_stress, day_effect)
+    first_invoice_adj = rng.normal(0, 3, num_invoices)
+    outlier_draw = rng.random(num_invoices)
+    outlier_days = rng.exponential(30, num_invoices)
+
+    # The history term depends on the company's previous efficiencies, so walk the
+    # invoices in per-company order one history position at a time, vectorized
+    # across companies, keeping the last 10 efficiencies of each company.
+    order = np.argsort(cust, kind='stable')
+    counts = np.bincount(cust, minlength=num_customers)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    recent_efficiency = np.full((num_customers, 10), np.nan)
+
+    days_to_payment = np.empty(num_invoices)
+    payment_efficiency = np.empty(num_invoices)
+
+    for position in range(counts.max() if num_invoices else 0):
+        active = np.flatnonzero(counts > position)
+        rows = order[starts[active] + position]
+
+        if position == 0:
+            historical_adj = first_invoice_adj[rows]
+        else:
+            window = recent_efficiency[active]
+            recent_performance = np.nanmean(window, axis=1)
+            consistency_factor = 1 - np.nanstd(window[:, -5:], axis=1) / 10
+            historical_adj = recent_performance * consistency_factor * 5
+
+        days = np.round(np.clip(partial_days[rows] + historical_adj, 1, 120), 1)
+        days = np.where(outlier_draw[rows] < 0.01, days + outlier_days[rows], days)
+        due = payment_due_days[rows]
+        efficiency = np.maximum(0, 1 - (days - due) / due)
+
+        days_to_payment[rows] = days
+        payment_efficiency[rows] = efficiency
+        recent_efficiency[active, :-1] = recent_efficiency[active, 1:]
+        recent_efficiency[active, -1] = efficiency
+
+    payment_delay = days_to_payment - payment_due_days
+    statuses = np.array(['Late', 'Early', 'On Time'], dtype=object)
+    payment_status = np.select([payment_delay > 7, payment_delay < -2], [0, 1], 2)
+    has_early_discount = (payment_delay < -5) & (rng.random(num_invoices) < 0.2)
+
+    invoice_date = (np.datetime64('2024-01', 'M') + (month - 1)).astype('datetime64[D]') + (day - 1)
+    payment_due_date = invoice_date + payment_due_days
+    payment_date = invoice_date + np.floor(days_to_payment).astype(int)
+
+    def date_strings(dates):
+        unique_dates, inverse = np.unique(dates, return_inverse=True)
+        return pd.Categorical.from_codes(inverse, unique_dates.astype(str))
+
+    def categorical(values, codes):
+        # Categories in sorted order, like sorting the plain strings would give
+        categories = np.sort(values)
+        return pd.Categorical.from_codes(np.argsort(np.argsort(values))[codes], categories)
+
+    return pd.DataFrame({
+        "InvoiceID": np.arange(10001, 10001 + num_invoices),
+        "Company": categorical(company_names, cust),
+        "Industry": categorical(industries, industry),
+        "Segment": categorical(segments, customer_segment[cust]),
+        "InvoiceDate": date_strings(invoice_date),
+        "PaymentDueDays": payment_due_days,
+        "PaymentDueDate": date_strings(payment_due_date),
+        "InvoiceAmount": invoice_amount,
+        "CustomerCreditScore": customer_credit[cust],
+        "Location": categorical(locations, location),
+        "PaymentMethod": categorical(payment_methods, method),
+        "InvoiceCurrency": pd.Categorical.from_codes(np.zeros(num_invoices, dtype=np.int8), ['INR']),
+        "HasEarlyDiscount": has_early_discount,
+        "MarketCondition": market_conditions[month],
+        "PaymentUrgency": payment_urgency[month],
+        "DayOfMonth": day,
+        "ActualPaymentDate": date_strings(payment_date),
+        "PaymentDelay": np.round(payment_delay, 1),
+        "DaysToPayment": np.round(days_to_payment, 1),
+        "PaymentStatus": categorical(statuses, payment_status),
+        "PaymentEfficiency": payment_efficiency
+    }, copy=False)
+
+def lagged_company_values(values, position, lag):
+    """Value `lag` rows earlier within the same company, 0 where the company has none"""
+    lagged = np.zeros_like(values)
+    if lag < len(values):
+        lagged[lag:] = values[:-lag]
+    return np.where(position >= lag, lagged, 0.0)
+
+def previous_window_mean(values, position, window):
+    """Mean of each company's previous `window` values (NaN on a company's first row)"""
+    total = np.zeros_like(values)
+    for lag in range(1, window + 1):
+        total += lagged_company_values(values, position, lag)
+    count = np.minimum(position, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+def previous_window_std(values, position, window):
+    """Sample std of each company's previous `window` values (NaN below 2 values)"""
+    count = np.minimum(position, window)
+    mean = previous_window_mean(values, position, window)
+    squares = np.zeros_like(values)
+    for lag in range(1, window + 1):
+        deviation = lagged_company_values(values, position, lag) - mean
+        squares += np.where(position >= lag, deviation ** 2, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+
+def previous_window_slope(values, position, window):
+    """Least-squares slope over each company's previous `window` values in closed form"""
+    # x runs 0..window-1 from the oldest value, so the value at `lag` has x = window - lag
+    x = np.arange(window)
+    sum_x = x.sum()
+    denominator = window * (x ** 2).sum() - sum_x ** 2
+    sum_y = np.zeros_like(values)
+    sum_xy = np.zeros_like(values)
+    for lag in range(1, window + 1):
+        lagged = lagged_company_values(values, position, lag)
+        sum_y += lagged
+        sum_xy += (window - lag) * lagged
+    slope = (window * sum_xy - sum_x * sum_y) / denominator
+    # Like the rolling polyfit it replaces, a slope needs a full window of history
+    return np.where(position >= window, slope, np.nan)
+
+def add_company_behavioral_features(df):
+    """Rolling company features over each company's previous invoices.
+
+    Expects `df` sorted by Company and InvoiceDate with LogInvoiceAmount set.
+    """
+    # Rows are sorted by company, so a row `lag` positions back belongs to the
+    # same company whenever its position within the company is at least `lag`.
+    companies = df.groupby('Company', observed=True)
+    position = companies.cumcount().to_numpy()
+    efficiency = df['PaymentEfficiency'].to_numpy(dtype=float)
+
+    for col, window in EFFICIENCY_WINDOWS.items():
+        df[col] = as_feature(previous_window_mean(efficiency, position, window))
+    df['CompanyEfficiency_All'] = as_feature((
+        (companies['PaymentEfficiency'].cumsum() - df['PaymentEfficiency']) / position
+    ).where(position > 0))
+
+    velocity = df['DaysToPayment'] / (df['LogInvoiceAmount'].astype(float) + 1)
+    df['PaymentVelocity'] = as_feature(velocity)
+    df['CompanyVelocity_Avg'] = as_feature((
+        (velocity.groupby(df['Company'], observed=True).cumsum() - velocity) / position
+    ).where(position > 0))
+
+    consistency_std = previous_window_std(efficiency, position, CONSISTENCY_WINDOW)
+    df['CompanyConsistency'] = as_feature(
+        1 / (1 + np.where(np.isnan(consistency_std), NO_HISTORY_STD, consistency_std)))
+
+    df['CompanyTrend'] = as_feature(previous_window_slope(efficiency, position, TREND_WINDOW))
+
+    return df
+
+def as_feature(values):
+    """Engineered feature column values in the compact FEATURE_DTYPE"""
+    return np.asarray(values, dtype=FEATURE_DTYPE)
+
+def sort_by_company_and_date(df):
+    """df's rows sorted by Company then InvoiceDate in a new frame, with InvoiceDate parsed and strings categorical"""
+    invoice_date = pd.to_datetime(df['InvoiceDate']).to_numpy()
+    company_codes = pd.factorize(df['Company'], sort=True)[0]
+    order = np.lexsort((invoice_date, company_codes))
+    df = df.take(order).reset_index(drop=True)
+    df['InvoiceDate'] = invoice_date[order]
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+def add_spec_features(df, names, statistics=None):
+    """Add the feature_spec features df does not hold yet as columns of df"""
+    for name, values in compile_features(names).columns(df, statistics).items():
+        df[name] = values
+    return df
+
+def add_invoice_features(df):
+    """Features computed from each invoice row alone; expects a parsed InvoiceDate"""
+    df = add_spec_features(df, INVOICE_FEATURES)
+    df['WeekOfYear'] = df['InvoiceDate'].dt.isocalendar().week
+    return df
+
+def add_company_features(df):
+    """Features computed from each company's own invoices; expects add_invoice_features and company/date order"""
+    df = add_company_behavioral_features(df)
+    df['DaysSinceLastInvoice'] = as_feature(
+        df.groupby('Company', observed=True)['InvoiceDate'].diff().dt.days)
+
+    # A company's first invoice has no history; fill it the way serving does
+    # for companies without any, before the features built on it
+    df.fillna({col: value for col, value in COMPANY_HISTORY_DEFAULTS.items()}, inplace=True)
+    return add_spec_features(df, COMPANY_FEATURES)
+
+class GlobalAggregates:
+    """Grouped count, mean and sum of squared deviations, mergeable across chunks of invoices"""
+
+    def __init__(self):
+        self.tables = {}
+
+    def update(self, df):
+        """Fold a frame of invoices with add_invoice_features columns into the statistics"""
+        for name, (keys, value) in GLOBAL_STATISTICS.items():
+            grouped = df.groupby(keys, observed=True)[value]
+            count = grouped.count()
+            table = pd.DataFrame({'count': count, 'mean': grouped.mean(), 'm2': grouped.var(ddof=0) * count})
+            table.index = _plain_index(table.index)
+            self.tables[name] = merge_group_statistics(self.tables[name], table) if name in self.tables else table
+
+    def lookup(self, name, columns, statistic='mean'):
+        """Per-row value of one group statistic for rows given as a frame or a mapping of their key columns"""
+        keys, _ = GLOBAL_STATISTICS[name]
+        table = self.tables[name]
+
+        # Look up every combination of the keys' distinct values once (the keys have
+        # few values each), then index that small table with the rows' key codes
+        codes, uniques = zip(*(pd.factorize(columns[key]) for key in keys))
+        if len(keys) == 1:
+            index = pd.Index(np.asarray(uniques[0]))
+        else:
+            index = pd.MultiIndex.from_product([np.asarray(values) for values in uniques])
+        positions = np.ravel_multi_index(codes, [len(values) for values in uniques])
+
+        if statistic == 'std':
+            # Sample standard deviation, NaN for single-row groups like pandas' std
+            column = np.sqrt(table['m2'] / (table['count'] - 1).where(table['count'] > 1))
+        else:
+            column = table[statistic]
+        return column.reindex(index).to_numpy(dtype=float)[positions]
+
+    def overall_mean(self, name):
+        """Mean of a statistic's value column over every invoice"""
+        table = self.tables[name]
+        return (table['mean'] * table['count']).sum() / table['count'].sum()
+
+    def add_features(self, df):
+        """Add the market, industry, location and target-encoding features to df"""
+        return add_spec_features(df, PORTFOLIO_FEATURES, self)
+
+    def portfolio_statistics(self):
+        """The statistics as PortfolioStatistics, which serving looks features up in without pandas"""
+        tables = {}
+        for name, table in self.tables.items():
+            keys = [key if isinstance(key, tuple) else (key,) for key in table.index.tolist()]
+            tables[name] = dict(zip(keys, zip(table['count'].tolist(), table['mean'].tolist(),
+                                              table['m2'].tolist())))
+        return PortfolioStatistics(tables)
+
+def _plain_index(index):
+    """Group index with plain values instead of categoricals, so any frame's keys can be looked up in it"""
+    if isinstance(index, pd.MultiIndex):
+        return pd.MultiIndex.from_tuples(list(index), names=index.names)
+    return pd.Index(list(index), name=index.name)
+
+def merge_group_statistics(left, right):
+    """Combine two tables of grouped count, mean and m2 (Chan et al. pairwise update)"""
+    left, right = left.align(right, join='outer', fill_value=0)
+    count = left['count'] + right['count']
+    delta = right['mean'] - left['mean']
+    return pd.DataFrame({
+        'count': count,
+        'mean': left['mean'] + delta * right['count'] / count,
+        'm2': left['m2'] + right['m2'] + delta * delta * left['count'] * right['count'] / count
+    })
+
+def fill_value(col, values):
+    """Value that fills missing entries of a feature column: a neutral default, else the column's median"""
+    if col in COMPANY_HISTORY_DEFAULTS:
+        return COMPANY_HISTORY_DEFAULTS[col]
+    if 'Efficiency' in col:
+        return 0.7
+    if 'Trend' in col:
+        return 0
+    if 'Consistency' in col:
+        return 0.5
+    return None if values is None else values.median()
+
+def columns_with_missing_values(df):
+    return [col for col in df.select_dtypes('number').columns if df[col].isnull().any()]
+
+def engineer_continuous_features(df, aggregates=None, statistics=None):
+    """Advanced feature engineering focusing on continuous behavioral patterns
+
+    The portfolio statistics are computed into `aggregates`, a fresh
+    GlobalAggregates unless the caller passes one to keep them. With
+    `statistics`, a trained model's fixed PortfolioStatistics, nothing is
+    aggregated: the portfolio features are looked up in them as that model's
+    serving does.
+    """
+
+    # Sorting takes the rows into a new frame, so the caller's frame is never modified
+    df = sort_by_company_and_date(df)
+    df = add_invoice_features(df)
+    df = add_company_features(df)
+
+    if statistics is not None:
+        df = add_spec_features(df, PORTFOLIO_FEATURES, statistics)
+        # Groups the statistics never saw are 0, as serving's feature matrices make them
+        df.fillna({name: 0.0 for name in PORTFOLIO_FEATURES if name in df.columns}, inplace=True)
+    else:
+        aggregates = GlobalAggregates() if aggregates is None else aggregates
+        aggregates.update(df)
+        df = aggregates.add_features(df)
+
+    # One fillna on the frame itself; fillna(inplace=True) on a column selection
+    # only fills a temporary copy under pandas copy-on-write
+    df.fillna({col: fill_value(col, df[col]) for col in columns_with_missing_values(df)}, inplace=True)
+
+    return df
+
+SEQUENCE_FEATURES = [
+    'CompanyEfficiency_3', 'CompanyEfficiency_7', 'CompanyEfficiency_All',
+    'CompanyVelocity_Avg', 'CompanyConsistency', 'CompanyTrend',
+    'PaymentFrequency', 'DaysSinceLastInvoice'
+]
+
+STATIC_FEATURES = [
+    'LogInvoiceAmount', 'AmountSquareRoot', 'LogAmountPerDueDay',
+    'CreditScoreNorm', 'CreditScoreSquared', 'CreditScoreCubed',
+    'MonthSin', 'MonthCos', 'QuarterSin', 'QuarterCos',
+    'DayOfWeekSin', 'DayOfWeekCos', 'DayOfMonthSin', 'DayOfMonthCos',
+    'MarketCondition', 'PaymentUrgency', 'MarketTrend', 'MarketVolatility',
+    'IndustrySeasonalEffect', 'LocationEconomicIndex',
+    'CreditScore_Amount', 'CreditScore_Market', 'Amount_Market',
+    'Efficiency_Consistency',
+    'Industry_TargetEncoded', 'Location_TargetEncoded',
+    'PaymentMethod_TargetEncoded', 'Segment_TargetEncoded'
+]
+
+def prepare_continuous_data(df):
+    """Prepare data for continuous prediction model"""
+
+    available_sequence = [f for f in SEQUENCE_FEATURES if f in df.columns]
+    available_static = [f for f in STATIC_FEATURES if f in df.columns]
+
+    print(f"Using {len(available_sequence)} sequence features and {len(available_static)} static features")
+
+    X_sequence = feature_matrix(df, available_sequence)
+    X_static = feature_matrix(df, available_static)
+    y = df['DaysToPayment'].to_numpy(dtype=FEATURE_DTYPE)
+
+    sequence_scaler = RobustScaler()
+    static_scaler = RobustScaler()
+
+    X_sequence_scaled = scale_in_place(sequence_scaler, X_sequence)
+    X_static_scaled = scale_in_place(static_scaler, X_static)
+
+    return X_sequence_scaled, X_static_scaled, y, sequence_scaler, static_scaler, available_sequence, available_static
+
+def feature_matrix(df, columns):
+    """Columns of df as one FEATURE_DTYPE matrix with NaN as 0, filled column by column without intermediate frames"""
+    return compile_features(columns).matrix(df)
+
+def scale_in_place(scaler, matrix):
+    """Fit a RobustScaler and apply it to matrix in place, as its transform would on a copy"""
+    scaler.fit(matrix)
+    return transform_in_place(scaler, matrix)
+
+def transform_in_place(scaler, matrix):
+    """Apply a fitted RobustScaler to matrix in place"""
+    matrix -= scaler.center_.astype(matrix.dtype)
+    matrix /= scaler.scale_.astype(matrix.dtype)
+    return matrix
@@ -0,0 +1,87 @@
+"""Content-addressed on-disk cache of engineered training matrices.
+
+The scaled sequence and static matrices, the targets and the fitted scalers
+that prepare_continuous_data returns, and the portfolio statistics of the
+invoices, depend only on the synthetic generator's parameters and seed, the
+feature lists and the code that builds them. train_model stores them under a hash of exactly those, one directory
+per key, with the matrices as .npy files that later runs load memory-mapped
+and hand straight to model.fit.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import uuid
+
+import numpy as np
+
+ARRAY_FILES = ('X_sequence.npy', 'X_static.npy', 'y.npy')
+SCALERS_FILE = 'scalers.pkl'
+STATISTICS_FILE = 'portfolio_statistics.pkl'
+METADATA_FILE = 'metadata.json'
+
+def cache_key(generator_params, sequence_features, static_features, code_hash=''):
+    """Hex key for the generator parameters (including the seed), the feature lists and the pipeline code"""
+    feature_hash = hashlib.sha256(json.dumps([sequence_features, static_features]).encode()).hexdigest()
+    payload = json.dumps({'generator': generator_params, 'features': feature_hash, 'code': code_hash},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+class FeatureMatrixCache:
+    """Directory of prepared training data keyed by cache_key"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """prepare_continuous_data's return tuple with memory-mapped matrices, or None on a miss"""
+        entry = self.path(key)
+        try:
+            with open(os.path.join(entry, METADATA_FILE)) as f:
+                metadata = json.load(f)
+            with open(os.path.join(entry, SCALERS_FILE), 'rb') as f:
+                sequence_scaler, static_scaler = pickle.load(f)
+            X_sequence, X_static, y = [np.load(os.path.join(entry, name), mmap_mode='r') for name in ARRAY_FILES]
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        return (X_sequence, X_static, y, sequence_scaler, static_scaler,
+                metadata['sequence_features'], metadata['static_features'])
+
+    def load_statistics(self, key):
+        """PortfolioStatistics stored with an entry, or None"""
+        try:
+            with open(os.path.join(self.path(key), STATISTICS_FILE), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, key, prepared, metadata=None, statistics=None):
+        """Store a prepare_continuous_data result; concurrent writers of one key are harmless"""
+        X_sequence, X_static, y, sequence_scaler, static_scaler, sequence_features, static_features = prepared
+
+        # Written under a private name and renamed into place, so readers never see a partial entry
+        staging = os.path.join(self.cache_dir, f'.{key}.{uuid.uuid4().hex[:8]}')
+        os.makedirs(staging)
+        try:
+            for name, array in zip(ARRAY_FILES, (X_sequence, X_static, y)):
+                np.save(os.path.join(staging, name), np.ascontiguousarray(array))
+            with open(os.path.join(staging, SCALERS_FILE), 'wb') as f:
+                pickle.dump((sequence_scaler, static_scaler), f)
+            if statistics is not None:
+                with open(os.path.join(staging, STATISTICS_FILE), 'wb') as f:
+                    pickle.dump(statistics, f)
+            with open(os.path.join(staging, METADATA_FILE), 'w') as f:
+                json.dump(dict(metadata or {}, sequence_features=sequence_features,
+                               static_features=static_features, rows=len(y)), f)
+            os.rename(staging, self.path(key))
+        except OSError:
+            # Another run stored the same key first
+            if not os.path.isdir(self.path(key)):
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
@@ -0,0 +1,389 @@
+"""Declarative spec of the model's input features, shared by training and serving.
+
+Every engineered feature is defined once, in FEATURES, by the columns it is
+computed from and a vectorized function of them. compile_features resolves
+the definitions a list of features needs, in dependency order, into a
+FeatureTransform that computes them over any column source: a DataFrame of
+invoices at training time, or the arrays request_columns builds from a batch
+of API requests at serving time. Columns the source already holds are used
+as they are.
+
+Two kinds of inputs come from outside a single invoice:
+  - company history columns, which training builds from each company's
+    previous invoices (feature_engineering.add_company_behavioral_features)
+    and serving from the history store's running aggregates (company_history);
+  - portfolio features, which look up group statistics of the training data:
+    GlobalAggregates while training, the PortfolioStatistics a model's
+    artifacts carry while serving.
+
+`python benchmarks.py feature-skew` checks that both paths agree.
+
+Kept free of pandas, like the rest of the serving path.
+"""
+
+import functools
+import itertools
+import math
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from company_aggregates import least_squares_slope
+
+# dtype of engineered feature columns and of the matrices the model sees
+FEATURE_DTYPE = np.float32
+
+# inputs: source or feature columns; compute(*input arrays) -> values, or
+# compute(statistics, {input: column}) for portfolio features, which use
+# fallback({input: column}) when the model has no statistics; dtype None
+# keeps compute's dtype; a feature with a `missing` value takes it when the
+# source cannot provide an input (e.g. the target while serving)
+Feature = namedtuple('Feature', ['inputs', 'compute', 'dtype', 'portfolio', 'fallback', 'missing'],
+                     defaults=(FEATURE_DTYPE, False, None, None))
+
+# Grouped statistics behind the portfolio features: name -> (group keys, value column)
+GLOBAL_STATISTICS = {
+    'market_by_month': (['Month'], 'MarketCondition'),
+    'efficiency_by_industry_month': (['Industry', 'Month'], 'PaymentEfficiency'),
+    'market_by_location_quarter': (['Location', 'Quarter'], 'MarketCondition'),
+    'efficiency_by_Industry': (['Industry'], 'PaymentEfficiency'),
+    'efficiency_by_Location': (['Location'], 'PaymentEfficiency'),
+    'efficiency_by_PaymentMethod': (['PaymentMethod'], 'PaymentEfficiency'),
+    'efficiency_by_Segment': (['Segment'], 'PaymentEfficiency')
+}
+
+TARGET_ENCODED_COLUMNS = ['Industry', 'Location', 'PaymentMethod', 'Segment']
+TARGET_ENCODING_SMOOTHING = 10
+
+# Portfolio feature values of models trained before their artifacts carried
+# PortfolioStatistics: constants, and target encodings as category -> value with a default
+LEGACY_PORTFOLIO_VALUES = {
+    'MarketTrend': 0.0,
+    'MarketVolatility': 0.1,
+    'IndustrySeasonalEffect': 0.0,
+    'LocationEconomicIndex': 1.0,
+    'Industry_TargetEncoded': ({'IT': 0.8, 'Finance': 0.7, 'Healthcare': 0.75, 'Retail': 0.6,
+                                'Manufacturing': 0.65}, 0.7),
+    'Location_TargetEncoded': ({'Mumbai': 0.8, 'Delhi': 0.75, 'Bangalore': 0.85, 'Chennai': 0.7,
+                                'Hyderabad': 0.72}, 0.75),
+    'PaymentMethod_TargetEncoded': ({'Bank Transfer': 0.7, 'Credit Card': 0.8, 'Cheque': 0.5, 'UPI': 0.9}, 0.7),
+    'Segment_TargetEncoded': ({'Reliable': 0.9, 'Average': 0.5, 'At-risk': 0.1}, 0.5)
+}
+
+# Company history windows, in previous invoices
+EFFICIENCY_WINDOWS = {'CompanyEfficiency_3': 3, 'CompanyEfficiency_7': 7}
+CONSISTENCY_WINDOW = 5
+TREND_WINDOW = 7
+
+# Efficiency std used for consistency below two previous invoices
+NO_HISTORY_STD = 0.5
+
+# Company history columns and their values before a company's first invoice
+COMPANY_HISTORY_DEFAULTS = {
+    'CompanyEfficiency_3': 0.7,
+    'CompanyEfficiency_7': 0.7,
+    'CompanyEfficiency_All': 0.7,
+    'CompanyVelocity_Avg': 1.0,
+    'CompanyConsistency': 1 / (1 + NO_HISTORY_STD),
+    'CompanyTrend': 0.0,
+    'DaysSinceLastInvoice': 30
+}
+
+# The company history columns company_history keeps per company; DaysSinceLastInvoice
+# depends on each invoice's date and is computed per invoice
+COMPANY_HISTORY_VALUES = [col for col in COMPANY_HISTORY_DEFAULTS if col != 'DaysSinceLastInvoice']
+
+# API request field -> (source column, default, conversion)
+REQUEST_FIELDS = {
+    'amount': ('InvoiceAmount', 50000, float),
+    'paymentDueDays': ('PaymentDueDays', 30, int),
+    'customerCreditScore': ('CustomerCreditScore', 700, int),
+    'marketCondition': ('MarketCondition', 1.0, float),
+    'paymentUrgency': ('PaymentUrgency', 0.5, float),
+    'customerIndustry': ('Industry', 'IT', str),
+    'customerLocation': ('Location', 'Mumbai', str),
+    'paymentMethod': ('PaymentMethod', 'Bank Transfer', str),
+    'customerSegment': ('Segment', 'Average', str)
+}
+
+def _days(dates):
+    return np.asarray(dates).astype('datetime64[D]')
+
+def calendar_month(dates):
+    return _days(dates).astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+def calendar_day_of_week(dates):
+    # Monday is 0; 1970-01-01 was a Thursday
+    return (_days(dates).astype(np.int64) + 3) % 7
+
+def calendar_day_of_month(dates):
+    days = _days(dates)
+    return (days - days.astype('datetime64[M]')).astype(np.int64) + 1
+
+def cyclical(period, function):
+    return lambda values: function(2 * np.pi * values / period)
+
+def statistic_lookup(name, statistic='mean'):
+    return lambda statistics, columns: statistics.lookup(name, columns, statistic)
+
+def legacy_value(feature):
+    """Fallback of a portfolio feature from LEGACY_PORTFOLIO_VALUES"""
+    value = LEGACY_PORTFOLIO_VALUES[feature]
+    if not isinstance(value, tuple):
+        return lambda columns: np.full(_rows(columns), value)
+    encoding, default = value
+    column = feature[:-len('_TargetEncoded')]
+    return lambda columns: np.array([encoding.get(category, default) for category in columns[column]], dtype=float)
+
+def industry_seasonal_effect(statistics, columns):
+    return np.asarray(columns['PaymentEfficiency']) - statistics.lookup('efficiency_by_industry_month', columns)
+
+def target_encoding(column):
+    """Smoothed mean efficiency of an invoice's category; unseen categories get the global mean"""
+    name = f'efficiency_by_{column}'
+
+    def compute(statistics, columns):
+        target_mean = np.nan_to_num(statistics.lookup(name, columns))
+        counts = np.nan_to_num(statistics.lookup(name, columns, 'count'))
+        global_mean = statistics.overall_mean('efficiency_by_Industry')
+        smoothing = TARGET_ENCODING_SMOOTHING
+        return (target_mean * counts + global_mean * smoothing) / (counts + smoothing)
+    return compute
+
+FEATURES = {
+    # Calendar
+    'Month': Feature(['InvoiceDate'], calendar_month, np.int32),
+    'Quarter': Feature(['Month'], lambda month: (month - 1) // 3 + 1, np.int32),
+    'DayOfWeek': Feature(['InvoiceDate'], calendar_day_of_week, np.int32),
+    'DayOfMonth': Feature(['InvoiceDate'], calendar_day_of_month, np.int32),
+
+    # Continuous seasonal features
+    'MonthSin': Feature(['Month'], cyclical(12, np.sin)),
+    'MonthCos': Feature(['Month'], cyclical(12, np.cos)),
+    'QuarterSin': Feature(['Quarter'], cyclical(4, np.sin)),
+    'QuarterCos': Feature(['Quarter'], cyclical(4, np.cos)),
+    'DayOfWeekSin': Feature(['DayOfWeek'], cyclical(7, np.sin)),
+    'DayOfWeekCos': Feature(['DayOfWeek'], cyclical(7, np.cos)),
+    'DayOfMonthSin': Feature(['DayOfMonth'], cyclical(30, np.sin)),
+    'DayOfMonthCos': Feature(['DayOfMonth'], cyclical(30, np.cos)),
+
+    # Amount features
+    'LogInvoiceAmount': Feature(['InvoiceAmount'], np.log1p),
+    'AmountSquareRoot': Feature(['InvoiceAmount'], np.sqrt),
+    'AmountPerDueDay': Feature(['InvoiceAmount', 'PaymentDueDays'], np.divide),
+    'LogAmountPerDueDay': Feature(['AmountPerDueDay'], np.log1p),
+
+    # Credit score features
+    'CreditScoreNorm': Feature(['CustomerCreditScore'], lambda score: (score - 650) / 100),
+    'CreditScoreSquared': Feature(['CreditScoreNorm'], lambda norm: norm ** 2),
+    'CreditScoreCubed': Feature(['CreditScoreNorm'], lambda norm: norm ** 3),
+
+    # Interaction features
+    'CreditScore_Amount': Feature(['CreditScoreNorm', 'LogInvoiceAmount'], np.multiply),
+    'CreditScore_Market': Feature(['CreditScoreNorm', 'MarketCondition'], np.multiply),
+    'Amount_Market': Feature(['LogInvoiceAmount', 'MarketCondition'], np.multiply),
+
+    # Company features on top of the company history columns
+    'Efficiency_Consistency': Feature(['CompanyEfficiency_All', 'CompanyConsistency'], np.multiply),
+    'PaymentFrequency': Feature(['DaysSinceLastInvoice'], lambda days: 1 / (days + 1)),
+
+    # Portfolio features
+    'MarketTrend': Feature(['Month'], statistic_lookup('market_by_month'),
+                           portfolio=True, fallback=legacy_value('MarketTrend')),
+    'MarketVolatility': Feature(['Month'], statistic_lookup('market_by_month', 'std'),
+                                portfolio=True, fallback=legacy_value('MarketVolatility')),
+    # Depends on the invoice's own payment, so serving uses its expected value
+    'IndustrySeasonalEffect': Feature(['PaymentEfficiency', 'Industry', 'Month'], industry_seasonal_effect,
+                                      portfolio=True, fallback=legacy_value('IndustrySeasonalEffect'),
+                                      missing=0.0),
+    'LocationEconomicIndex': Feature(['Location', 'Quarter'], statistic_lookup('market_by_location_quarter'),
+                                     portfolio=True, fallback=legacy_value('LocationEconomicIndex')),
+    **{
+        f'{col}_TargetEncoded': Feature([col], target_encoding(col), portfolio=True,
+                                        fallback=legacy_value(f'{col}_TargetEncoded'))
+        for col in TARGET_ENCODED_COLUMNS
+    }
+}
+
+# Features defined by the input columns that depend on the invoice itself
+INVOICE_FEATURES = [name for name, feature in FEATURES.items()
+                    if not feature.portfolio and not set(feature.inputs) & set(COMPANY_HISTORY_DEFAULTS)]
+COMPANY_FEATURES = [name for name, feature in FEATURES.items() if set(feature.inputs) & set(COMPANY_HISTORY_DEFAULTS)]
+PORTFOLIO_FEATURES = [name for name, feature in FEATURES.items() if feature.portfolio]
+
+# Features whose training values use the payment being predicted
+TARGET_DEPENDENT_FEATURES = [name for name, feature in FEATURES.items() if feature.missing is not None]
+
+def _rows(source):
+    return len(source[next(iter(source))]) if len(source) else 0
+
+class FeatureTransform:
+    """The spec definitions a list of features needs, compiled into dependency order"""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.steps = []
+        for name in self.names:
+            self._visit(name)
+
+    def _visit(self, name):
+        if name in self.steps or name not in FEATURES:
+            return
+        for input_name in FEATURES[name].inputs:
+            self._visit(input_name)
+        self.steps.append(name)
+
+    def columns(self, source, statistics=None):
+        """Every step the source does not already hold, computed over it, by name"""
+        computed = {}
+        for name in self.steps:
+            if name in source:
+                continue
+            feature = FEATURES[name]
+            inputs = {}
+            for input_name in feature.inputs:
+                if input_name in computed:
+                    inputs[input_name] = computed[input_name]
+                elif input_name in source:
+                    inputs[input_name] = source[input_name]
+            if len(inputs) < len(feature.inputs):
+                if feature.missing is None:
+                    missing = sorted(set(feature.inputs) - set(inputs))
+                    raise KeyError(f"{name} needs the column(s) {', '.join(missing)}")
+                values = np.full(_rows(source), feature.missing)
+            elif not feature.portfolio:
+                values = feature.compute(*(np.asarray(values) for values in inputs.values()))
+            elif statistics is not None:
+                values = feature.compute(statistics, inputs)
+            else:
+                values = feature.fallback(inputs)
+            computed[name] = values if feature.dtype is None else np.asarray(values, dtype=feature.dtype)
+        return computed
+
+    def dependents(self, columns):
+        """Steps whose values change with any of the given columns"""
+        affected = set(columns)
+        for name in self.steps:
+            if affected.intersection(FEATURES[name].inputs):
+                affected.add(name)
+        return affected - set(columns)
+
+    def matrix(self, source, statistics=None):
+        """The features as one FEATURE_DTYPE matrix in list order, with NaN as 0"""
+        computed = self.columns(source, statistics)
+        matrix = np.empty((_rows(source), len(self.names)), dtype=FEATURE_DTYPE)
+        for i, name in enumerate(self.names):
+            matrix[:, i] = computed[name] if name in computed else np.asarray(source[name])
+        matrix[np.isnan(matrix)] = 0
+        return matrix
+
+@functools.lru_cache(maxsize=64)
+def _compile(names):
+    return FeatureTransform(names)
+
+def compile_features(names):
+    """FeatureTransform for a list of features, compiled once per list"""
+    return _compile(tuple(names))
+
+def request_columns(invoices, now=None):
+    """Source columns of a batch of API request dicts, with the API defaults for missing fields
+
+    Invoices are dated by their optional "invoiceDate" (ISO 8601), else now.
+    """
+    columns = {
+        column: np.array([convert(invoice.get(field, default)) for invoice in invoices],
+                         dtype=object if convert is str else None)
+        for field, (column, default, convert) in REQUEST_FIELDS.items()
+    }
+    now = np.datetime64(now or datetime.now(), 'us')
+    columns['InvoiceDate'] = np.array([
+        np.datetime64(invoice['invoiceDate'], 'us') if invoice.get('invoiceDate') else now
+        for invoice in invoices
+    ], dtype='datetime64[us]')
+    return columns
+
+def company_history(aggregate):
+    """COMPANY_HISTORY_VALUES of a company and its last invoice date, from its CompanyAggregate (or None)
+
+    Mirrors add_company_behavioral_features, with the aggregate's records as
+    the company's previous invoices.
+    """
+    if aggregate is None or aggregate.count == 0:
+        return [COMPANY_HISTORY_DEFAULTS[col] for col in COMPANY_HISTORY_VALUES], None
+
+    recent = aggregate.recent_efficiencies
+    efficiencies = [sum(recent[-window:]) / len(recent[-window:]) for window in EFFICIENCY_WINDOWS.values()]
+
+    window = recent[-CONSISTENCY_WINDOW:]
+    if len(window) > 1:
+        mean = sum(window) / len(window)
+        std = math.sqrt(sum((value - mean) ** 2 for value in window) / (len(window) - 1))
+    else:
+        std = NO_HISTORY_STD
+
+    # A trend needs a full window of history
+    trend = least_squares_slope(recent[-TREND_WINDOW:]) if len(recent) >= TREND_WINDOW else 0.0
+
+    return efficiencies + [aggregate.efficiency_mean, aggregate.velocity_sum / aggregate.count,
+                           1 / (1 + std), trend], aggregate.last_date
+
+def company_history_columns(histories, codes, invoice_dates):
+    """Company history columns per invoice
+
+    histories holds company_history's (values, last invoice date) per distinct
+    company and codes each invoice's index into it.
+    """
+    values = np.array([values for values, _ in histories], dtype=float).reshape(
+        len(histories), len(COMPANY_HISTORY_VALUES))[codes]
+    columns = {col: values[:, i] for i, col in enumerate(COMPANY_HISTORY_VALUES)}
+
+    last_dates = np.array([last_date for _, last_date in histories], dtype='datetime64[us]')[codes]
+    elapsed = (invoice_dates - last_dates) // np.timedelta64(1, 'D')
+    columns['DaysSinceLastInvoice'] = np.where(
+        np.isnat(last_dates), COMPANY_HISTORY_DEFAULTS['DaysSinceLastInvoice'], np.maximum(elapsed, 0)
+    ).astype(float)
+    return columns
+
+def _factorize(values):
+    """(codes, distinct values) of a column; strings are hashed rather than sorted"""
+    values = np.asarray(values)
+    if values.dtype != object:
+        uniques, codes = np.unique(values, return_inverse=True)
+        return codes.reshape(-1), uniques.tolist()
+    positions = {}
+    codes = np.fromiter((positions.setdefault(value, len(positions)) for value in values.tolist()),
+                        dtype=np.intp, count=len(values))
+    return codes, list(positions)
+
+class PortfolioStatistics:
+    """GlobalAggregates of the training data as plain lookup tables, for serving without pandas"""
+
+    def __init__(self, tables):
+        # name -> {key tuple: (count, mean, m2)}
+        self.tables = tables
+
+    def lookup(self, name, columns, statistic='mean'):
+        """Per-row value of one group statistic, NaN for groups the training data did not have"""
+        keys, _ = GLOBAL_STATISTICS[name]
+        table = self.tables[name]
+        codes, uniques = zip(*(_factorize(columns[key]) for key in keys))
+        values = np.array([_statistic(table.get(combination), statistic)
+                           for combination in itertools.product(*uniques)], dtype=float)
+        return values[np.ravel_multi_index(codes, [len(values) for values in uniques])]
+
+    def overall_mean(self, name):
+        """Mean of a statistic's value column over every training invoice"""
+        rows = self.tables[name].values()
+        return sum(count * mean for count, mean, _ in rows) / sum(count for count, _, _ in rows)
+
+def _statistic(row, statistic):
+    if row is None:
+        return math.nan
+    count, mean, m2 = row
+    if statistic == 'count':
+        return count
+    if statistic == 'std':
+        # Sample standard deviation, NaN for single-row groups like pandas' std
+        return math.sqrt(m2 / (count - 1)) if count > 1 else math.nan
+    return mean
@@ -0,0 +1,72 @@
+"""Gunicorn configuration for the production server.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+
+The app module is imported once in the master process before workers are
+forked. With INFERENCE_ENGINE=numpy the model is loaded there too, so its
+weight arrays are shared copy-on-write by every worker; TensorFlow is not
+fork-safe, so with the Keras engine each worker loads the model after fork.
+Company history defaults to the SQLite store, which all workers share.
+"""
+
+import multiprocessing
+import os
+import signal
+
+# Workers share history through SQLite; the in-memory store would give each worker its own copy
+os.environ.setdefault('HISTORY_BACKEND', 'sqlite')
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5173)}")
+
+# One worker per core: requests are CPU-bound in NumPy/TensorFlow
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Threads per worker let concurrent /predict requests share micro-batches
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+preload_app = True
+
+# Seconds in-flight requests get to finish after SIGTERM before workers are killed
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Bulk /forecast and /history/ingest requests can run for minutes
+timeout = int(os.environ.get('WORKER_TIMEOUT', 300))
+
+accesslog = os.environ.get('ACCESS_LOG')
+
+def on_starting(server):
+    import app
+
+    if app.history_store.backend == 'memory' and workers > 1:
+        server.log.warning("HISTORY_BACKEND=memory with %d workers: each worker keeps its own "
+                           "payment history; use HISTORY_BACKEND=sqlite", workers)
+    if app.INFERENCE_ENGINE == 'numpy':
+        if app.load_existing_model():
+            server.log.info("Model loaded in the master process; workers share it")
+        else:
+            server.log.info("No model files found; call POST /train")
+
+def post_fork(server, worker):
+    import app
+
+    if app.active_model is None:
+        app.load_existing_model()
+
+def post_worker_init(worker):
+    import app
+
+    # Gunicorn stops accepting on SIGTERM and drains in-flight requests;
+    # flag the worker not ready first and stop its training job
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def drain(signum, frame):
+        app.begin_shutdown()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
+
+def worker_exit(server, worker):
+    import app
+
+    app.training_jobs.shutdown()
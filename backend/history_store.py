@@ -0,0 +1,309 @@
+"""Company payment-history stores.
+
+Two interchangeable backends sit behind get_company_payment_history and
+add_company_payment_record in app.py:
+
+- InMemoryHistoryStore: the original process-local dict, for demos and tests.
+- SQLiteHistoryStore: a persistent WAL-mode SQLite database with records
+  indexed on (company, date) and one aggregate row per company, so feature
+  reads never scan a company's history.
+
+Both keep a per-company history version that is bumped on every append or
+clear, for caches of values derived from a company's history. Versions are
+drawn from one store-wide sequence, so changed_since(version) can list just
+the companies changed after a given point, e.g. for the portfolio risk index.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from company_aggregates import CompanyAggregate
+
+# Record fields persisted by the SQLite backend
+RECORD_FIELDS = ['amount', 'days_to_payment', 'payment_efficiency']
+
+class InMemoryHistoryStore:
+    """Payment history held in process-local dicts
+
+    Writers and changed_since hold one lock. Writers update a copy of a
+    company's aggregate and swap it in, so an aggregate handed out is never
+    modified under its reader.
+    """
+
+    backend = 'memory'
+
+    def __init__(self):
+        self.history = {}
+        self.aggregates = {}
+        # Company -> version, in version order: a bumped company moves to the end
+        self.versions = {}
+        self.latest_version = 0
+        self._lock = threading.Lock()
+
+    def get_history(self, company_name):
+        return self.history.get(company_name, [])
+
+    def get_aggregate(self, company_name):
+        return self.aggregates.get(company_name)
+
+    def count(self, company_name):
+        aggregate = self.aggregates.get(company_name)
+        return aggregate.count if aggregate else 0
+
+    def version(self, company_name):
+        return self.versions.get(company_name, 0)
+
+    def add_records(self, company_name, records):
+        with self._lock:
+            aggregate = self._updated_aggregate(company_name)
+            for record in records:
+                self.history[company_name].append(record)
+                aggregate.add(record)
+            self.aggregates[company_name] = aggregate
+            self._bump_version(company_name)
+
+    def add_record(self, company_name, record):
+        self.add_records(company_name, [record])
+
+    def add_history_batch(self, batch):
+        """Append a bulk-ingest HistoryBatch, merging its precomputed aggregates"""
+        with self._lock:
+            for group, company_name in enumerate(batch.companies):
+                aggregate = self._updated_aggregate(company_name)
+                self.history[company_name].extend(batch.records(group))
+                aggregate.merge(batch.aggregates[group])
+                self.aggregates[company_name] = aggregate
+                self._bump_version(company_name)
+
+    def clear(self, company_name):
+        with self._lock:
+            self.history[company_name] = []
+            self.aggregates[company_name] = CompanyAggregate()
+            self._bump_version(company_name)
+
+    def companies(self):
+        with self._lock:
+            return list(self.history)
+
+    def total_records(self):
+        with self._lock:
+            aggregates = list(self.aggregates.values())
+        return sum(aggregate.count for aggregate in aggregates)
+
+    def changed_since(self, version):
+        """(latest version, [(company, aggregate)]) for companies changed after version"""
+        changed = []
+        with self._lock:
+            for company_name, company_version in reversed(self.versions.items()):
+                if company_version <= version:
+                    break
+                changed.append((company_name, self.aggregates.get(company_name)))
+            return self.latest_version, changed
+
+    def _updated_aggregate(self, company_name):
+        """Copy of a company's aggregate to fold new records into, creating its history if new; holds the lock"""
+        if company_name not in self.history:
+            self.history[company_name] = []
+            return CompanyAggregate()
+        return self.aggregates[company_name].copy()
+
+    def _bump_version(self, company_name):
+        self.latest_version += 1
+        self.versions.pop(company_name, None)
+        self.versions[company_name] = self.latest_version
+
+class SQLiteHistoryStore:
+    """Payment history persisted in SQLite, shareable between worker processes"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript('''
+            CREATE TABLE IF NOT EXISTS payment_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company TEXT NOT NULL,
+                date TEXT NOT NULL,
+                amount REAL,
+                days_to_payment REAL,
+                payment_efficiency REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_payment_history_company_date
+                ON payment_history (company, date);
+            CREATE TABLE IF NOT EXISTS company_aggregates (
+                company TEXT PRIMARY KEY,
+                record_count INTEGER NOT NULL,
+                state TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS company_versions (
+                company TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_company_versions_version
+                ON company_versions (version);
+        ''')
+
+    def _connection(self):
+        """One connection per thread and process; connections never cross a fork"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _write_transaction(self):
+        """Explicit write transaction; BEGIN IMMEDIATE takes the write lock up front"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get_history(self, company_name):
+        rows = self._connection().execute(
+            'SELECT date, amount, days_to_payment, payment_efficiency FROM payment_history '
+            'WHERE company = ? ORDER BY date, id',
+            (company_name,)
+        ).fetchall()
+        history = []
+        for date, *values in rows:
+            record = {'date': datetime.fromisoformat(date)}
+            record.update({field: value for field, value in zip(RECORD_FIELDS, values) if value is not None})
+            history.append(record)
+        return history
+
+    def get_aggregate(self, company_name):
+        return self._read_aggregate(self._connection(), company_name)
+
+    def count(self, company_name):
+        row = self._connection().execute(
+            'SELECT record_count FROM company_aggregates WHERE company = ?', (company_name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def version(self, company_name):
+        row = self._connection().execute(
+            'SELECT version FROM company_versions WHERE company = ?', (company_name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def add_records(self, company_name, records):
+        self.add_company_records({company_name: records})
+
+    def add_record(self, company_name, record):
+        self.add_company_records({company_name: [record]})
+
+    def add_company_records(self, records_by_company):
+        """Insert records for several companies in one transaction"""
+        # The write lock is held before the aggregates are read, so concurrent
+        # writers cannot lose each other's updates.
+        with self._write_transaction() as connection:
+            for company_name, records in records_by_company.items():
+                records = [dict(record, date=record.get('date', datetime.now())) for record in records]
+                connection.executemany(
+                    'INSERT INTO payment_history (company, date, amount, days_to_payment, payment_efficiency) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(company_name, record['date'].isoformat(),
+                      *[_optional_float(record.get(field)) for field in RECORD_FIELDS])
+                     for record in records]
+                )
+                aggregate = self._read_aggregate(connection, company_name) or CompanyAggregate()
+                for record in records:
+                    aggregate.add(record)
+                self._write_aggregate(connection, company_name, aggregate)
+                self._bump_version(connection, company_name)
+
+    def add_history_batch(self, batch, chunk_rows=500000):
+        """Append a bulk-ingest HistoryBatch in one transaction, merging its precomputed aggregates"""
+        with self._write_transaction() as connection:
+            # Rows are converted to Python values a chunk at a time to bound memory
+            for start in range(0, len(batch), chunk_rows):
+                end = min(start + chunk_rows, len(batch))
+                connection.executemany(
+                    'INSERT INTO payment_history (company, date, amount, days_to_payment, payment_efficiency) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    zip(batch.company_column(start, end), batch.date_strings(start, end),
+                        *[batch.column(field, start, end) for field in RECORD_FIELDS])
+                )
+            for company_name, new_aggregate in zip(batch.companies, batch.aggregates):
+                aggregate = self._read_aggregate(connection, company_name)
+                if aggregate is None:
+                    aggregate = new_aggregate
+                else:
+                    aggregate.merge(new_aggregate)
+                self._write_aggregate(connection, company_name, aggregate)
+                self._bump_version(connection, company_name)
+
+    def clear(self, company_name):
+        with self._write_transaction() as connection:
+            connection.execute('DELETE FROM payment_history WHERE company = ?', (company_name,))
+            connection.execute('DELETE FROM company_aggregates WHERE company = ?', (company_name,))
+            self._bump_version(connection, company_name)
+
+    def companies(self):
+        return [row[0] for row in self._connection().execute('SELECT company FROM company_aggregates')]
+
+    def total_records(self):
+        return self._connection().execute(
+            'SELECT COALESCE(SUM(record_count), 0) FROM company_aggregates'
+        ).fetchone()[0]
+
+    def changed_since(self, version):
+        """(latest version, [(company, aggregate)]) for companies changed after version, by any process"""
+        rows = self._connection().execute(
+            'SELECT v.company, v.version, a.state FROM company_versions v '
+            'LEFT JOIN company_aggregates a ON a.company = v.company WHERE v.version > ?',
+            (version,)
+        ).fetchall()
+        latest = max([version] + [company_version for _, company_version, _ in rows])
+        return latest, [(company_name, CompanyAggregate.from_state(json.loads(state)) if state else None)
+                        for company_name, _, state in rows]
+
+    @staticmethod
+    def _read_aggregate(connection, company_name):
+        row = connection.execute(
+            'SELECT state FROM company_aggregates WHERE company = ?', (company_name,)
+        ).fetchone()
+        return CompanyAggregate.from_state(json.loads(row[0])) if row else None
+
+    @staticmethod
+    def _write_aggregate(connection, company_name, aggregate):
+        connection.execute(
+            'INSERT OR REPLACE INTO company_aggregates (company, record_count, state) VALUES (?, ?, ?)',
+            (company_name, aggregate.count, json.dumps(aggregate.to_state()))
+        )
+
+    @staticmethod
+    def _bump_version(connection, company_name):
+        # The next store-wide version; called inside write transactions, so
+        # versions are unique. They outlive clear(), so a cleared company never
+        # reuses an old version.
+        connection.execute(
+            'INSERT INTO company_versions (company, version) '
+            'VALUES (?, (SELECT COALESCE(MAX(version), 0) + 1 FROM company_versions)) '
+            'ON CONFLICT (company) DO UPDATE SET version = excluded.version',
+            (company_name,)
+        )
+
+def _optional_float(value):
+    return None if value is None else float(value)
+
+def create_history_store(backend, path=None):
+    """Build the history store selected by HISTORY_BACKEND"""
+    if backend == 'memory':
+        return InMemoryHistoryStore()
+    if backend == 'sqlite':
+        return SQLiteHistoryStore(path)
+    raise ValueError(f"Unknown history backend: {backend}")
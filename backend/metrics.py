@@ -0,0 +1,145 @@
+"""Lightweight in-process metrics.
+
+Histograms and counters are kept per process; MetricsRegistry renders them
+in the Prometheus text exposition format for the /metrics endpoint.
+"""
+
+import bisect
+import threading
+import time
+
+class Histogram:
+    """Fixed-bucket histogram; buckets are inclusive upper bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Cumulative bucket counts, total count and sum"""
+        with self._lock:
+            counts = list(self.bucket_counts)
+            count, total = self.count, self.sum
+        cumulative = []
+        running = 0
+        for bucket_count in counts[:-1]:
+            running += bucket_count
+            cumulative.append(running)
+        return {
+            'buckets': {str(bound): bucket_total for bound, bucket_total in zip(self.buckets, cumulative)},
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else 0.0
+        }
+
+# Request latency buckets, in seconds
+LATENCY_BUCKETS_S = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def histogram_lines(name, histogram, labels=()):
+    """Prometheus text-format sample lines of one histogram"""
+    snapshot = histogram.snapshot()
+    lines = [f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}'
+             for bound, count in snapshot['buckets'].items()]
+    lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {snapshot["count"]}')
+    lines.append(f'{name}_sum{_format_labels(labels)} {snapshot["sum"]}')
+    lines.append(f'{name}_count{_format_labels(labels)} {snapshot["count"]}')
+    return lines
+
+class MetricsRegistry:
+    """Labelled histograms, counters and scrape-time gauges, rendered as Prometheus text"""
+
+    def __init__(self):
+        # name -> (kind, help, buckets or collect function, {sorted label items: value} or None)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, buckets):
+        self._metrics[name] = ('histogram', help_text, buckets, {})
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ('counter', help_text, None, {})
+
+    def gauge(self, name, help_text, collect, kind='gauge'):
+        """collect() returns a value, or a list of (labels dict, value) pairs, at scrape time
+
+        kind='counter' exposes a running total kept elsewhere, such as a cache's hit count.
+        """
+        self._metrics[name] = (kind, help_text, collect, None)
+
+    def external_histogram(self, name, help_text, histogram):
+        """Expose a Histogram owned elsewhere, such as the micro-batcher's"""
+        self._metrics[name] = ('histogram', help_text, None, {(): histogram})
+
+    def observe(self, name, value, **labels):
+        _, _, buckets, series = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = series.setdefault(key, Histogram(buckets))
+        histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        series = self._metrics[name][3]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series[key] = series.get(key, 0) + value
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, (kind, help_text, extra, series) in self._metrics.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if series is None:
+                collected = extra()
+                if not isinstance(collected, list):
+                    collected = [({}, collected)]
+                lines.extend(f'{name}{_format_labels(tuple(sorted(labels.items())))} {value}'
+                             for labels, value in collected)
+                continue
+            with self._lock:
+                samples = list(series.items())
+            if kind == 'histogram':
+                for labels, histogram in samples:
+                    lines.extend(histogram_lines(name, histogram, labels))
+            else:
+                lines.extend(f'{name}{_format_labels(labels)} {value}' for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+class StageTimer:
+    """Splits one request's wall time into consecutive named stages"""
+
+    def __init__(self, registry, endpoint):
+        self.registry = registry
+        self.endpoint = endpoint
+        self.started = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        """Record the time since the previous mark as `stage`"""
+        now = time.perf_counter()
+        self.registry.observe('request_stage_seconds', now - self.last, endpoint=self.endpoint, stage=stage)
+        self.last = now
+
+    def finish(self, status):
+        self.registry.observe('request_duration_seconds', time.perf_counter() - self.started,
+                              endpoint=self.endpoint)
+        self.registry.inc('requests_total', endpoint=self.endpoint, status=status)
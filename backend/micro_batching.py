@@ -0,0 +1,118 @@
+"""Request coalescing for concurrent single-row predictions.
+
+Each /predict request submits its feature vectors to a MicroBatcher and
+blocks on a future. A worker thread drains the queue into batches, flushing
+when the batch reaches max_batch_size rows or when the oldest queued row has
+waited max_wait_ms, runs one model call per batch and hands every caller its
+own row. Requests announce themselves with in_flight() before building their
+features; a batch only waits while some announced request has not submitted
+yet, so a lone request is scored at once. Rows submitted with different contexts (the model version a request
+is served by) are scored in separate calls.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+from metrics import Histogram
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+QUEUE_WAIT_BUCKETS_MS = [0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250]
+
+class MicroBatcher:
+    """Coalesces concurrent (sequence, static) rows into batched model calls"""
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batch_size_histogram = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_histogram = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        # Requests inside in_flight(), each of which may still submit a row
+        self._in_flight = 0
+
+    @contextmanager
+    def in_flight(self):
+        """Count a request from before its features are built until it has its prediction"""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def submit(self, sequence_row, static_row, context=None, timeout=None):
+        """Queue one row and wait for its prediction; context is passed on to predict_fn"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((time.perf_counter(), sequence_row, static_row, context, future))
+        return future.result(timeout)
+
+    def _ensure_worker(self):
+        # The worker thread does not survive a fork, so each process starts its own
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, name='predict-micro-batcher', daemon=True).start()
+                self._worker_pid = os.getpid()
+
+    def _run(self):
+        pending = self._queue
+        max_wait = self.max_wait_ms / 1000
+        while True:
+            batch = [pending.get()]
+            deadline = batch[0][0] + max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0 and self._in_flight > len(batch):
+                        # Other requests in flight may still submit: wait for them up to the deadline
+                        batch.append(pending.get(timeout=remaining))
+                    else:
+                        # Rows already queued are taken even once nothing more is expected
+                        batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        flushed_at = time.perf_counter()
+        for enqueued_at, _, _, _, _ in batch:
+            self.queue_wait_histogram.observe((flushed_at - enqueued_at) * 1000)
+        self.batch_size_histogram.observe(len(batch))
+
+        # Normally one group; two while requests straddle a model swap
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item[3]), []).append(item)
+        for group in groups.values():
+            futures = [future for _, _, _, _, future in group]
+            try:
+                predictions = self.predict_fn(np.stack([row for _, row, _, _, _ in group]),
+                                              np.stack([row for _, _, row, _, _ in group]), group[0][3])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, prediction in zip(futures, predictions):
+                future.set_result(prediction)
+
+    def stats(self):
+        return {
+            'maxBatchSize': self.max_batch_size,
+            'maxWaitMs': self.max_wait_ms,
+            'queueDepth': self._queue.qsize(),
+            'batchSize': self.batch_size_histogram.snapshot(),
+            'queueWaitMs': self.queue_wait_histogram.snapshot()
+        }
@@ -0,0 +1,170 @@
+"""Versioned model registry.
+
+Every trained model is stored as an immutable version directory holding the
+Keras model, its NumPy weights and the artifacts pickle (scalers, feature
+lists, metrics, timestamp), plus a metadata.json summary for listing.
+CURRENT names the version being served and is replaced atomically, so every
+server process sees either the old or the new version, never a mix.
+activations.json keeps the order versions were activated in; rollback walks
+back along it.
+
+Layout:
+    MODEL_REGISTRY_DIR/
+        CURRENT
+        activations.json
+        versions/<version>/
+            payment_prediction_model.h5
+            payment_prediction_model.pkl
+            payment_prediction_model.npz
+            metadata.json
+"""
+
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): concurrent activations from several processes are not serialised
+    fcntl = None
+
+MODEL_FILE = 'payment_prediction_model.h5'
+ARTIFACTS_FILE = 'payment_prediction_model.pkl'
+NPZ_FILE = 'payment_prediction_model.npz'
+METADATA_FILE = 'metadata.json'
+
+CURRENT_FILE = 'CURRENT'
+ACTIVATIONS_FILE = 'activations.json'
+
+def _write_atomic(path, text):
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+class ModelRegistry:
+    """Directory of immutable model versions with an atomic current pointer"""
+
+    def __init__(self, root):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def paths(self, version):
+        """(model, artifacts, npz) file paths of a version"""
+        directory = self.version_dir(version)
+        return tuple(os.path.join(directory, name) for name in (MODEL_FILE, ARTIFACTS_FILE, NPZ_FILE))
+
+    def exists(self, version):
+        return bool(version) and os.path.isfile(os.path.join(self.version_dir(version), METADATA_FILE))
+
+    def register(self, model_path, artifacts_path, npz_path, metadata=None, move=False):
+        """Store a model's files as a new version and return its name; the current version is unchanged"""
+        version = datetime.now().strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+        # Assembled under a private name and renamed into place, so a version is never seen half-written
+        staging = os.path.join(self.versions_dir, f'.{version}')
+        os.makedirs(staging)
+        try:
+            transfer = shutil.move if move else shutil.copy2
+            for source, name in zip((model_path, artifacts_path, npz_path), (MODEL_FILE, ARTIFACTS_FILE, NPZ_FILE)):
+                transfer(source, os.path.join(staging, name))
+            with open(os.path.join(staging, METADATA_FILE), 'w') as f:
+                json.dump(dict(metadata or {}, version=version, registeredAt=datetime.now().isoformat()), f)
+            os.rename(staging, self.version_dir(version))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return version
+
+    def metadata(self, version):
+        """metadata.json of a version, or None if there is no such version"""
+        try:
+            with open(os.path.join(self.version_dir(version), METADATA_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def versions(self):
+        """Metadata of every version, oldest first"""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        names = sorted(name for name in os.listdir(self.versions_dir) if not name.startswith('.'))
+        return [metadata for metadata in map(self.metadata, names) if metadata is not None]
+
+    def current(self):
+        """Name of the version being served, or None"""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version if self.exists(version) else None
+
+    def activations(self):
+        try:
+            with open(os.path.join(self.root, ACTIVATIONS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def set_current(self, version):
+        """Point CURRENT at a version; raises KeyError for unknown versions"""
+        if not self.exists(version):
+            raise KeyError(version)
+        with self._lock():
+            activations = self.activations()
+            if not activations or activations[-1]['version'] != version:
+                activations.append({'version': version, 'activatedAt': datetime.now().isoformat()})
+            self._point_at(version, activations)
+
+    def previous(self):
+        """Version rollback would make current, or None"""
+        activations = self._without_current(self.activations())
+        return activations[-1]['version'] if activations else None
+
+    def rollback(self):
+        """Make the previously activated version current again; returns it, or None if there is none"""
+        with self._lock():
+            activations = self._without_current(self.activations())
+            if not activations:
+                return None
+            version = activations[-1]['version']
+            self._point_at(version, activations)
+            return version
+
+    def _without_current(self, activations):
+        """Activations up to the one before the current version's, skipping versions since deleted"""
+        current = self.current()
+        activations = list(activations)
+        while activations and (activations[-1]['version'] == current or not self.exists(activations[-1]['version'])):
+            activations.pop()
+        return activations
+
+    def _point_at(self, version, activations):
+        os.makedirs(self.root, exist_ok=True)
+        _write_atomic(os.path.join(self.root, ACTIVATIONS_FILE), json.dumps(activations))
+        _write_atomic(os.path.join(self.root, CURRENT_FILE), version + '\n')
+
+    def _lock(self):
+        """Exclusive flock serialising pointer updates across processes"""
+        os.makedirs(self.root, exist_ok=True)
+        return _FileLock(os.path.join(self.root, '.lock'))
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
@@ -0,0 +1,339 @@
+"""TensorFlow-free inference for the hybrid LSTM payment model.
+
+export_numpy_weights reads the Keras .h5 written by train_model with h5py
+and stores the weights of every layer in a compact .npz file.
+NumpyPaymentModel runs the forward pass of create_continuous_prediction_model
+on those arrays with inference-mode semantics: dropout is the identity and
+BatchNormalization uses its frozen moving statistics, which are folded into
+the neighbouring weight matrices at load time.
+
+predict_samples runs Monte-Carlo dropout instead: every row is repeated once
+per sample and pushed through one batched forward pass with fresh dropout
+masks, while BatchNormalization keeps its moving statistics. The spread of
+the samples estimates the model's uncertainty about each prediction.
+
+Usage:
+    python numpy_inference.py export [--model payment_prediction_model.h5] [--output payment_prediction_model.npz]
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+# Rows per forward pass when predict() is not given a batch size
+DEFAULT_BATCH_SIZE = 1024
+
+# Sampled rows (rows x samples) per Monte-Carlo forward pass
+DEFAULT_SAMPLE_BATCH_SIZE = 2048
+
+# Dropout rates of create_continuous_prediction_model, for .npz files exported
+# before the rates were stored with the weights. LSTMs: (input, recurrent).
+DEFAULT_DROPOUT_RATES = {
+    'lstm1': (0.4, 0.4), 'lstm2': (0.4, 0.4),
+    'dense1': 0.3, 'dense2': 0.3, 'final_dense1': 0.4, 'final_dense2': 0.3
+}
+
+def export_numpy_weights(h5_path, npz_path):
+    """Copy the weights of a saved hybrid LSTM model into a .npz file"""
+    import h5py
+
+    arrays = {}
+    with h5py.File(h5_path, 'r') as f:
+        config = json.loads(f.attrs['model_config'])
+        layers = config['config']['layers']
+        roles = _layer_roles(layers)
+        consumers = _consumers(layers)
+        weights_group = f['model_weights']
+
+        for role, layer in roles.items():
+            group = weights_group[layer['config']['name']]
+            for weight_name in group.attrs['weight_names']:
+                weight_name = weight_name.decode() if isinstance(weight_name, bytes) else weight_name
+                variable = weight_name.split('/')[-1].split(':')[0]
+                arrays[f'{role}/{variable}'] = np.asarray(group[weight_name])
+            if layer['class_name'] == 'BatchNormalization':
+                arrays[f'{role}/epsilon'] = np.asarray(layer['config']['epsilon'])
+            if layer['class_name'] == 'LSTM':
+                arrays[f'{role}/dropout'] = np.asarray(
+                    [layer['config'].get('dropout', 0.0), layer['config'].get('recurrent_dropout', 0.0)])
+            else:
+                following = consumers.get(layer['config']['name'], [])
+                if following and following[0]['class_name'] == 'Dropout':
+                    arrays[f'{role}/dropout'] = np.asarray(following[0]['config']['rate'])
+
+    np.savez(npz_path, **arrays)
+    return npz_path
+
+def _consumers(layers):
+    """Layers fed by each layer, by layer name"""
+    consumers = {}
+    for layer in layers:
+        for node in layer['inbound_nodes']:
+            for inbound in node:
+                consumers.setdefault(inbound[0], []).append(layer)
+    return consumers
+
+def _layer_roles(layers):
+    """Name the layers of the hybrid model by following its two input branches"""
+    consumers = _consumers(layers)
+
+    def follow(name, class_names):
+        """Walk the single-consumer chain from `name`, collecting layers of the given classes"""
+        found = []
+        while consumers.get(name):
+            layer = consumers[name][0]
+            if layer['class_name'] == 'Concatenate':
+                break
+            if layer['class_name'] in class_names:
+                found.append(layer)
+            name = layer['config']['name']
+        return found, name
+
+    sequence_layers, sequence_end = follow('sequence_input', ('LSTM', 'BatchNormalization'))
+    static_layers, static_end = follow('static_input', ('Dense', 'BatchNormalization'))
+    concatenate = consumers[sequence_end][0]
+    head_layers, _ = follow(concatenate['config']['name'], ('Dense',))
+
+    expected = [['LSTM', 'BatchNormalization', 'LSTM', 'BatchNormalization'],
+                ['Dense', 'BatchNormalization', 'Dense'],
+                ['Dense', 'Dense', 'Dense']]
+    found = [[layer['class_name'] for layer in branch] for branch in (sequence_layers, static_layers, head_layers)]
+    if found != expected:
+        raise ValueError(f"Unexpected model architecture: {found}")
+
+    names = ['lstm1', 'lstm1_bn', 'lstm2', 'lstm2_bn',
+             'dense1', 'dense1_bn', 'dense2',
+             'final_dense1', 'final_dense2', 'output']
+    return dict(zip(names, sequence_layers + static_layers + head_layers))
+
+def _sigmoid(x):
+    # tanh form: one transcendental per element and no overflow for large |x|
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+def _dropout_mask(rng, rate, shape, dtype):
+    """Inverted dropout mask as Keras draws it in training: kept units are scaled by 1 / (1 - rate)"""
+    if rng is None or not rate:
+        return None
+    return (rng.random(shape, dtype=dtype) >= rate) * dtype(1 / (1 - rate))
+
+def _dropped(x, mask):
+    return x if mask is None else x * mask
+
+def _sigmoid_gates_first(weights):
+    """Reorder Keras LSTM gate columns (i, f, c, o) to (i, f, o, c)"""
+    i, f, c, o = np.split(weights, 4, axis=-1)
+    return np.concatenate([i, f, o, c], axis=-1)
+
+class NumpyPaymentModel:
+    """Batched NumPy forward pass of the hybrid LSTM + feedforward model"""
+
+    def __init__(self, weights, dtype=np.float32):
+        self.dtype = dtype
+        w = {name: np.asarray(value, dtype=np.float64) for name, value in weights.items()}
+
+        # Files with stored rates list every dropout; a layer without one has none
+        stored_rates = any(name.endswith('/dropout') for name in w)
+        self.dropout_rates = {}
+        for role, default in DEFAULT_DROPOUT_RATES.items():
+            rate = w.get(f'{role}/dropout')
+            if rate is not None:
+                self.dropout_rates[role] = tuple(rate.tolist()) if rate.ndim else float(rate)
+            else:
+                self.dropout_rates[role] = (0.0, 0.0) if stored_rates and isinstance(default, tuple) else \
+                    (0.0 if stored_rates else default)
+        # Measured cost of predict_samples per sampled row, for callers that budget its latency
+        self.seconds_per_sampled_row = None
+
+        def batch_norm(role):
+            scale = w[f'{role}/gamma'] / np.sqrt(w[f'{role}/moving_variance'] + w[f'{role}/epsilon'])
+            shift = w[f'{role}/beta'] - w[f'{role}/moving_mean'] * scale
+            return scale, shift
+
+        # LSTM gate columns are reordered so the three sigmoid gates are contiguous
+        for role in ('lstm1', 'lstm2'):
+            for variable in ('kernel', 'recurrent_kernel', 'bias'):
+                w[f'{role}/{variable}'] = _sigmoid_gates_first(w[f'{role}/{variable}'])
+
+        # LSTM 1 sees one feature per step
+        self.lstm1_kernel = w['lstm1/kernel'][0]
+        self.lstm1_recurrent = w['lstm1/recurrent_kernel']
+        self.lstm1_bias = w['lstm1/bias']
+
+        # Fold the BatchNorm after LSTM 1 into LSTM 2's input kernel
+        scale, shift = batch_norm('lstm1_bn')
+        self.lstm2_kernel = scale[:, None] * w['lstm2/kernel']
+        self.lstm2_recurrent = w['lstm2/recurrent_kernel']
+        self.lstm2_bias = w['lstm2/bias'] + shift @ w['lstm2/kernel']
+        # LSTM 2's input dropout comes after that BatchNorm, so with dropout the shift is masked per row
+        self.lstm2_shift_kernel = shift[:, None] * w['lstm2/kernel']
+        self.lstm2_input_bias = w['lstm2/bias']
+
+        self.dense1_kernel = w['dense1/kernel']
+        self.dense1_bias = w['dense1/bias']
+
+        # Fold the BatchNorm after dense 1 into dense 2
+        scale, shift = batch_norm('dense1_bn')
+        self.dense2_kernel = scale[:, None] * w['dense2/kernel']
+        self.dense2_bias = w['dense2/bias'] + shift @ w['dense2/kernel']
+
+        # Fold the BatchNorm after LSTM 2 into the sequence half of the head
+        scale, shift = batch_norm('lstm2_bn')
+        lstm2_units = self.lstm2_recurrent.shape[0]
+        head_kernel = w['final_dense1/kernel']
+        self.head_sequence_kernel = scale[:, None] * head_kernel[:lstm2_units]
+        self.head_static_kernel = head_kernel[lstm2_units:]
+        self.head_bias = w['final_dense1/bias'] + shift @ head_kernel[:lstm2_units]
+
+        self.final_dense2_kernel = w['final_dense2/kernel']
+        self.final_dense2_bias = w['final_dense2/bias']
+        self.output_kernel = w['output/kernel']
+        self.output_bias = w['output/bias']
+
+        for name, value in list(vars(self).items()):
+            if isinstance(value, np.ndarray):
+                setattr(self, name, value.astype(dtype))
+
+    @classmethod
+    def load(cls, npz_path, dtype=np.float32):
+        with np.load(npz_path) as weights:
+            return cls(dict(weights), dtype=dtype)
+
+    @staticmethod
+    def _lstm(input_projection, recurrent_kernel, return_sequences, recurrent_mask=None):
+        """Run an LSTM over precomputed input projections of shape (batch, steps, 4 * units)
+
+        recurrent_mask is a (batch, units) recurrent dropout mask, reused at every step.
+        """
+        batch, steps, _ = input_projection.shape
+        units = recurrent_kernel.shape[0]
+        h = np.zeros((batch, units), dtype=input_projection.dtype)
+        c = np.zeros((batch, units), dtype=input_projection.dtype)
+        outputs = np.empty((batch, steps, units), dtype=input_projection.dtype) if return_sequences else None
+
+        for step in range(steps):
+            z = input_projection[:, step] + _dropped(h, recurrent_mask) @ recurrent_kernel
+            # Gate order after _sigmoid_gates_first: input, forget, output, cell
+            gates = _sigmoid(z[:, :3 * units])
+            i = gates[:, :units]
+            f = gates[:, units:2 * units]
+            o = gates[:, 2 * units:]
+            g = np.tanh(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+            if return_sequences:
+                outputs[:, step] = h
+        return outputs if return_sequences else h
+
+    def _forward(self, sequence, static, rng=None):
+        """Forward pass; with rng, every row gets its own dropout masks as in training"""
+        return self._head(self._sequence_branch(sequence, rng), static, rng)
+
+    def _sequence_branch(self, sequence, rng=None):
+        """(batch, 8) -> (batch, 8, 1) -> LSTM(64) -> LSTM(32)"""
+        batch = len(sequence)
+        rates = self.dropout_rates
+        lstm1_units = self.lstm1_recurrent.shape[0]
+        lstm2_units = self.lstm2_recurrent.shape[0]
+
+        def mask(rate, units):
+            return _dropout_mask(rng, rate, (batch, units), self.dtype)
+
+        # LSTM input masks are drawn per row and reused at every step
+        projection = _dropped(sequence, mask(rates['lstm1'][0], 1))[:, :, None] * self.lstm1_kernel + self.lstm1_bias
+        lstm1 = self._lstm(projection, self.lstm1_recurrent, return_sequences=True,
+                           recurrent_mask=mask(rates['lstm1'][1], lstm1_units))
+        lstm2_mask = mask(rates['lstm2'][0], lstm1_units)
+        if lstm2_mask is None:
+            projection = lstm1 @ self.lstm2_kernel + self.lstm2_bias
+        else:
+            projection = ((lstm1 * lstm2_mask[:, None]) @ self.lstm2_kernel
+                          + (lstm2_mask @ self.lstm2_shift_kernel + self.lstm2_input_bias)[:, None])
+        return self._lstm(projection, self.lstm2_recurrent, return_sequences=False,
+                          recurrent_mask=mask(rates['lstm2'][1], lstm2_units))
+
+    def _head(self, lstm2, static, rng=None):
+        """Static branch and the head over both branches, from the sequence branch's output"""
+        batch = len(static)
+        rates = self.dropout_rates
+
+        def mask(rate, units):
+            return _dropout_mask(rng, rate, (batch, units), self.dtype)
+
+        # Static branch
+        dense1 = np.maximum(static @ self.dense1_kernel + self.dense1_bias, 0)
+        dense1 = _dropped(dense1, mask(rates['dense1'], dense1.shape[1]))
+        dense2 = np.maximum(dense1 @ self.dense2_kernel + self.dense2_bias, 0)
+        dense2 = _dropped(dense2, mask(rates['dense2'], dense2.shape[1]))
+
+        # Head over the concatenated branches
+        hidden = np.maximum(lstm2 @ self.head_sequence_kernel + dense2 @ self.head_static_kernel
+                            + self.head_bias, 0)
+        hidden = _dropped(hidden, mask(rates['final_dense1'], hidden.shape[1]))
+        hidden = np.maximum(hidden @ self.final_dense2_kernel + self.final_dense2_bias, 0)
+        hidden = _dropped(hidden, mask(rates['final_dense2'], hidden.shape[1]))
+        return hidden @ self.output_kernel + self.output_bias
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        """Keras-compatible predict: [sequence, static] -> array of shape (batch, 1)"""
+        sequence, static = (np.asarray(x, dtype=self.dtype) for x in inputs)
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        if len(sequence) <= batch_size:
+            return self._forward(sequence, static)
+        return np.concatenate([
+            self._forward(sequence[start:start + batch_size], static[start:start + batch_size])
+            for start in range(0, len(sequence), batch_size)
+        ])
+
+    def predict_repeated_sequences(self, sequence, static, repeats, batch_size=None):
+        """predict() for static rows that come in runs of `repeats` per sequence row
+
+        Row i of sequence pairs with static rows i * repeats to (i + 1) * repeats - 1.
+        The LSTM branch, most of the cost, runs once per sequence row.
+        """
+        sequence = np.asarray(sequence, dtype=self.dtype)
+        static = np.asarray(static, dtype=self.dtype)
+        sequence_outputs = self._sequence_branch(sequence)
+        rows_per_pass = max(1, (batch_size or DEFAULT_BATCH_SIZE) // repeats)
+        return np.concatenate([
+            self._head(np.repeat(sequence_outputs[start:start + rows_per_pass], repeats, axis=0),
+                       static[start * repeats:(start + rows_per_pass) * repeats])
+            for start in range(0, len(sequence), rows_per_pass)
+        ])
+
+    def predict_samples(self, inputs, samples, rng=None, batch_size=None):
+        """Monte-Carlo dropout predictions of shape (rows, samples)
+
+        Each row is repeated `samples` times so all of its stochastic passes
+        run in one batched forward pass of about batch_size sampled rows.
+        """
+        started = time.perf_counter()
+        sequence, static = (np.asarray(x, dtype=self.dtype) for x in inputs)
+        rng = rng if rng is not None else np.random.default_rng()
+        rows_per_pass = max(1, (batch_size or DEFAULT_SAMPLE_BATCH_SIZE) // samples)
+        predictions = np.empty((len(sequence), samples), dtype=self.dtype)
+        for start in range(0, len(sequence), rows_per_pass):
+            end = min(start + rows_per_pass, len(sequence))
+            predictions[start:end] = self._forward(np.repeat(sequence[start:end], samples, axis=0),
+                                                   np.repeat(static[start:end], samples, axis=0),
+                                                   rng).reshape(end - start, samples)
+        # Small calls are dominated by per-call overhead, so only full passes measure the cost
+        if len(sequence) >= rows_per_pass:
+            self.seconds_per_sampled_row = (time.perf_counter() - started) / predictions.size
+        return predictions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help='Export .h5 weights to .npz')
+    export.add_argument('--model', default='payment_prediction_model.h5')
+    export.add_argument('--output', default='payment_prediction_model.npz')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_numpy_weights(args.model, args.output)
+        print(f"✅ Exported {args.model} -> {args.output}")
+
+if __name__ == '__main__':
+    main()
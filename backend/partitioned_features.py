@@ -0,0 +1,229 @@
+"""Out-of-core feature engineering, partitioned by company.
+
+engineer_continuous_features needs the whole invoice frame in memory. This
+module computes the same features for files too large for that:
+
+1. One streaming pass reads the input in chunks, adds the per-invoice
+   features, folds each chunk into the global aggregates (month, industry
+   and location means, target encodings) and appends its rows to one of
+   --shards partitions chosen by a hash of the company name, so every
+   company's invoices land in a single shard.
+2. A process pool engineers the shards independently: each worker loads one
+   shard, sorts it, computes the per-company rolling features and joins the
+   global aggregates back in.
+3. Columns that fill missing values with a median get it from all shards,
+   and the pool fills the shards in place.
+
+The output directory holds one features-NNNNN.pkl frame per shard plus a
+manifest; prepare_partitioned_data turns it into training matrices. Parquet
+and Arrow IPC input need pyarrow.
+
+Usage:
+    python partitioned_features.py invoices.parquet --output features/ [--shards 64] [--workers 4]
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import RobustScaler
+
+from feature_engineering import (
+    GlobalAggregates, add_invoice_features, sort_by_company_and_date, add_company_features,
+    fill_value, columns_with_missing_values, feature_matrix, scale_in_place,
+    SEQUENCE_FEATURES, STATIC_FEATURES, FEATURE_DTYPE
+)
+from history_ingest import detect_format
+
+DEFAULT_SHARDS = 64
+DEFAULT_CHUNK_ROWS = 500000
+
+MANIFEST_FILE = 'manifest.json'
+AGGREGATES_FILE = 'global_aggregates.pkl'
+PARTITIONS_DIR = 'partitions'
+
+def read_invoice_chunks(source, fmt, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield DataFrames of at most about chunk_rows invoices from a CSV, Parquet or Arrow IPC file"""
+    if fmt == 'csv':
+        yield from pd.read_csv(source, chunksize=chunk_rows)
+        return
+    if fmt not in ('parquet', 'arrow'):
+        raise ValueError(f"Unknown input format: {fmt}")
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError(f"Reading {fmt} files requires pyarrow (pip install pyarrow)")
+
+    if fmt == 'parquet':
+        import pyarrow.parquet
+        for batch in pyarrow.parquet.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+        return
+    # Arrow IPC files are read in the record batches they were written with
+    with pyarrow.memory_map(source) as stream:
+        reader = pyarrow.ipc.open_file(stream)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).to_pandas()
+
+def company_shards(companies, num_shards):
+    """Shard number of each invoice from a stable hash of its company name"""
+    hashes = pd.util.hash_array(np.asarray(companies, dtype=object))
+    return (hashes % np.uint64(num_shards)).astype(np.int64)
+
+def partition_invoices(chunks, partition_dir, num_shards):
+    """Split chunks of raw invoices into shard directories; returns the global aggregates and row count"""
+    aggregates = GlobalAggregates()
+    rows = 0
+    for chunk_index, chunk in enumerate(chunks):
+        chunk['InvoiceDate'] = pd.to_datetime(chunk['InvoiceDate'])
+        chunk = add_invoice_features(chunk)
+        aggregates.update(chunk)
+        rows += len(chunk)
+
+        for shard, part in chunk.groupby(company_shards(chunk['Company'], num_shards), sort=False):
+            shard_dir = os.path.join(partition_dir, f'shard-{shard:05d}')
+            os.makedirs(shard_dir, exist_ok=True)
+            part.to_pickle(os.path.join(shard_dir, f'part-{chunk_index:06d}.pkl'))
+    return aggregates, rows
+
+def engineer_shard(shard_dir, output_path, aggregates):
+    """Engineer the features of one shard's invoices; returns its row count and columns with missing values"""
+    parts = [pd.read_pickle(path) for path in sorted(glob.glob(os.path.join(shard_dir, 'part-*.pkl')))]
+    df = pd.concat(parts, ignore_index=True)
+    del parts
+
+    df = sort_by_company_and_date(df)
+    df = add_company_features(df)
+    df = aggregates.add_features(df)
+    df.to_pickle(output_path)
+    shutil.rmtree(shard_dir)
+    return len(df), columns_with_missing_values(df)
+
+def present_values(path, columns):
+    """Non-missing values of some columns of one engineered shard"""
+    df = pd.read_pickle(path)
+    return {col: df[col].dropna().to_numpy() for col in columns}
+
+def fill_shard(path, fill_values):
+    df = pd.read_pickle(path)
+    df.fillna({col: value for col, value in fill_values.items() if col in df.columns}, inplace=True)
+    df.to_pickle(path)
+
+def shard_paths(output_dir):
+    return sorted(glob.glob(os.path.join(output_dir, 'features-*.pkl')))
+
+def engineer_partitioned_features(source, output_dir, fmt=None, num_shards=DEFAULT_SHARDS,
+                                  workers=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Engineer the features of an invoice file shard by shard into output_dir; returns run statistics"""
+    fmt = fmt or detect_format(source)
+    workers = workers or os.cpu_count()
+    os.makedirs(output_dir, exist_ok=True)
+    for stale in shard_paths(output_dir):
+        os.remove(stale)
+    partition_dir = os.path.join(output_dir, PARTITIONS_DIR)
+    shutil.rmtree(partition_dir, ignore_errors=True)
+
+    started = time.perf_counter()
+    aggregates, rows = partition_invoices(read_invoice_chunks(source, fmt, chunk_rows), partition_dir, num_shards)
+    with open(os.path.join(output_dir, AGGREGATES_FILE), 'wb') as f:
+        pickle.dump(aggregates, f)
+    partitioned = time.perf_counter()
+
+    # Spawned workers start without the parent's memory or TensorFlow state
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        shard_dirs = sorted(glob.glob(os.path.join(partition_dir, 'shard-*')))
+        output_paths = [os.path.join(output_dir, f"features-{os.path.basename(path)[len('shard-'):]}.pkl")
+                        for path in shard_dirs]
+        results = list(pool.map(engineer_shard, shard_dirs, output_paths, [aggregates] * len(shard_dirs)))
+        engineered = time.perf_counter()
+
+        # Median fills need every shard's values; the fixed fills do not
+        missing = sorted({col for _, columns in results for col in columns})
+        fill_values = {col: fill_value(col, None) for col in missing}
+        median_columns = [col for col, value in fill_values.items() if value is None]
+        if median_columns:
+            values = list(pool.map(present_values, output_paths, [median_columns] * len(output_paths)))
+            for col in median_columns:
+                fill_values[col] = pd.Series(np.concatenate([shard[col] for shard in values])).median()
+            del values
+        if fill_values:
+            list(pool.map(fill_shard, output_paths, [fill_values] * len(output_paths)))
+    shutil.rmtree(partition_dir, ignore_errors=True)
+    finished = time.perf_counter()
+
+    stats = {
+        'rows': rows,
+        'shards': len(output_paths),
+        'workers': workers,
+        'partitionSeconds': round(partitioned - started, 3),
+        'engineerSeconds': round(engineered - partitioned, 3),
+        'fillSeconds': round(finished - engineered, 3),
+        'seconds': round(finished - started, 3),
+        'fillValues': {col: float(value) for col, value in fill_values.items()}
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+def read_partitioned_features(output_dir, columns=None):
+    """Concatenate the engineered shards (optionally only some columns) into one frame"""
+    frames = []
+    for path in shard_paths(output_dir):
+        df = pd.read_pickle(path)
+        frames.append(df if columns is None else df[columns])
+    return pd.concat(frames, ignore_index=True)
+
+def prepare_partitioned_data(output_dir, sequence_features=None, static_features=None):
+    """prepare_continuous_data's return tuple, built shard by shard from engineered shards"""
+    sequence_features = sequence_features or SEQUENCE_FEATURES
+    static_features = static_features or STATIC_FEATURES
+    with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+        rows = json.load(f)['rows']
+
+    # Preallocated and filled one shard at a time, so only one shard's frame is in memory
+    X_sequence = np.empty((rows, len(sequence_features)), dtype=FEATURE_DTYPE)
+    X_static = np.empty((rows, len(static_features)), dtype=FEATURE_DTYPE)
+    y = np.empty(rows, dtype=FEATURE_DTYPE)
+    start = 0
+    for path in shard_paths(output_dir):
+        df = pd.read_pickle(path)
+        end = start + len(df)
+        X_sequence[start:end] = feature_matrix(df, sequence_features)
+        X_static[start:end] = feature_matrix(df, static_features)
+        y[start:end] = df['DaysToPayment']
+        start = end
+        del df
+
+    sequence_scaler = RobustScaler()
+    static_scaler = RobustScaler()
+    scale_in_place(sequence_scaler, X_sequence)
+    scale_in_place(static_scaler, X_static)
+    return X_sequence, X_static, y, sequence_scaler, static_scaler, sequence_features, static_features
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='CSV, Parquet or Arrow IPC file of invoices')
+    parser.add_argument('--output', required=True, help='Directory for the engineered shards')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], help='Defaults to the file extension')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS, help='Company partitions')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help='Rows read per chunk in the partitioning pass')
+
+    args = parser.parse_args()
+    stats = engineer_partitioned_features(args.source, args.output, args.format, args.shards,
+                                          args.workers, args.chunk_rows)
+    print(f"✅ Engineered {stats['rows']:,} invoices into {stats['shards']} shards in {args.output} "
+          f"in {stats['seconds']:.2f}s with {stats['workers']} workers (partition {stats['partitionSeconds']:.2f}s, "
+          f"engineer {stats['engineerSeconds']:.2f}s, fill {stats['fillSeconds']:.2f}s)")
+
+if __name__ == '__main__':
+    main()
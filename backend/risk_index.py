@@ -0,0 +1,177 @@
+"""Portfolio-wide customer risk index.
+
+Holds the /customer-risk score of every company with payment history in a
+list kept sorted from riskiest to safest, so the top k companies are a
+slice and score thresholds (including the risk levels) are a binary search.
+refresh() follows the history store's change feed and rescores only the
+companies whose history changed since the last refresh, whichever process
+appended it.
+"""
+
+import bisect
+import threading
+
+# Risk scores are in [0, 100]; a level covers scores up to its bound
+LOW_RISK_MAX_SCORE = 25
+MEDIUM_RISK_MAX_SCORE = 50
+RISK_LEVELS = ('low', 'medium', 'high')
+
+# Payment efficiency slopes within this of zero count as a stable trend
+TREND_TOLERANCE = 0.005
+TRENDS = ('improving', 'stable', 'declining')
+
+# Above this share of the index changed at once, re-sorting beats inserting one by one
+REBUILD_FRACTION = 0.1
+
+def risk_score(features):
+    """Risk score from a company's payment efficiency and consistency"""
+    return (1 - features['efficiency_all']) * 70 + (1 - features['consistency']) * 30
+
+def risk_level(score):
+    if score <= LOW_RISK_MAX_SCORE:
+        return 'low'
+    if score <= MEDIUM_RISK_MAX_SCORE:
+        return 'medium'
+    return 'high'
+
+def trend_direction(trend):
+    if trend > TREND_TOLERANCE:
+        return 'improving'
+    if trend < -TREND_TOLERANCE:
+        return 'declining'
+    return 'stable'
+
+def risk_assessment(features, history_records):
+    """The /customer-risk response fields for one company's behavioral features"""
+    efficiency = features['efficiency_all']
+    score = risk_score(features)
+    return {
+        'riskLevel': risk_level(score),
+        'riskScore': round(score, 1),
+        # Efficiency converted to delay days
+        'averageDelayDays': round((1 - efficiency) * 20, 1),
+        'paymentReliability': round(efficiency * 100, 1),
+        'historyRecords': history_records,
+        'companyFeatures': {
+            'efficiency': round(efficiency, 3),
+            'consistency': round(features['consistency'], 3),
+            'trend': round(features['trend'], 3)
+        }
+    }
+
+class RiskEntry:
+    """Indexed risk of one company"""
+
+    __slots__ = ('company', 'score', 'level', 'trend', 'history_records', 'features')
+
+    def __init__(self, company, features, history_records):
+        self.company = company
+        self.score = risk_score(features)
+        self.level = risk_level(self.score)
+        self.trend = trend_direction(features['trend'])
+        self.history_records = history_records
+        self.features = features
+
+    @property
+    def key(self):
+        return (-self.score, self.company)
+
+    def to_dict(self):
+        return dict(risk_assessment(self.features, self.history_records), customerName=self.company)
+
+    def matches(self, level=None, trend=None, min_history=0, min_score=None, max_score=None):
+        """Whether the entry passes the filters RiskIndex.top takes"""
+        return ((level is None or self.level == level) and (trend is None or self.trend == trend)
+                and self.history_records >= min_history
+                and (min_score is None or self.score >= min_score)
+                and (max_score is None or self.score <= max_score))
+
+class RiskIndex:
+    """Thread-safe risk scores of every company in a history store, ordered by score"""
+
+    def __init__(self, history_store):
+        self.history_store = history_store
+        self.version = 0
+        self._entries = {}
+        # Parallel lists in index order: (-score, company) keys and the negated scores alone to bisect on
+        self._keys = []
+        self._negated_scores = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def refresh(self):
+        """Rescore the companies whose history changed since the last refresh; returns how many"""
+        with self._lock:
+            version, changed = self.history_store.changed_since(self.version)
+            if not changed:
+                return 0
+            if len(changed) > REBUILD_FRACTION * max(len(self._entries), 1):
+                for company, aggregate in changed:
+                    self._entries.pop(company, None)
+                    if aggregate is not None and aggregate.count:
+                        self._entries[company] = RiskEntry(company, aggregate.features(), aggregate.count)
+                self._keys = sorted(entry.key for entry in self._entries.values())
+                self._negated_scores = [key[0] for key in self._keys]
+            else:
+                for company, aggregate in changed:
+                    self._remove(company)
+                    if aggregate is not None and aggregate.count:
+                        self._insert(RiskEntry(company, aggregate.features(), aggregate.count))
+            self.version = version
+            return len(changed)
+
+    def get(self, company):
+        """RiskEntry of a company, or None if it has no payment history"""
+        return self._entries.get(company)
+
+    def top(self, k=None, level=None, trend=None, min_history=0, min_score=None, max_score=None):
+        """Up to k riskiest entries, riskiest first, optionally filtered
+
+        Score bounds and levels narrow a contiguous range by binary search;
+        trend and min_history are checked while walking it.
+        """
+        if k is not None and k <= 0:
+            return []
+        with self._lock:
+            start, end = 0, len(self._keys)
+            if level == 'high':
+                end = min(end, bisect.bisect_left(self._negated_scores, -MEDIUM_RISK_MAX_SCORE))
+            elif level == 'medium':
+                start = max(start, bisect.bisect_left(self._negated_scores, -MEDIUM_RISK_MAX_SCORE))
+                end = min(end, bisect.bisect_left(self._negated_scores, -LOW_RISK_MAX_SCORE))
+            elif level == 'low':
+                start = max(start, bisect.bisect_left(self._negated_scores, -LOW_RISK_MAX_SCORE))
+            if min_score is not None:
+                end = min(end, bisect.bisect_right(self._negated_scores, -min_score))
+            if max_score is not None:
+                start = max(start, bisect.bisect_left(self._negated_scores, -max_score))
+
+            if trend is None and not min_history:
+                keys = self._keys[start:end if k is None else min(end, start + k)]
+                return [self._entries[company] for _, company in keys]
+
+            entries = []
+            for i in range(start, end):
+                entry = self._entries[self._keys[i][1]]
+                if (trend is None or entry.trend == trend) and entry.history_records >= min_history:
+                    entries.append(entry)
+                    if k is not None and len(entries) >= k:
+                        break
+            return entries
+
+    def _insert(self, entry):
+        key = entry.key
+        i = bisect.bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._negated_scores.insert(i, key[0])
+        self._entries[entry.company] = entry
+
+    def _remove(self, company):
+        entry = self._entries.pop(company, None)
+        if entry is None:
+            return
+        i = bisect.bisect_left(self._keys, entry.key)
+        del self._keys[i]
+        del self._negated_scores[i]
@@ -0,0 +1,438 @@
+"""Training pipeline for the payment prediction model.
+
+Everything here is only needed by POST /train and offline tooling, so app.py
+imports this module lazily and serving workers never pay for TensorFlow,
+pandas or sklearn's training modules. The synthetic data and feature
+engineering it trains on live in feature_engineering.py.
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import mean_absolute_error, r2_score
+import tensorflow as tf
+from tensorflow.keras.models import Model
+from tensorflow.keras.layers import LSTM, Dense, Dropout, BatchNormalization, Input, Concatenate
+from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCheckpoint
+from tensorflow.keras.regularizers import l1_l2
+import hashlib
+import inspect
+import os
+import pickle
+import time
+from datetime import datetime
+
+import feature_engineering
+import feature_spec
+from feature_engineering import (generate_improved_synthetic_data, engineer_continuous_features,
+                                 prepare_continuous_data, feature_matrix, transform_in_place, GlobalAggregates,
+                                 SEQUENCE_FEATURES, STATIC_FEATURES, FEATURE_DTYPE)
+from feature_matrix_cache import FeatureMatrixCache, cache_key
+from history_ingest import detect_format
+from numpy_inference import export_numpy_weights
+
+# Directory of cached training matrices (see feature_matrix_cache.py); empty disables the cache
+FEATURE_MATRIX_CACHE_DIR = os.environ.get('FEATURE_MATRIX_CACHE_DIR', 'feature_matrix_cache')
+
+# Training data of models whose artifacts predate 'training_data': POST /train's defaults
+DEFAULT_TRAINING_DATA = {'num_customers': 200, 'num_invoices': 80000, 'seed': 42}
+
+def continuous_loss(y_true, y_pred):
+    """Custom loss function for continuous predictions"""
+    mse = tf.reduce_mean(tf.square(y_true - y_pred))
+    # Add clustering penalty to encourage predictions near common payment terms
+    common_terms = tf.constant([15.0, 30.0, 45.0, 60.0, 90.0])
+    distances = tf.abs(tf.expand_dims(y_pred, -1) - tf.expand_dims(common_terms, 0))
+    min_distances = tf.reduce_min(distances, axis=-1)
+    clustering_penalty = tf.reduce_mean(tf.exp(-min_distances))
+    return mse + 0.1 * clustering_penalty
+
+def create_continuous_prediction_model(sequence_features, static_features):
+    """Create a hybrid LSTM + feedforward model designed for continuous predictions"""
+
+    # Sequence input for LSTM processing
+    sequence_input = Input(shape=(sequence_features,), name='sequence_input')
+    sequence_reshaped = tf.keras.layers.Reshape((sequence_features, 1))(sequence_input)
+
+    # LSTM layers for sequence processing
+    lstm1 = LSTM(64, return_sequences=True, dropout=0.4, recurrent_dropout=0.4,
+                 kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(sequence_reshaped)
+    lstm1_bn = BatchNormalization()(lstm1)
+
+    lstm2 = LSTM(32, return_sequences=False, dropout=0.4, recurrent_dropout=0.4,
+                 kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(lstm1_bn)
+    lstm2_bn = BatchNormalization()(lstm2)
+
+    # Static input for dense processing
+    static_input = Input(shape=(static_features,), name='static_input')
+
+    # Dense layers for static features
+    dense1 = Dense(64, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(static_input)
+    dense1_dropout = Dropout(0.3)(dense1)
+    dense1_bn = BatchNormalization()(dense1_dropout)
+
+    dense2 = Dense(32, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(dense1_bn)
+    dense2_dropout = Dropout(0.3)(dense2)
+
+    # Combine LSTM and dense outputs
+    combined = Concatenate()([lstm2_bn, dense2_dropout])
+
+    # Final prediction layers
+    final_dense1 = Dense(32, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(combined)
+    final_dropout1 = Dropout(0.4)(final_dense1)
+
+    final_dense2 = Dense(16, activation='relu', kernel_regularizer=l1_l2(l1=0.001, l2=0.001))(final_dropout1)
+    final_dropout2 = Dropout(0.3)(final_dense2)
+
+    # Output layer
+    output = Dense(1, activation='linear', name='days_prediction')(final_dropout2)
+
+    # Create model
+    model = Model(inputs=[sequence_input, static_input], outputs=output)
+
+    # Compile model
+    model.compile(
+        optimizer='adam',
+        loss=continuous_loss,
+        metrics=['mae', 'mse']
+    )
+
+    return model
+
+def training_split_order(num_samples, test_size=0.15, val_size=0.18, random_state=42):
+    """Row order putting the train, validation and test rows in contiguous blocks, and the block sizes.
+
+    The rows are the ones two chained train_test_split calls on the data
+    would pick, chosen on row indices so the data itself is reordered once
+    and every split is a slice of it.
+    """
+    temp, test = train_test_split(np.arange(num_samples), test_size=test_size, random_state=random_state,
+                                  shuffle=True)
+    train, val = train_test_split(temp, test_size=val_size, random_state=random_state, shuffle=True)
+    return np.concatenate([train, val, test]), len(train), len(val)
+
+def feature_pipeline_hash():
+    """Hash of the source of the code that turns generator parameters into training matrices"""
+    source = inspect.getsource(feature_engineering) + inspect.getsource(feature_spec)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+def load_or_prepare_training_data(num_customers, num_invoices, seed, cache_dir=FEATURE_MATRIX_CACHE_DIR,
+                                  progress=None):
+    """prepare_continuous_data output for the synthetic data set and its PortfolioStatistics
+
+    Both come from the feature-matrix cache when possible.
+    """
+    progress = progress or (lambda phase, **info: None)
+
+    cache = FeatureMatrixCache(cache_dir) if cache_dir else None
+    generator_params = {'num_customers': num_customers, 'num_invoices': num_invoices, 'seed': seed}
+    key = cache_key(generator_params, SEQUENCE_FEATURES, STATIC_FEATURES, feature_pipeline_hash())
+
+    if cache is not None:
+        prepared = cache.load(key)
+        if prepared is not None:
+            progress('prepare', cached=True)
+            print(f"⚡ Loaded {len(prepared[2])} prepared samples from the feature-matrix cache ({key})")
+            return prepared, cache.load_statistics(key)
+
+    # Generate data
+    progress('generate')
+    print("📊 Generating synthetic data...")
+    started = time.perf_counter()
+    synthetic_df = generate_improved_synthetic_data(num_customers, num_invoices, seed)
+    print(f"✅ Generated {len(synthetic_df)} invoice records")
+
+    # Engineer features
+    progress('engineer')
+    print("🔧 Engineering features...")
+    aggregates = GlobalAggregates()
+    df_continuous = engineer_continuous_features(synthetic_df, aggregates)
+    statistics = aggregates.portfolio_statistics()
+    del synthetic_df
+    print("✅ Feature engineering completed")
+
+    # Prepare data
+    progress('prepare', cached=False)
+    print("🎯 Preparing data for modeling...")
+    prepared = prepare_continuous_data(df_continuous)
+
+    if cache is not None:
+        cache.save(key, prepared, {'generator': generator_params,
+                                   'seconds': round(time.perf_counter() - started, 3)}, statistics)
+        print(f"💾 Cached prepared training data ({key})")
+    return prepared, statistics
+
+class ProgressCallback(tf.keras.callbacks.Callback):
+    """Reports the fit phase after every epoch"""
+
+    def __init__(self, progress, epochs):
+        super().__init__()
+        self.progress = progress
+        self.epochs = epochs
+
+    def on_epoch_end(self, epoch, logs=None):
+        metrics = {name: float(value) for name, value in (logs or {}).items()}
+        self.progress('fit', epoch=epoch + 1, epochs=self.epochs, metrics=metrics)
+
+def train_model(model_path, artifacts_path, npz_path, num_customers=200, num_invoices=80000, seed=42,
+                epochs=100, progress=None, checkpoint_path='best_model_temp.h5',
+                feature_cache_dir=FEATURE_MATRIX_CACHE_DIR):
+    """Train the ML model with full LSTM + feedforward architecture and save its artifacts
+
+    `progress(phase, **info)` is called as training moves through the
+    generate, engineer, prepare, fit, evaluate and save phases; generate and
+    engineer are skipped when the prepared data comes from the feature-matrix cache.
+    """
+    progress = progress or (lambda phase, **info: None)
+
+    # Set random seeds for reproducibility
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+    print("=" * 50)
+    print("🚀 TRAINING PAYMENT PREDICTION MODEL")
+    print("=" * 50)
+
+    prepared, portfolio_statistics = load_or_prepare_training_data(
+        num_customers, num_invoices, seed, feature_cache_dir, progress)
+    X_seq, X_static, y, seq_scaler, static_scaler, seq_features, static_features = prepared
+    print(f"✅ Data prepared: {X_seq.shape[0]} samples")
+
+    # Split data: reorder once, then every split is a view
+    order, num_train, num_val = training_split_order(len(y))
+    X_seq, X_static, y = X_seq[order], X_static[order], y[order]
+    train, val, test = slice(0, num_train), slice(num_train, num_train + num_val), slice(num_train + num_val, None)
+    X_seq_train, X_seq_val, X_seq_test = X_seq[train], X_seq[val], X_seq[test]
+    X_static_train, X_static_val, X_static_test = X_static[train], X_static[val], X_static[test]
+    y_train, y_val, y_test = y[train], y[val], y[test]
+
+    print(f"📈 Training samples: {X_seq_train.shape[0]}")
+    print(f"📊 Validation samples: {X_seq_val.shape[0]}")
+    print(f"🧪 Test samples: {X_seq_test.shape[0]}")
+
+    # Create and train model
+    print("🏗️ Building hybrid LSTM + feedforward model...")
+    model = create_continuous_prediction_model(len(seq_features), len(static_features))
+
+    # Training callbacks
+    callbacks = [
+        EarlyStopping(monitor='val_loss', patience=15, restore_best_weights=True, verbose=1),
+        ReduceLROnPlateau(monitor='val_loss', factor=0.7, patience=8, min_lr=1e-6, verbose=1),
+        ModelCheckpoint(checkpoint_path, monitor='val_loss', save_best_only=True, verbose=0),
+        ProgressCallback(progress, epochs)
+    ]
+
+    print("🎓 Training model with epochs...")
+    history = model.fit(
+        [X_seq_train, X_static_train], y_train,
+        validation_data=([X_seq_val, X_static_val], y_val),
+        epochs=epochs,
+        batch_size=64,
+        callbacks=callbacks,
+        verbose=1
+    )
+
+    # Evaluation
+    progress('evaluate')
+    print("📋 Evaluating model...")
+    y_pred = model.predict([X_seq_test, X_static_test], verbose=0).flatten()
+    mae = mean_absolute_error(y_test, y_pred)
+    r2 = r2_score(y_test, y_pred)
+
+    print(f"✅ Model Performance:")
+    print(f"   📉 MAE: {mae:.2f} days")
+    print(f"   📈 R²: {r2:.3f}")
+
+    # Save model artifacts
+    progress('save', evaluation={'mae': float(mae), 'r2': float(r2)})
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    model_filename = model_path
+    pickle_filename = artifacts_path
+
+    model.save(model_filename)
+
+    model_artifacts = {
+        'model_path': model_filename,
+        'sequence_scaler': seq_scaler,
+        'static_scaler': static_scaler,
+        'sequence_features': seq_features,
+        'static_features': static_features,
+        'timestamp': timestamp,
+        'model_version': '1.0',
+        'industries': ['IT', 'Finance', 'Healthcare', 'Retail', 'Manufacturing'],
+        'locations': ['Mumbai', 'Delhi', 'Bangalore', 'Chennai', 'Hyderabad'],
+        'payment_methods': ['Bank Transfer', 'Credit Card', 'Cheque', 'UPI'],
+        'segments': ['Reliable', 'Average', 'At-risk'],
+        'metrics': {'mae': float(mae), 'r2': float(r2)},
+        # Group statistics of the training data that serving looks the portfolio features up in
+        'portfolio_statistics': portfolio_statistics,
+        # Lets incremental retraining replay rows of this model's training data
+        'training_data': {'num_customers': num_customers, 'num_invoices': num_invoices, 'seed': seed}
+    }
+
+    with open(pickle_filename, 'wb') as f:
+        pickle.dump(model_artifacts, f)
+
+    export_numpy_weights(model_filename, npz_path)
+
+    print(f"✅ Model saved: {model_filename}")
+    print(f"✅ Artifacts saved: {pickle_filename}")
+    print(f"✅ NumPy weights exported: {npz_path}")
+    print("🎉 Model training completed!")
+
+    return model, model_artifacts
+
+def read_invoices(path):
+    """All rows of a CSV, Parquet or Arrow IPC invoice file with the generator's columns"""
+    from partitioned_features import read_invoice_chunks
+
+    return pd.concat(read_invoice_chunks(path, detect_format(path)), ignore_index=True)
+
+def rescale(matrix, from_scaler, to_scaler):
+    """Rows scaled by one fitted RobustScaler, re-expressed in another's scaling"""
+    raw = matrix * from_scaler.scale_ + from_scaler.center_
+    return ((raw - to_scaler.center_) / to_scaler.scale_).astype(FEATURE_DTYPE)
+
+def sample_rows(rows, count, rng):
+    """Sorted random subset of at most count row indices"""
+    return np.sort(rng.choice(rows, size=min(count, len(rows)), replace=False))
+
+def incremental_retrain(model_path, artifacts_path, npz_path, new_invoices_path, base_model_path,
+                        base_artifacts_path, since=None, epochs=5, replay_ratio=1.0, learning_rate=1e-4,
+                        max_mae_regression=0.0, seed=42, progress=None,
+                        feature_cache_dir=FEATURE_MATRIX_CACHE_DIR):
+    """Fine-tune the current model on new invoices plus replayed training rows; save it only if it is no worse
+
+    Invoices dated before `since` only give the newer ones their company
+    history and are not trained on. The new rows are split into train,
+    validation and test like a full run; `replay_ratio` old training rows
+    are mixed in per new training row so the model does not forget the
+    original data, and the holdout adds as many rows of the original test
+    split. The fine-tuned model is saved to model_path, artifacts_path and
+    npz_path only if its holdout MAE is at most `max_mae_regression` (a
+    fraction) worse than the current model's.
+
+    Returns (model, artifacts, promoted); artifacts carries the comparison.
+    """
+    from tensorflow.keras.models import load_model
+
+    progress = progress or (lambda phase, **info: None)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+    rng = np.random.default_rng(seed)
+
+    print("=" * 50)
+    print("🔁 INCREMENTAL RETRAINING FROM THE CURRENT MODEL")
+    print("=" * 50)
+
+    progress('load')
+    with open(base_artifacts_path, 'rb') as f:
+        base_artifacts = pickle.load(f)
+    seq_scaler, static_scaler = base_artifacts['sequence_scaler'], base_artifacts['static_scaler']
+    seq_features, static_features = base_artifacts['sequence_features'], base_artifacts['static_features']
+    statistics = base_artifacts.get('portfolio_statistics')
+    if statistics is None:
+        raise ValueError("The current model has no portfolio statistics to engineer new rows with; "
+                         "run a full retrain")
+    model = load_model(base_model_path, compile=False)
+
+    # New rows: engineered with their companies' history and the current model's portfolio
+    # statistics (which the fine-tuned model keeps and serves with), scaled with its scalers
+    progress('engineer')
+    print(f"🔧 Engineering features for {new_invoices_path}...")
+    df = engineer_continuous_features(read_invoices(new_invoices_path), statistics=statistics)
+    if since is not None:
+        df = df[df['InvoiceDate'] >= pd.Timestamp(since)]
+    missing = [col for col in seq_features + static_features if col not in df.columns]
+    if missing:
+        raise ValueError(f"The current model uses features the pipeline no longer builds: {', '.join(missing)}; "
+                         f"run a full retrain")
+    if len(df) < 10:
+        raise ValueError(f"Only {len(df)} new invoices to train on")
+    X_seq_new = transform_in_place(seq_scaler, feature_matrix(df, seq_features))
+    X_static_new = transform_in_place(static_scaler, feature_matrix(df, static_features))
+    y_new = df['DaysToPayment'].to_numpy(dtype=FEATURE_DTYPE)
+    del df
+    order, num_train, num_val = training_split_order(len(y_new), random_state=seed)
+    new_train, new_val, new_test = np.split(order, [num_train, num_train + num_val])
+    print(f"✅ {len(y_new)} new samples: {len(new_train)} train, {len(new_val)} validation, {len(new_test)} test")
+
+    # Replay rows: drawn from the training and test splits of the current model's own training data
+    progress('prepare')
+    training_data = base_artifacts.get('training_data', DEFAULT_TRAINING_DATA)
+    prepared, _ = load_or_prepare_training_data(training_data['num_customers'], training_data['num_invoices'],
+                                                training_data['seed'], feature_cache_dir)
+    X_seq_old, X_static_old, y_old, old_seq_scaler, old_static_scaler, old_seq_features, old_static_features = \
+        prepared
+    if old_seq_features != seq_features or old_static_features != static_features:
+        raise ValueError("The current model was trained on different features; run a full retrain")
+    order, num_train, num_val = training_split_order(len(y_old))
+    replay = sample_rows(order[:num_train + num_val], int(len(new_train) * replay_ratio), rng)
+    replay_test = sample_rows(order[num_train + num_val:], len(new_test), rng)
+
+    def old_rows(rows):
+        return (rescale(X_seq_old[rows], old_seq_scaler, seq_scaler),
+                rescale(X_static_old[rows], old_static_scaler, static_scaler), np.asarray(y_old[rows]))
+
+    replay_seq, replay_static, replay_y = old_rows(replay)
+    test_seq, test_static, test_y = old_rows(replay_test)
+    X_seq_train = np.concatenate([X_seq_new[new_train], replay_seq])
+    X_static_train = np.concatenate([X_static_new[new_train], replay_static])
+    y_train = np.concatenate([y_new[new_train], replay_y])
+    X_seq_test = np.concatenate([X_seq_new[new_test], test_seq])
+    X_static_test = np.concatenate([X_static_new[new_test], test_static])
+    y_test = np.concatenate([y_new[new_test], test_y])
+    print(f"📈 Fine-tuning on {len(y_train)} samples ({len(replay)} replayed); holdout {len(y_test)} samples")
+
+    # The current model's holdout error, before fitting changes its weights
+    base_pred = model.predict([X_seq_test, X_static_test], verbose=0).flatten()
+    base_mae = mean_absolute_error(y_test, base_pred)
+
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss=continuous_loss, metrics=['mae', 'mse'])
+    callbacks = [
+        EarlyStopping(monitor='val_loss', patience=2, restore_best_weights=True, verbose=1),
+        ProgressCallback(progress, epochs)
+    ]
+    print(f"🎓 Fine-tuning for up to {epochs} epochs...")
+    model.fit(
+        [X_seq_train, X_static_train], y_train,
+        validation_data=([X_seq_new[new_val], X_static_new[new_val]], y_new[new_val]),
+        epochs=epochs,
+        batch_size=64,
+        callbacks=callbacks,
+        verbose=1
+    )
+
+    progress('evaluate')
+    y_pred = model.predict([X_seq_test, X_static_test], verbose=0).flatten()
+    mae = mean_absolute_error(y_test, y_pred)
+    r2 = r2_score(y_test, y_pred)
+    new_rows = slice(0, len(new_test))
+    comparison = {
+        'base_mae': float(base_mae),
+        'mae': float(mae),
+        'new_rows_base_mae': float(mean_absolute_error(y_test[new_rows], base_pred[new_rows])),
+        'new_rows_mae': float(mean_absolute_error(y_test[new_rows], y_pred[new_rows]))
+    }
+    promoted = mae <= base_mae * (1 + max_mae_regression)
+    print(f"✅ Holdout MAE: {base_mae:.2f} -> {mae:.2f} days "
+          f"(new invoices {comparison['new_rows_base_mae']:.2f} -> {comparison['new_rows_mae']:.2f})")
+
+    artifacts = dict(base_artifacts, metrics={'mae': float(mae), 'r2': float(r2)},
+                     timestamp=datetime.now().strftime("%Y%m%d_%H%M%S"), model_path=model_path,
+                     training_data=training_data,
+                     incremental={'new_invoices': len(y_new), 'replayed': len(replay), 'since': since,
+                                  'comparison': comparison})
+    if not promoted:
+        print("❌ Fine-tuned model regressed on the holdout; keeping the current model")
+        return model, artifacts, False
+
+    progress('save', evaluation={'mae': float(mae), 'r2': float(r2), 'base_mae': float(base_mae)})
+    model.save(model_path)
+    with open(artifacts_path, 'wb') as f:
+        pickle.dump(artifacts, f)
+    export_numpy_weights(model_path, npz_path)
+    print(f"✅ Model saved: {model_path}")
+    print("🎉 Incremental retraining completed!")
+    return model, artifacts, True
@@ -0,0 +1,272 @@
+"""Background training jobs.
+
+Each job runs training.train_model (training.incremental_retrain for mode
+'incremental') in its own spawned process at a lower CPU priority, writing
+its artifacts into a private staging directory. The child streams
+phase/epoch events back over a queue; the parent tracks them per job and,
+once the job completes, hands the staging directory to an on_complete
+callback that installs and activates the new model. An incremental job
+whose model regresses ends 'rejected' and installs nothing.
+
+Job state is also written to TRAINING_JOBS_DIR/<job_id>.json and the
+one-job-at-a-time rule is an flock on TRAINING_JOBS_DIR/.lock, so every
+worker process of a multi-process server sees and can cancel the same jobs.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): only jobs of this process are serialised
+    fcntl = None
+
+# Niceness added to training processes so serving keeps the CPU
+TRAINING_NICENESS = 10
+
+# File names inside a job's staging directory
+STAGED_MODEL = 'payment_prediction_model.h5'
+STAGED_ARTIFACTS = 'payment_prediction_model.pkl'
+STAGED_NPZ = 'payment_prediction_model.npz'
+STAGED_CHECKPOINT = 'best_model_temp.h5'
+
+ACTIVE_STATUSES = ('queued', 'running', 'installing')
+
+def _run_training_process(job_dir, params, events):
+    """Entry point of the training process"""
+    try:
+        os.nice(TRAINING_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+    try:
+        import training
+
+        def progress(phase, **info):
+            events.put(('progress', phase, info))
+
+        params = dict(params)
+        staged = (os.path.join(job_dir, STAGED_MODEL), os.path.join(job_dir, STAGED_ARTIFACTS),
+                  os.path.join(job_dir, STAGED_NPZ))
+        if params.pop('mode', 'full') == 'incremental':
+            _, artifacts, promoted = training.incremental_retrain(*staged, progress=progress, **params)
+            evaluation = dict(artifacts['metrics'], **artifacts['incremental']['comparison'])
+            if not promoted:
+                events.put(('rejected', 'done', {'evaluation': evaluation}))
+                return
+        else:
+            _, artifacts = training.train_model(
+                *staged,
+                progress=progress,
+                checkpoint_path=os.path.join(job_dir, STAGED_CHECKPOINT),
+                **params
+            )
+            evaluation = artifacts['metrics']
+        events.put(('completed', 'done', {'evaluation': evaluation}))
+    except Exception as e:
+        events.put(('failed', 'error', {'error': str(e)}))
+
+class TrainingJob:
+    """State of one background training run"""
+
+    def __init__(self, job_id, params, job_dir):
+        self.job_id = job_id
+        self.params = params
+        self.job_dir = job_dir
+        self.status = 'queued'
+        self.phase = None
+        self.epoch = None
+        self.epochs = None
+        self.metrics = {}
+        self.evaluation = {}
+        self.error = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.process = None
+
+    def to_dict(self):
+        return {
+            'jobId': self.job_id,
+            'status': self.status,
+            'pid': self.process.pid if self.process else None,
+            'phase': self.phase,
+            'epoch': self.epoch,
+            'epochs': self.epochs,
+            'metrics': self.metrics,
+            'evaluation': self.evaluation,
+            'params': self.params,
+            'error': self.error,
+            'createdAt': self.created_at.isoformat(),
+            'finishedAt': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class TrainingJobManager:
+    """Starts, tracks and cancels background training jobs, one at a time"""
+
+    def __init__(self, work_dir, on_complete):
+        self.work_dir = work_dir
+        self.on_complete = on_complete
+        # Jobs started by this process; other workers' jobs are read from their state files
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context('spawn')
+
+    def active_job(self):
+        return next((job for job in self.jobs.values() if job.status in ACTIVE_STATUSES), None)
+
+    def start(self, params):
+        """Start a training job; raises RuntimeError if one is already running"""
+        with self._lock:
+            if self.active_job():
+                raise RuntimeError(f"Training job {self.active_job().job_id} is already running")
+            os.makedirs(self.work_dir, exist_ok=True)
+            lock_file = self._acquire_work_dir_lock()
+
+            job_id = uuid.uuid4().hex[:12]
+            job_dir = os.path.join(self.work_dir, job_id)
+            job = TrainingJob(job_id, params, job_dir)
+
+            events = self._context.Queue()
+            job.process = self._context.Process(
+                target=_run_training_process, args=(job_dir, params, events),
+                name=f'training-{job_id}', daemon=True
+            )
+            try:
+                os.makedirs(job_dir)
+                job.process.start()
+            except Exception:
+                if lock_file is not None:
+                    lock_file.close()
+                raise
+            job.status = 'running'
+            self.jobs[job_id] = job
+            self._save(job)
+
+        threading.Thread(target=self._monitor, args=(job, events, lock_file), daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        """State dict of a job started by any worker, or None"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list_jobs(self):
+        """State dicts of all jobs in the work directory, oldest first"""
+        if not os.path.isdir(self.work_dir):
+            return []
+        job_ids = [name[:-len('.json')] for name in os.listdir(self.work_dir) if name.endswith('.json')]
+        jobs = [job for job in map(self.get, job_ids) if job is not None]
+        return sorted(jobs, key=lambda job: job['createdAt'])
+
+    def cancel(self, job_id):
+        """Stop a running job; returns False if it is not running"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            # Started by another worker: its monitor sees the SIGTERM exit code
+            state = self.get(job_id)
+            if state is None or state['status'] != 'running' or not state['pid']:
+                return False
+            try:
+                os.kill(state['pid'], signal.SIGTERM)
+            except OSError:
+                return False
+            return True
+        if job.status != 'running':
+            return False
+        job.status = 'cancelled'
+        self._save(job)
+        job.process.terminate()
+        return True
+
+    def shutdown(self):
+        """Cancel this process's running job, e.g. when its server worker exits"""
+        job = self.active_job()
+        if job is not None:
+            self.cancel(job.job_id)
+
+    def _acquire_work_dir_lock(self):
+        """Exclusive flock held for a job's lifetime; raises RuntimeError if another worker holds it"""
+        if fcntl is None:
+            return None
+        lock_file = open(os.path.join(self.work_dir, '.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError("A training job started by another worker is already running")
+        return lock_file
+
+    def _state_path(self, job_id):
+        return os.path.join(self.work_dir, f'{job_id}.json')
+
+    def _save(self, job):
+        """Write the job's state file atomically"""
+        path = self._state_path(job.job_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(path + '.tmp', path)
+
+    def _monitor(self, job, events, lock_file):
+        status, error = 'failed', None
+        while True:
+            try:
+                kind, phase, info = events.get(timeout=1)
+            except Exception:
+                if job.process.is_alive():
+                    continue
+                # The process exited without a final event: cancelled or crashed
+                if job.process.exitcode == -signal.SIGTERM:
+                    job.status = 'cancelled'
+                error = f'Training process exited with code {job.process.exitcode}'
+                break
+
+            if kind == 'progress':
+                job.phase = phase
+                job.epoch = info.get('epoch', job.epoch)
+                job.epochs = info.get('epochs', job.epochs)
+                job.metrics = info.get('metrics', job.metrics)
+                job.evaluation = info.get('evaluation', job.evaluation)
+                self._save(job)
+                continue
+
+            if kind == 'failed':
+                error = info['error']
+            elif kind == 'rejected':
+                # Incremental retrain whose model regressed: nothing to install
+                job.evaluation = info['evaluation']
+                status = 'rejected'
+                error = (f"Fine-tuned model not promoted: holdout MAE {job.evaluation['mae']:.2f} "
+                         f"vs {job.evaluation['base_mae']:.2f} for the current model")
+            elif job.status != 'cancelled':
+                job.evaluation = info['evaluation']
+                job.status = 'installing'
+                job.phase = 'activate'
+                self._save(job)
+                try:
+                    self.on_complete(job)
+                    status = 'completed'
+                except Exception as e:
+                    error = f'Failed to activate trained model: {e}'
+            break
+
+        job.process.join()
+        shutil.rmtree(job.job_dir, ignore_errors=True)
+        job.finished_at = datetime.now()
+        if job.status != 'cancelled':
+            job.status, job.error = status, error
+        self._save(job)
+        if lock_file is not None:
+            lock_file.close()